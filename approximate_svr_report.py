@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import glob
+import time
+import contextlib
+
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from putemg_features import biolab_utilities
+
+from experiment_config import ExperimentConfig
+import feature_store
+from force_learn_tasks import SplitData, SharedArrays, column_positions
+import regressors
+from regressors import APPROXIMATE_SVR
+from subject_loader import SubjectLoader
+from script_utilities import pop_option, pop_flag
+
+
+# approximate SVR settings used if experiment config does not define ASVR regressor
+DEFAULT_APPROXIMATE_ARGS = {"approximation": "nystroem", "n_components": 500, "gamma": "scale", "C": 1.0,
+                            "epsilon": 0.1, "batch_size": 1024, "epochs": 5, "random_state": 0}
+
+
+def usage():
+    print()
+    print('Compares accuracy and fit time of exact RBF SVR and approximate kernel SVR (ASVR) on force learn splits')
+    print()
+    print('Usage: {:s} [options] <putEMG_HDF5_feature_folder> <output_csv>'.format(os.path.basename(__file__)))
+    print()
+    print('Arguments:')
+    print('    <putEMG_HDF5_feature_folder>     URL to a folder containing HDF5 files with features or columnar '
+          'feature store')
+    print('    <output_csv>                     URL to a CSV file for saving the report')
+    print()
+    print('Options:')
+    print('    --config <xml>                   experiment config, SVR and ASVR regressor settings are taken from it, '
+          'default force_learn_config.xml')
+    print('    --subjects <N>                   number of subjects compared, default 3')
+    print('    --feature-set <name>             feature set of experiment config, default TimeDomain')
+    print('    --trajectory <name>              trajectory of experiment config, default the first one')
+    print('    --n-components <N>               overrides number of components of kernel approximation')
+    print('    --approximation <nystroem|rff>   overrides kernel approximation method')
+    print('    --cross-subject                  also train ASVR on all but the last subject and test on the last one, '
+          'each subject is loaded once, train data is memory-mapped and fitted in mini-batches')
+    print()
+    print('Example:')
+    print('{:s} --subjects 5 ../putEMG/Data-HDF5-filtered-feature asvr_report.csv'.format(os.path.basename(__file__)))
+    exit(1)
+
+
+def fit_and_score(settings: Dict[str, any], train_x: pd.DataFrame, train_y: pd.DataFrame, test_x: pd.DataFrame,
+                  test_y: pd.DataFrame) -> Tuple[float, float]:
+    """Returns RMSE on test data and fit time of regressor with given settings"""
+    start = time.time()
+    pipeline = regressors.prepare_pipeline(train_x, train_y, predictor=settings["predictor"], norm_per_feature=False,
+                                           **settings["args"])
+    fit_time = time.time() - start
+    return regressors.rmse(test_y.values, pipeline.predict(test_x)), fit_time
+
+
+if __name__ == '__main__':
+    if '-h' in sys.argv or '--help' in sys.argv:
+        usage()
+
+    config_file = pop_option(sys.argv, '--config', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                'force_learn_config.xml'))
+    subject_count = pop_option(sys.argv, '--subjects', 3, int)
+    feature_set = pop_option(sys.argv, '--feature-set', 'TimeDomain')
+    trajectory = pop_option(sys.argv, '--trajectory', None)
+    n_components = pop_option(sys.argv, '--n-components', None, int)
+    approximation = pop_option(sys.argv, '--approximation', None)
+    cross_subject = pop_flag(sys.argv, '--cross-subject')
+
+    if len(sys.argv) != 3:
+        print('Illegal number of parameters')
+        usage()
+
+    input_folder = os.path.abspath(sys.argv[1])
+    if not os.path.isdir(input_folder):
+        print('{:s} is not a valid folder'.format(input_folder))
+        usage()
+    output_file = os.path.abspath(sys.argv[2])
+
+    config = ExperimentConfig(config_file)
+    if feature_set not in config.feature_sets:
+        print('Unknown feature set - {:s}'.format(feature_set))
+        usage()
+    trajectory = trajectory if trajectory is not None else list(config.trajectories)[0]
+    if trajectory not in config.trajectories:
+        print('Unknown trajectory - {:s}'.format(trajectory))
+        usage()
+
+    exact = config.regressors.get("SVR")
+    if exact is None:
+        print('Experiment config does not define SVR regressor')
+        exit(1)
+    approximate = config.regressors.get(APPROXIMATE_SVR, {"predictor": APPROXIMATE_SVR,
+                                                          "args": dict(DEFAULT_APPROXIMATE_ARGS)})
+    approximate = {"predictor": APPROXIMATE_SVR, "args": dict(approximate["args"])}
+    if n_components is not None:
+        approximate["args"]["n_components"] = n_components
+    if approximation is not None:
+        approximate["args"]["approximation"] = approximation
+
+    if feature_store.is_feature_store(input_folder):
+        all_files = [f for f in feature_store.list_feature_files(input_folder) if not ("bias" in f or "mvc" in f)]
+    else:
+        all_files = [f for f in sorted(glob.glob(os.path.join(input_folder, "*.hdf5")))
+                     if not ("bias" in f or "mvc" in f)]
+    all_records = [biolab_utilities.Record(os.path.basename(f)) for f in all_files]
+    record_files = dict(zip(all_records, all_files))
+    subjects = sorted(set(r.id for r in all_records))[:subject_count]
+
+    features = config.feature_sets[feature_set]
+    channel_range = config.channel_ranges[feature_set]
+    fingers = config.trajectories[trajectory]
+    loader = SubjectLoader(lambda f: feature_store.select_columns(feature_store.feature_columns(f), features,
+                                                                  channel_range))
+
+    def subject_splits(subject) -> Dict[str, List[SplitData]]:
+        """Returns data of each split of each day of a subject, only a single subject is loaded at once"""
+        records = biolab_utilities.record_filter(all_records, whitelists={"id": [subject]})
+        dfs = loader.load({r: record_files[r] for r in records})
+        splits = biolab_utilities.data_per_id_and_date(records, n_splits=config.n_splits)
+        return {id_: [SplitData(dfs, s, features, config.force_feature, fingers) for s in id_splits]
+                for id_, id_splits in splits.items()}
+
+    def split_columns(split_data: SplitData) -> Tuple[List[int], List[int]]:
+        return column_positions(split_data.input_columns(features, channel_range)), split_data.output_columns(fingers)
+
+    def subject_data(splits_per_id: Dict[str, List[SplitData]]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Returns inputs and outputs of all days of a subject, train and test part of the first split"""
+        xs, ys = list(), list()
+        for splits in splits_per_id.values():
+            inputs, outputs = split_columns(splits[0])
+            for x, y in ((splits[0].train_x, splits[0].train_y), (splits[0].test_x, splits[0].test_y)):
+                xs.append(x.iloc[:, inputs])
+                ys.append(y.iloc[:, column_positions(outputs)])
+        return pd.concat(xs), pd.concat(ys)
+
+    cross_subject = cross_subject and len(subjects) > 1
+    # cross-subject train data is appended to scratch files as each subject is loaded, and memory-mapped for fitting
+    scratch = SharedArrays() if cross_subject else None
+    cross_columns: Tuple[List[str], List[str]] = None
+    cross_rows = 0
+    cross_test: Tuple[pd.DataFrame, pd.DataFrame] = None
+
+    with scratch if scratch is not None else contextlib.nullcontext():
+        rows: List[Dict[str, any]] = list()
+        for subject in subjects:
+            splits_per_id = subject_splits(subject)
+            for id_, splits in splits_per_id.items():
+                for i_s, split_data in enumerate(splits):
+                    inputs, outputs = split_columns(split_data)
+                    train_x, test_x = split_data.train_x.iloc[:, inputs], split_data.test_x.iloc[:, inputs]
+                    train_y, test_y = split_data.train_y.iloc[:, outputs], split_data.test_y.iloc[:, outputs]
+
+                    exact_rmse, exact_fit = fit_and_score(exact, train_x, train_y, test_x, test_y)
+                    approximate_rmse, approximate_fit = fit_and_score(approximate, train_x, train_y, test_x, test_y)
+
+                    rows.append({"id": id_, "split": i_s, "train_samples": len(train_x),
+                                 "svr_rmse": exact_rmse, "asvr_rmse": approximate_rmse,
+                                 "svr_fit_time": exact_fit, "asvr_fit_time": approximate_fit})
+                    print('\t{:s} split {:d} ({:d} samples): SVR rmse {:.4f} fit {:.1f}s, ASVR rmse {:.4f} fit {:.1f}s'
+                          .format(id_, i_s, len(train_x), exact_rmse, exact_fit, approximate_rmse, approximate_fit),
+                          flush=True)
+
+            if cross_subject:
+                x, y = subject_data(splits_per_id)
+                if subject == subjects[-1]:
+                    cross_test = x, y
+                    continue
+                if cross_columns is None:
+                    cross_columns = list(x.columns), list(y.columns)
+                elif (list(x.columns), list(y.columns)) != cross_columns:
+                    print('Columns of subject {:s} differ from previous subjects, cross-subject ASVR is not possible'
+                          .format(str(subject)))
+                    exit(1)
+                for values, name in ((x.values, 'x'), (y.values, 'y')):
+                    with open(os.path.join(scratch.folder, name + '.bin'), 'ab') as f:
+                        np.ascontiguousarray(values, dtype=np.float64).tofile(f)
+                cross_rows += len(x)
+
+        report = pd.DataFrame(rows)
+        report["fit_speedup"] = report["svr_fit_time"] / report["asvr_fit_time"]
+        report["rmse_difference"] = report["asvr_rmse"] - report["svr_rmse"]
+        report.to_csv(output_file, index=False)
+
+        print()
+        print(report[["train_samples", "svr_rmse", "asvr_rmse", "rmse_difference", "svr_fit_time", "asvr_fit_time",
+                      "fit_speedup"]].mean().to_string())
+        print('Report written to {:s}'.format(output_file))
+
+        if cross_subject:
+            train_subjects, test_subject = subjects[:-1], subjects[-1]
+            print()
+            print('Cross-subject ASVR: training on {:d} subjects, testing on subject {:s}'.format(
+                len(train_subjects), str(test_subject)), flush=True)
+
+            # train data of all subjects is memory-mapped, ASVR reads it in mini-batches (see ApproximateKernelSVR)
+            x, y = [pd.DataFrame(np.memmap(os.path.join(scratch.folder, name + '.bin'), dtype=np.float64, mode='r',
+                                           shape=(cross_rows, len(columns))), columns=columns, copy=False)
+                    for name, columns in zip(('x', 'y'), cross_columns)]
+            cross_rmse, fit_time = fit_and_score(approximate, x, y, *cross_test)
+            del x, y
+            print('Cross-subject ASVR: {:d} train samples, rmse {:.4f}, fit {:.1f}s'.format(
+                cross_rows, cross_rmse, fit_time))
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+
+from typing import Dict, List, Callable
+
+import numpy as np
+import pandas as pd
+
+from putemg_features import biolab_utilities
+
+import feature_engine
+from experiment_config import ExperimentConfig
+from force_learn_tasks import SplitData
+from mvc_index import MVCIndex
+import regressors
+import result_stats
+import synthetic_data
+from script_utilities import pop_option, pop_flag
+
+
+def usage():
+    print()
+    print('Times all pipeline stages on synthetic putEMG-shaped recordings and compares them with a saved baseline')
+    print('Features are timed with both engines, putemg_features (default) and batched, as separate stages')
+    print()
+    print('Usage: {:s} [options] <feature_config_xml> <experiment_config_xml>'.format(os.path.basename(__file__)))
+    print()
+    print('Arguments:')
+    print('    <feature_config_xml>            XML file containing feature descriptors, eg. force_features.xml')
+    print('    <experiment_config_xml>         force learn experiment config, eg. force_learn_config.xml')
+    print()
+    print('Options:')
+    print('    --subjects <N>                  number of generated subjects, each with a single day, default 2')
+    print('    --duration <s>                  duration of each generated trial in seconds, default 60')
+    print('    --seed <N>                      random seed of generated data, default 0')
+    print('    --repeat <N>                    number of timed repetitions, best time is reported, default 3')
+    print('    --data <folder>                 keep generated recordings in folder, reused if already generated')
+    print('    --save <json>                   save timings as new baseline')
+    print('    --baseline <json>               compare timings with baseline, exit code 1 on regression')
+    print('    --tolerance <ratio>             relative slowdown reported as regression, default 0.2')
+    print('    --quick                         only the first regressor of experiment config is timed')
+    print()
+    print('Example:')
+    print('{:s} --baseline benchmark_baseline.json force_features.xml force_learn_config.xml'.
+          format(os.path.basename(__file__)))
+    exit(1)
+
+
+def best_time(function: Callable[[], any], repeat: int) -> float:
+    """Returns shortest execution time of a function"""
+    times = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def environment() -> Dict[str, str]:
+    """Returns description of machine and library versions timings were measured with"""
+    return {"python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+            "machine": platform.machine(), "processor": platform.processor(), "cpus": str(os.cpu_count())}
+
+
+def compare(stages: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    """Prints timings next to baseline, returns names of stages slower than baseline by more than tolerance"""
+    print('{:<36s} {:>12s} {:>12s} {:>8s}'.format('Stage', 'baseline[s]', 'current[s]', 'ratio'))
+    regressions = list()
+    for name, seconds in stages.items():
+        if name not in baseline:
+            print('{:<36s} {:>12s} {:>12.4f} {:>8s}'.format(name, '-', seconds, 'new'))
+            continue
+        ratio = seconds / baseline[name] if baseline[name] > 0 else float('inf')
+        status = ''
+        if ratio > 1.0 + tolerance:
+            status = 'SLOWER'
+            regressions.append(name)
+        elif ratio < 1.0 / (1.0 + tolerance):
+            status = 'faster'
+        print('{:<36s} {:>12.4f} {:>12.4f} {:>7.2f}x {:s}'.format(name, baseline[name], seconds, ratio, status))
+    return regressions
+
+
+if __name__ == '__main__':
+    if '-h' in sys.argv or '--help' in sys.argv:
+        usage()
+
+    subjects = pop_option(sys.argv, '--subjects', 2, int)
+    duration = pop_option(sys.argv, '--duration', 60.0, float)
+    seed = pop_option(sys.argv, '--seed', 0, int)
+    repeat = pop_option(sys.argv, '--repeat', 3, int)
+    data_folder = pop_option(sys.argv, '--data', None, os.path.abspath)
+    save_file = pop_option(sys.argv, '--save', None)
+    baseline_file = pop_option(sys.argv, '--baseline', None)
+    tolerance = pop_option(sys.argv, '--tolerance', 0.2, float)
+    quick = pop_flag(sys.argv, '--quick')
+
+    if len(sys.argv) != 3:
+        print('Illegal number of parameters')
+        usage()
+
+    feature_config = feature_engine.FeatureConfig(os.path.abspath(sys.argv[1]))
+    experiment = ExperimentConfig(os.path.abspath(sys.argv[2]))
+
+    parameters = {"subjects": subjects, "duration": duration, "seed": seed, "repeat": repeat, "quick": quick}
+    stages: Dict[str, float] = dict()
+
+    folder = data_folder if data_folder is not None else tempfile.mkdtemp(prefix='putemg_benchmark_')
+    try:
+        if not os.path.isdir(folder) or not any(f.endswith('.hdf5') for f in os.listdir(folder)):
+            print('Generating {:d} subjects, {:.0f} s trials in {:s}'.format(subjects, duration, folder), flush=True)
+            synthetic_data.generate(folder, subjects, duration, seed)
+
+        trial_files = sorted(os.path.join(folder, f) for f in os.listdir(folder)
+                             if f.endswith('.hdf5') and '-mvc-' not in f)
+        mvc_index = MVCIndex(folder)
+        raw = {f: pd.read_hdf(f) for f in trial_files}
+        raw_mvc = {f: pd.read_hdf(mvc_index.find(os.path.basename(f))) for f in trial_files}
+
+        # filtering is in place, each repetition works on a fresh copy, time of copying is excluded
+        def filter_all():
+            copies = {f: df.copy() for f, df in raw.items()}
+            start = time.perf_counter()
+            for df in copies.values():
+                biolab_utilities.apply_filter(df)
+            return time.perf_counter() - start, copies
+
+        print('Timing apply_filter', flush=True)
+        timings = [filter_all() for _ in range(repeat)]
+        stages["apply_filter"] = min(t for t, _ in timings)
+        filtered = timings[-1][1]
+        filtered_mvc = dict()
+        for f, mvc in raw_mvc.items():
+            filtered_mvc[f] = mvc.copy()
+            biolab_utilities.apply_filter(filtered_mvc[f])
+
+        print('Timing normalise_force_data', flush=True)
+        stages["normalise_force_data"] = best_time(
+            lambda: [biolab_utilities.normalise_force_data(filtered[f], filtered_mvc[f]) for f in trial_files], repeat)
+        records = {f: biolab_utilities.normalise_force_data(filtered[f], filtered_mvc[f]) for f in trial_files}
+
+        # putemg_features is the default engine of process_recordings.py, batched engine is its --batched option
+        for engine, batched in (('putemg_features', False), ('batched', True)):
+            print('Timing features ({:s})'.format(engine), flush=True)
+            for feature in feature_config.all_features():
+                stages["feature {:s} ({:s})".format(feature.name, engine)] = best_time(
+                    lambda: [feature_engine.features_from_config_on_df(feature_config, records[f], [feature], batched)
+                             for f in trial_files], repeat)
+            stages["features all ({:s})".format(engine)] = best_time(
+                lambda: [feature_engine.features_from_config_on_df(feature_config, records[f], batched=batched)
+                         for f in trial_files], repeat)
+
+        # feature DataFrames as read by force_learn.py, named after feature files
+        dfs = {biolab_utilities.Record(os.path.splitext(os.path.basename(f))[0] + '_filtered_features.hdf5'):
+               feature_engine.features_from_config_on_df(feature_config, records[f]) for f in trial_files}
+        del raw, filtered, records
+
+        print('Timing prepare_force_data', flush=True)
+        first_subject = sorted(set(r.id for r in dfs))[0]
+        subject_records = biolab_utilities.record_filter(list(dfs), whitelists={"id": [first_subject]})
+        splits = biolab_utilities.data_per_id_and_date(subject_records, n_splits=experiment.n_splits)
+        split = list(splits.values())[0][0]
+
+        all_features = sorted(set(f for features in experiment.feature_sets.values() for f in features))
+        all_fingers = sorted(set(f for trajectory in experiment.trajectories.values() for f in trajectory))
+        stages["prepare_force_data"] = best_time(
+            lambda: SplitData(dfs, split, all_features, experiment.force_feature, all_fingers), repeat)
+        split_data = SplitData(dfs, split, all_features, experiment.force_feature, all_fingers)
+
+        # regressors are timed on the largest feature set and the first trajectory of experiment config
+        feature_set = max(experiment.feature_sets, key=lambda name: len(experiment.feature_sets[name]))
+        trajectory = list(experiment.trajectories)[0]
+        input_columns = split_data.input_columns(experiment.feature_sets[feature_set],
+                                                 experiment.channel_ranges[feature_set])
+        output_columns = split_data.output_columns(experiment.trajectories[trajectory])
+        train_x = split_data.train_x.iloc[:, input_columns]
+        train_y = split_data.train_y.iloc[:, output_columns]
+        test_x = split_data.test_x.iloc[:, input_columns]
+        test_y = split_data.test_y.iloc[:, output_columns]
+
+        predictions = list()
+        for reg_id, reg_settings in list(experiment.regressors.items())[:1 if quick else None]:
+            print('Timing {:s} on {:s} feature set, {:d} train samples'.format(reg_id, feature_set, len(train_x)),
+                  flush=True)
+            pipelines = list()
+            stages["fit " + reg_id] = best_time(
+                lambda: pipelines.append(regressors.prepare_pipeline(
+                    train_x, train_y, predictor=reg_settings["predictor"], norm_per_feature=False,
+                    **reg_settings["args"])), repeat)
+            stages["predict " + reg_id] = best_time(lambda: pipelines[-1].predict(test_x), repeat)
+            predictions.append(pipelines[-1].predict(test_x))
+
+        print('Timing stats aggregation', flush=True)
+        stages["error_metrics"] = best_time(
+            lambda: [result_stats.error_metrics(test_y.values, p) for p in predictions], repeat)
+    finally:
+        if data_folder is None:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    print()
+    result = {"parameters": parameters, "environment": environment(), "stages": stages}
+
+    regressions = list()
+    if baseline_file is not None:
+        with open(baseline_file, 'r') as f:
+            baseline = json.load(f)
+        if baseline["parameters"] != parameters:
+            print('Warning: baseline was measured with different parameters: {:s}'.format(str(baseline["parameters"])))
+        if baseline["environment"] != result["environment"]:
+            print('Warning: baseline was measured in different environment: {:s}'.format(
+                str(baseline["environment"])))
+        regressions = compare(stages, baseline["stages"], tolerance)
+    else:
+        for name, seconds in stages.items():
+            print('{:<36s} {:>12.4f}'.format(name, seconds))
+
+    if save_file is not None:
+        with open(save_file, 'w') as f:
+            json.dump(result, f, indent=2)
+        print('Baseline saved to {:s}'.format(save_file))
+
+    if regressions:
+        print('Slower than baseline by more than {:.0f}%: {:s}'.format(tolerance * 100, ', '.join(regressions)))
+        exit(1)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import glob
+
+import pandas as pd
+
+import feature_store
+
+
+def usage():
+    print()
+    print('Converts folder of HDF5 feature files to columnar feature store partitioned by subject id and date')
+    print()
+    print('Usage: {:s} <input_hdf5_feature_folder> <output_store_folder>'.format(os.path.basename(__file__)))
+    print()
+    print('Arguments:')
+    print('    <input_hdf5_feature_folder>     HDF5 folder containing calculated feature data')
+    print('    <output_store_folder>           output folder of columnar feature store')
+    print()
+    print('Example:')
+    print('{:s} ../putEMG/Data-HDF5-filtered-feature ../putEMG/Data-filtered-feature-store'.
+          format(os.path.basename(__file__)))
+    exit(1)
+
+
+if __name__ == '__main__':
+    if '-h' in sys.argv or '--help' in sys.argv:
+        usage()
+
+    if len(sys.argv) != 3:
+        print('Illegal number of parameters')
+        usage()
+
+    input_folder = os.path.abspath(sys.argv[1])
+    if not os.path.isdir(input_folder):
+        print('{:s} is not a valid folder'.format(input_folder))
+        usage()
+
+    output_folder = os.path.abspath(sys.argv[2])
+
+    all_files = [f for f in sorted(glob.glob(os.path.join(input_folder, "*.hdf5")))]
+
+    for file in all_files:
+        output_file = feature_store.partition_path(output_folder, file)
+
+        if os.path.isfile(output_file) and os.path.getmtime(output_file) > os.path.getmtime(file):
+            print('Skipping already converted file: {:s}'.format(os.path.basename(file)))
+            continue
+
+        print('Converting {:s} to {:s}'.format(os.path.basename(file), os.path.relpath(output_file, output_folder)))
+        feature_store.write_features(pd.DataFrame(pd.read_hdf(file)), output_file)
@@ -0,0 +1,117 @@
+import ast
+import json
+import hashlib
+import itertools
+import xml.etree.ElementTree as ET
+
+from typing import Dict, List, Tuple
+
+
+def parse_value(text: str) -> any:
+    """Returns Python literal of XML attribute value (eg. 1.0, None, (200, )), other text is returned as string"""
+    try:
+        return ast.literal_eval(text.strip())
+    except (ValueError, SyntaxError):
+        return text.strip()
+
+
+def parse_list(text: str) -> List[any]:
+    """Returns values of comma separated XML attribute, eg. "0.5, 1.0, 2.0" or "ZC, WAMP" """
+    value = parse_value(text)
+    if isinstance(value, tuple):
+        return list(value)
+    if isinstance(value, str):
+        return [v.strip() for v in value.split(',') if v.strip()]
+    return [value]
+
+
+def sweep_name(name: str, swept: Dict[str, any]) -> str:
+    """Returns name of regressor with given swept argument values, eg. SVR[C=0.5,epsilon=0.1]"""
+    if not swept:
+        return name
+    return name + '[' + ','.join('{:s}={:s}'.format(k, str(v)) for k, v in swept.items()) + ']'
+
+
+def settings_hash(settings: Dict[str, any], trajectory: str, feature_set: str, reg: str, force_feature: str,
+                  multi_output: bool = False) -> str:
+    """Returns hash of all settings a result of a task depends on - features and channels of its feature set, fingers
+    of its trajectory (of all trajectories for multi-output regressor), regressor arguments, force feature and number
+    of splits
+
+    Settings are given as experiment settings saved with results - dicts "trajectories", "feature_sets",
+    "channel_ranges", "regressors" and "n_splits", missing entries are hashed as None.
+    """
+    trajectories = settings.get("trajectories", dict())
+    described = {"features": settings.get("feature_sets", dict()).get(feature_set),
+                 "channel_range": settings.get("channel_ranges", dict()).get(feature_set),
+                 "fingers": trajectories if multi_output else trajectories.get(trajectory),
+                 "regressor": settings.get("regressors", dict()).get(reg),
+                 "force_feature": force_feature, "n_splits": settings.get("n_splits")}
+    return hashlib.sha1(json.dumps(described, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ExperimentConfig:
+    """Force learn experiment parsed from XML file (eg. force_learn_config.xml), with band and hyperparameter
+    sweeps expanded to feature sets and regressors of the same structure as used by force_learn.py"""
+
+    def __init__(self, xml_file_url: str):
+        root = ET.parse(xml_file_url).getroot()
+
+        self.n_splits = int(root.find('splits').get('n_splits'))
+        self.force_feature = root.find('force_feature').get('name')
+
+        bands = [(b.get('name'), {"begin": int(b.get('begin')), "end": int(b.get('end'))})
+                 for b in root.find('bands').findall('band')]
+        if not bands:
+            raise ValueError('At least one channel band has to be defined in {:s}'.format(xml_file_url))
+
+        # feature set name -> list of features and feature set name -> channel range, for each band
+        self.feature_sets: Dict[str, List[str]] = dict()
+        self.channel_ranges: Dict[str, Dict[str, int]] = dict()
+        for band_name, channel_range in bands:
+            for f in root.find('feature_sets').findall('feature_set'):
+                name = f.get('name') if len(bands) == 1 else f.get('name') + '_' + band_name
+                self.feature_sets[name] = [str(v) for v in parse_list(f.get('features'))]
+                self.channel_ranges[name] = channel_range
+
+        self.trajectories: Dict[str, List[int]] = {t.get('name'): [int(v) for v in parse_list(t.get('fingers'))]
+                                                   for t in root.find('trajectories').findall('trajectory')}
+
+        self.regressors: Dict[str, Dict[str, any]] = dict()
+        for r in root.find('regressors').findall('regressor'):
+            for name, settings in self._expand(r):
+                # the same settings reached through different sweeps are fitted only once
+                if settings not in self.regressors.values():
+                    self.regressors[name] = settings
+
+    @staticmethod
+    def _expand(regressor: ET.Element) -> List[Tuple[str, Dict[str, any]]]:
+        """Returns (name, settings) of every combination of swept arguments of a <regressor> entry"""
+        fixed: Dict[str, any] = dict()
+        swept: Dict[str, List[any]] = dict()
+        for a in regressor.findall('arg'):
+            if a.get('values') is not None:
+                swept[a.get('name')] = parse_list(a.get('values'))
+            else:
+                fixed[a.get('name')] = parse_value(a.get('value'))
+
+        expanded = list()
+        for values in itertools.product(*swept.values()):
+            combination = dict(zip(swept.keys(), values))
+            args = dict(fixed)
+            args.update(combination)
+            # keep order of arguments as given in XML
+            args = {a.get('name'): args[a.get('name')] for a in regressor.findall('arg')}
+            expanded.append((sweep_name(regressor.get('name'), combination),
+                             {"predictor": regressor.get('predictor'), "args": args}))
+        return expanded
+
+    def settings(self) -> Dict[str, any]:
+        """Returns experiment settings saved with results, in the form used by settings_hash"""
+        return {"trajectories": self.trajectories, "regressors": self.regressors, "feature_sets": self.feature_sets,
+                "channel_ranges": self.channel_ranges, "n_splits": self.n_splits}
+
+    def channel_envelope(self) -> Dict[str, int]:
+        """Returns channel range covering all bands, used for selecting columns to be read"""
+        return {"begin": min(r["begin"] for r in self.channel_ranges.values()),
+                "end": max(r["end"] for r in self.channel_ranges.values())}
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+import feature_engine
+from script_utilities import pop_option
+
+
+def usage():
+    print()
+    print('Compares batched feature engine with putemg_features - output columns, values and calculation time')
+    print()
+    print('Usage: {:s} [--repeat <N>] <feature_config_xml> <input_hdf5_file>'.format(os.path.basename(__file__)))
+    print()
+    print('Arguments:')
+    print('    <feature_config_xml>            XML file containing feature descriptors')
+    print('    <input_hdf5_file>               putEMG HDF5 file, eg. filtered and normalised experiment data')
+    print('    --repeat <N>                    number of timed repetitions, best time is reported, default 3')
+    print()
+    print('Example:')
+    print('{:s} force_features.xml '
+          '../putEMG/Data-HDF5-filtered/emg_force-03-sequential-2018-05-11-11-05-00-595_filtered.hdf5'.
+          format(os.path.basename(__file__)))
+    exit(1)
+
+
+def best_time(function, repeat: int) -> Tuple[float, any]:
+    """Returns shortest execution time of a function and its result"""
+    times = list()
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def compare(reference: pd.DataFrame, batched: pd.DataFrame) -> str:
+    """Returns description of differences between two feature DataFrames, empty if equal"""
+    if list(reference.columns) != list(batched.columns):
+        return 'columns differ'
+    if not reference.index.equals(batched.index):
+        return 'index differs'
+    if not np.allclose(reference.values, batched.values, rtol=1e-6, atol=1e-9, equal_nan=True):
+        return 'max difference {:g}'.format(np.nanmax(np.abs(reference.values - batched.values)))
+    return ''
+
+
+if __name__ == '__main__':
+    if '-h' in sys.argv or '--help' in sys.argv:
+        usage()
+
+    repeat = pop_option(sys.argv, '--repeat', 3, int)
+
+    if len(sys.argv) != 3:
+        print('Illegal number of parameters')
+        usage()
+
+    config = feature_engine.FeatureConfig(os.path.abspath(sys.argv[1]))
+    data: pd.DataFrame = pd.read_hdf(os.path.abspath(sys.argv[2]))
+
+    print('{:<12s} {:>12s} {:>12s} {:>9s}  {:s}'.format('Feature', 'reference[s]', 'batched[s]', 'speedup', 'check'))
+
+    mismatches = 0
+    for feature in config.all_features() + [None]:
+        features = config.all_features() if feature is None else [feature]
+
+        # putemg_features invoked through temporary XML with the same single feature
+        reference_time, reference = best_time(
+            lambda: feature_engine.reference_features(config, features, data), repeat)
+        batched_time, batched = best_time(
+            lambda: feature_engine.features_from_config_on_df(config, data, features), repeat)
+
+        check = compare(reference, batched)
+        mismatches += bool(check)
+
+        print('{:<12s} {:>12.3f} {:>12.3f} {:>8.1f}x  {:s}'.format(
+            'ALL' if feature is None else feature.name, reference_time, batched_time,
+            reference_time / batched_time, check or 'OK'))
+
+    exit(1 if mismatches else 0)
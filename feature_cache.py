@@ -0,0 +1,110 @@
+import os
+import json
+import hashlib
+
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from feature_engine import FeatureConfig, FeatureDescriptor
+from script_utilities import atomic_output
+
+
+class FeatureCache:
+    """Content-addressed on-disk cache of features, a single entry holds one feature of one input file
+
+    Entries are keyed by hash of input file, hash of its MVC file, windowing, all XML attributes of the feature and
+    the engine that calculates it (feature_engine.engine_description).
+    Total size is limited, least recently used entries are removed first (access updates entry modification time).
+    """
+
+    def __init__(self, folder: str, max_bytes: int):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(folder, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._entries())
+
+        # file hashes are remembered for given path, size and modification time, so files are read only once
+        self._hashes_url = os.path.join(folder, 'file_hashes.json')
+        self._hashes: Dict[str, str] = dict()
+        if os.path.isfile(self._hashes_url):
+            with open(self._hashes_url, 'r') as f:
+                self._hashes = json.load(f)
+
+    def file_hash(self, file_url: str) -> str:
+        """Returns SHA1 of file content"""
+        stat = os.stat(file_url)
+        stamp = '{:s}:{:d}:{:d}'.format(os.path.abspath(file_url), stat.st_size, stat.st_mtime_ns)
+
+        if stamp not in self._hashes:
+            sha1 = hashlib.sha1()
+            with open(file_url, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    sha1.update(block)
+            self._hashes[stamp] = sha1.hexdigest()
+            self._save_hashes()
+
+        return self._hashes[stamp]
+
+    def _save_hashes(self):
+        temp_url = atomic_output(self._hashes_url)
+        with open(temp_url, 'w') as f:
+            json.dump(self._hashes, f)
+        os.replace(temp_url, self._hashes_url)
+
+    @staticmethod
+    def key(file_hash: str, mvc_hash: str, config: FeatureConfig, feature: FeatureDescriptor, engine: List) -> str:
+        description = json.dumps([file_hash, mvc_hash, config.window, config.step, feature.key(), engine])
+        return hashlib.sha1(description.encode()).hexdigest()
+
+    def _entry_url(self, key: str) -> str:
+        return os.path.join(self.folder, key[:2], key + '.pkl')
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        """Returns cached feature DataFrame or None if not available"""
+        url = self._entry_url(key)
+        try:
+            df = pd.read_pickle(url)
+        except (OSError, EOFError, ValueError):
+            self.misses += 1
+            return None
+
+        # mark as recently used
+        os.utime(url)
+        self.hits += 1
+        return df
+
+    def put(self, key: str, df: pd.DataFrame):
+        """Stores feature DataFrame in cache, removes least recently used entries if cache exceeds size limit"""
+        url = self._entry_url(key)
+        os.makedirs(os.path.dirname(url), exist_ok=True)
+
+        temp_url = atomic_output(url)
+        df.to_pickle(temp_url)
+        self._size += os.path.getsize(temp_url) - (os.path.getsize(url) if os.path.isfile(url) else 0)
+        os.replace(temp_url, url)
+
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        """Yields (modification time, size, url) of all cache entries"""
+        for root, _, files in os.walk(self.folder):
+            for f in files:
+                if f.endswith('.pkl'):
+                    stat = os.stat(os.path.join(root, f))
+                    yield stat.st_mtime, stat.st_size, os.path.join(root, f)
+
+    def evict(self):
+        """Removes least recently used entries until cache fits its size limit"""
+        entries = sorted(self._entries())
+        self._size = sum(size for _, size, _ in entries)
+
+        for _, size, url in entries:
+            if self._size <= self.max_bytes:
+                break
+            os.remove(url)
+            self._size -= size
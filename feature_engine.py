@@ -0,0 +1,379 @@
+import os
+import glob
+import time
+import hashlib
+import weakref
+import tempfile
+import xml.etree.ElementTree as ET
+
+from functools import lru_cache
+from typing import Dict, List, Tuple, Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+import instrumentation
+
+
+# putEMG amplifier sampling frequency, used for frequency domain features
+SAMPLING_FREQUENCY = 5120
+
+# version of batched engine calculations, part of feature cache keys - increase when output of any feature changes
+ENGINE_VERSION = 1
+
+# number of windows processed at once, bounds memory of intermediate arrays
+WINDOW_BATCH = 4096
+
+# columns of putEMG DataFrame that force features are calculated for
+FORCE_COLUMN_PREFIXES = ('FORCE_', 'TRAJ_')
+
+
+class FeatureDescriptor:
+    """Single <feature> or <force_feature> entry of feature XML"""
+
+    def __init__(self, name: str, params: Dict[str, str], force: bool = False):
+        self.name = name
+        self.params = params
+        self.force = force
+
+    def key(self) -> Tuple[str, Tuple[Tuple[str, str], ...], bool]:
+        """Returns hashable description of feature, including all its XML attributes"""
+        return self.name, tuple(sorted(self.params.items())), self.force
+
+    def __repr__(self):
+        return '{:s}{:s}'.format(self.name, str(self.params) if self.params else '')
+
+
+class FeatureConfig:
+    """Windowing and feature descriptors parsed from feature XML file (eg. force_features.xml)"""
+
+    def __init__(self, xml_file_url: str):
+        root = ET.parse(xml_file_url).getroot()
+
+        windowing = root.find('windowing')
+        self.window = int(windowing.get('window'))
+        self.step = int(windowing.get('step'))
+
+        self.emg_features: List[FeatureDescriptor] = list()
+        self.force_features: List[FeatureDescriptor] = list()
+
+        emg_desc = root.find('emg_desc')
+        if emg_desc is not None:
+            for f in emg_desc.findall('feature'):
+                params = {k: v for k, v in f.attrib.items() if k != 'name'}
+                self.emg_features.append(FeatureDescriptor(f.get('name'), params))
+
+        force_desc = root.find('force_desc')
+        if force_desc is not None:
+            for f in force_desc.findall('force_feature'):
+                params = {k: v for k, v in f.attrib.items() if k != 'name'}
+                self.force_features.append(FeatureDescriptor(f.get('name'), params, force=True))
+
+        # putemg_features calculations of feature subsets, created on first use
+        self._references: Dict[Tuple, ReferenceFeatures] = dict()
+
+    def __getstate__(self):
+        # XML files of putemg_features calculations belong to the process that wrote them
+        state = dict(self.__dict__)
+        state['_references'] = dict()
+        return state
+
+    def all_features(self) -> List[FeatureDescriptor]:
+        return self.emg_features + self.force_features
+
+    def reference(self, features: List[FeatureDescriptor]) -> 'ReferenceFeatures':
+        """Returns putemg_features calculation of given features, its XML file is written once for this config"""
+        key = tuple(f.key() for f in features)
+        if key not in self._references:
+            self._references[key] = ReferenceFeatures(self, features)
+        return self._references[key]
+
+
+class WindowIntermediates:
+    """Lazily computed values shared between features of a single batch of windows
+
+    Windows are given as array of shape (windows, channels, window_length), usually a strided view of the signal.
+    Each intermediate is computed only once, eg. a single spectrum is shared by MNF, MNP, PKF and TTP.
+    """
+
+    def __init__(self, windows: np.ndarray, fs: float = SAMPLING_FREQUENCY):
+        self.windows = windows
+        self.fs = fs
+        self._cache: Dict[str, np.ndarray] = dict()
+
+    def _get(self, name: str, calculate: Callable[[], np.ndarray]) -> np.ndarray:
+        if name not in self._cache:
+            self._cache[name] = calculate()
+        return self._cache[name]
+
+    @property
+    def length(self) -> int:
+        return self.windows.shape[-1]
+
+    @property
+    def absolute(self) -> np.ndarray:
+        return self._get('absolute', lambda: np.abs(self.windows))
+
+    @property
+    def energy(self) -> np.ndarray:
+        return self._get('energy', lambda: np.einsum('ijk,ijk->ij', self.windows, self.windows))
+
+    @property
+    def diff(self) -> np.ndarray:
+        return self._get('diff', lambda: np.diff(self.windows, axis=-1))
+
+    @property
+    def abs_diff(self) -> np.ndarray:
+        return self._get('abs_diff', lambda: np.abs(self.diff))
+
+    @property
+    def frequencies(self) -> np.ndarray:
+        return self._get('frequencies', lambda: np.fft.rfftfreq(self.length, 1.0 / self.fs))
+
+    @property
+    def power(self) -> np.ndarray:
+        """One-sided power spectral density of each window, equal to scipy.signal.periodogram defaults"""
+        def calculate():
+            detrended = self.windows - self.windows.mean(axis=-1, keepdims=True)
+            power = np.square(np.abs(np.fft.rfft(detrended, axis=-1))) / (self.fs * self.length)
+            # double all bins except DC and, for even window length, Nyquist
+            power[..., 1:(None if self.length % 2 else -1)] *= 2
+            return power
+        return self._get('power', calculate)
+
+    @property
+    def total_power(self) -> np.ndarray:
+        return self._get('total_power', lambda: np.sum(self.power, axis=-1))
+
+
+def _feature_tm(im: WindowIntermediates, order: str = '3') -> np.ndarray:
+    order = int(order)
+    if order == 2:
+        return im.energy / im.length
+    return np.abs(np.mean(np.power(im.windows, order), axis=-1))
+
+
+def _feature_zc(im: WindowIntermediates, threshold: str = '0') -> np.ndarray:
+    sign_change = im.windows[..., :-1] * im.windows[..., 1:] < 0
+    return np.sum(sign_change & (im.abs_diff >= float(threshold)), axis=-1).astype(float)
+
+
+def _feature_ssc(im: WindowIntermediates, threshold: str = '0') -> np.ndarray:
+    slope = -im.diff[..., :-1] * im.diff[..., 1:]
+    return np.sum(slope >= float(threshold), axis=-1).astype(float)
+
+
+# EMG features calculated on windows, each returns array of shape (windows, channels)
+EMG_FEATURES: Dict[str, Callable[..., np.ndarray]] = {
+    'IAV': lambda im: np.sum(im.absolute, axis=-1),
+    'MAV': lambda im: np.mean(im.absolute, axis=-1),
+    'AAC': lambda im: np.mean(im.abs_diff, axis=-1),
+    'WL': lambda im: np.sum(im.abs_diff, axis=-1),
+    'RMS': lambda im: np.sqrt(im.energy / im.length),
+    'VAR': lambda im: im.energy / (im.length - 1),
+    'SSI': lambda im: im.energy,
+    'TM': _feature_tm,
+    'WAMP': lambda im, threshold='0': np.sum(im.abs_diff > float(threshold), axis=-1).astype(float),
+    'ZC': _feature_zc,
+    'SSC': _feature_ssc,
+    'MNF': lambda im: np.sum(im.power * im.frequencies, axis=-1) / im.total_power,
+    'MNP': lambda im: np.mean(im.power, axis=-1),
+    'PKF': lambda im: im.frequencies[np.argmax(im.power, axis=-1)],
+    'TTP': lambda im: im.total_power,
+}
+
+# force features, calculated on windows of force and trajectory columns
+FORCE_FEATURES: Dict[str, Callable[..., np.ndarray]] = {
+    'MEAN': lambda im: np.mean(im.windows, axis=-1),
+    'MEDIAN': lambda im: np.median(im.windows, axis=-1),
+    'LAST': lambda im: im.windows[..., -1],
+}
+
+
+def emg_columns(df: pd.DataFrame) -> List[str]:
+    return [c for c in df.columns if c.startswith('EMG_')]
+
+
+def force_columns(df: pd.DataFrame) -> List[str]:
+    return [c for c in df.columns if c.startswith(FORCE_COLUMN_PREFIXES)]
+
+
+def feature_column_name(feature_name: str, column: str) -> str:
+    """Returns output column name of a feature calculated for a given input column, eg. RMS_EMG_9"""
+    return feature_name + '_' + column
+
+
+def window_view(values: np.ndarray, window: int, step: int) -> np.ndarray:
+    """Returns strided view of shape (windows, channels, window) over (samples, channels) array, without copying"""
+    return np.lib.stride_tricks.sliding_window_view(values, window, axis=0)[::step]
+
+
+def window_index(index: pd.Index, window: int, step: int) -> pd.Index:
+    """Returns index of rows at which each window ends"""
+    return index[window - 1::step][:max(0, (len(index) - window) // step + 1)]
+
+
+def is_supported(feature: FeatureDescriptor) -> bool:
+    return feature.name in (FORCE_FEATURES if feature.force else EMG_FEATURES)
+
+
+def calculate_features_on_array(values: np.ndarray, features: List[FeatureDescriptor], window: int, step: int,
+                                fs: float = SAMPLING_FREQUENCY) -> Dict[FeatureDescriptor, np.ndarray]:
+    """Calculates features for all channels of (samples, channels) array, returns (windows, channels) per feature"""
+    view = window_view(np.ascontiguousarray(values, dtype=float), window, step)
+    results = {f: np.empty(view.shape[:2]) for f in features}
+
+    # time of shared intermediates is accounted to the first feature using them
+    elapsed = {f: 0.0 for f in features}
+    for begin in range(0, view.shape[0], WINDOW_BATCH):
+        im = WindowIntermediates(view[begin:begin + WINDOW_BATCH], fs)
+        for f in features:
+            calculate = (FORCE_FEATURES if f.force else EMG_FEATURES)[f.name]
+            start = time.perf_counter()
+            results[f][begin:begin + WINDOW_BATCH] = calculate(im, **f.params)
+            elapsed[f] += time.perf_counter() - start
+
+    for f in features:
+        instrumentation.record('feature ' + f.name, elapsed[f], windows=view.shape[0])
+
+    return results
+
+
+def _remove_xml(xml_file_url: str, pid: int):
+    # forked processes inherit finalizers, only the writing process removes the file
+    if os.getpid() == pid and os.path.exists(xml_file_url):
+        os.remove(xml_file_url)
+
+
+class ReferenceFeatures:
+    """Calculation of given features with putemg_features, through a temporary XML containing only those features
+
+    XML file is written once and removed when the calculation is released, so repeated calculations (eg. of chunks
+    or blocks of a recording) do not write files.
+    """
+
+    def __init__(self, config: FeatureConfig, features: List[FeatureDescriptor]):
+        root = ET.Element('features_calculation')
+        ET.SubElement(root, 'windowing', window=str(config.window), step=str(config.step))
+        emg_desc = ET.SubElement(root, 'emg_desc')
+        force_desc = ET.SubElement(root, 'force_desc')
+        for f in features:
+            ET.SubElement(force_desc if f.force else emg_desc, 'force_feature' if f.force else 'feature',
+                          name=f.name, **f.params)
+
+        handle, self.xml_file_url = tempfile.mkstemp(suffix='.xml')
+        with os.fdopen(handle, 'wb') as xml_file:
+            ET.ElementTree(root).write(xml_file)
+        weakref.finalize(self, _remove_xml, self.xml_file_url, os.getpid())
+
+    def __call__(self, df: pd.DataFrame) -> pd.DataFrame:
+        import putemg_features
+        return putemg_features.features_from_xml_on_df(self.xml_file_url, df)
+
+
+def reference_features(config: FeatureConfig, features: List[FeatureDescriptor], df: pd.DataFrame) -> pd.DataFrame:
+    """Calculates given features with putemg_features, XML of the features is written once per config"""
+    return config.reference(features)(df)
+
+
+@lru_cache(maxsize=1)
+def reference_version() -> str:
+    """Returns hash of putemg_features source files, identifies version of the reference engine"""
+    import putemg_features
+
+    sha1 = hashlib.sha1()
+    for file_url in sorted(glob.glob(os.path.join(os.path.dirname(putemg_features.__file__), '*.py'))):
+        with open(file_url, 'rb') as f:
+            sha1.update(f.read())
+    return sha1.hexdigest()
+
+
+def engine_description(feature: FeatureDescriptor, batched: bool = True) -> List:
+    """Returns name, version and parameters of the engine that calculates given feature
+
+    Features calculated by different engines (or their versions) may differ, so they are cached apart.
+    """
+    if batched and is_supported(feature):
+        return ['batched', ENGINE_VERSION, SAMPLING_FREQUENCY]
+    return ['putemg_features', reference_version()]
+
+
+def calculate_each_feature(config: FeatureConfig, df: pd.DataFrame, features: List[FeatureDescriptor],
+                           batched: bool = True) -> List[pd.DataFrame]:
+    """Calculates features of putEMG DataFrame, returns DataFrame of columns produced by each feature, in their order
+
+    Features of the same name with different parameters produce the same column names, so columns of each feature
+    are kept apart instead of being split by name. With batched engine all supported features of a kind (EMG, force)
+    are calculated at once, other features are calculated with putemg_features one by one. Time of each feature is
+    recorded with either engine.
+    """
+    columns = {False: emg_columns(df), True: force_columns(df)}
+    index = window_index(df.index, config.window, config.step)
+
+    output: Dict[FeatureDescriptor, pd.DataFrame] = dict()
+    for force in (False, True):
+        selected = [f for f in features if batched and f.force == force and is_supported(f)]
+        if not selected:
+            continue
+        if not columns[force]:
+            output.update({f: pd.DataFrame(index=index) for f in selected})
+            continue
+        values = calculate_features_on_array(df[columns[force]].values, selected, config.window, config.step)
+        for f in selected:
+            output[f] = pd.DataFrame(values[f], index=index,
+                                     columns=[feature_column_name(f.name, c) for c in columns[force]])
+
+    for f in features:
+        if f not in output:
+            start = time.perf_counter()
+            output[f] = reference_features(config, [f], df)
+            instrumentation.record('feature ' + f.name, time.perf_counter() - start, windows=len(index))
+    return [output[f] for f in features]
+
+
+def features_from_config_on_df(config: FeatureConfig, df: pd.DataFrame, features: List[FeatureDescriptor] = None,
+                               batched: bool = True) -> pd.DataFrame:
+    """Calculates features of putEMG DataFrame, output columns are the same as of features_from_xml_on_df
+
+    All EMG channels are processed at once over a single strided window view, intermediates shared by features
+    (absolute values, energy, spectrum) are calculated once per window. Features not implemented here are
+    delegated to putemg_features, all features are if batched is False. Columns are in order of features, each for all
+    channels.
+    """
+    if features is None:
+        features = config.all_features()
+    if not features:
+        return pd.DataFrame(index=window_index(df.index, config.window, config.step))
+    return pd.concat(calculate_each_feature(config, df, features, batched), axis=1)
+
+
+class FeatureStream:
+    """Calculates features of consecutive chunks of a recording, windows are the same as of calculation over the whole
+    recording (window ends at row window - 1 + k * step)
+
+    calculate(df) returns features of all complete windows of df, indexed by df index at window ends, eg.
+    features_from_config_on_df. Rows of windows not completed by a chunk are kept and joined with the next one.
+    """
+
+    def __init__(self, config: FeatureConfig, calculate: Callable[[pd.DataFrame], pd.DataFrame]):
+        self.window = config.window
+        self.step = config.step
+        self.calculate = calculate
+        self._rest: pd.DataFrame = None
+        self.windows = 0
+
+    def push(self, chunk: pd.DataFrame) -> Optional[pd.DataFrame]:
+        """Returns features of windows completed by the next chunk of recording, None if there are none"""
+        data = chunk if self._rest is None or not len(self._rest) else pd.concat([self._rest, chunk])
+        count = (len(data) - self.window) // self.step + 1 if len(data) >= self.window else 0
+        # next window starts after all steps of calculated windows
+        self._rest = data.iloc[count * self.step:]
+        if count == 0:
+            return None
+        self.windows += count
+        return self.calculate(data.iloc[:(count - 1) * self.step + self.window])
+
+
+def features_from_xml_on_df(xml_file_url: str, df: pd.DataFrame) -> pd.DataFrame:
+    """Drop-in replacement of putemg_features.features_from_xml_on_df using the batched engine"""
+    return features_from_config_on_df(FeatureConfig(xml_file_url), df)
@@ -0,0 +1,204 @@
+import os
+import glob
+
+from typing import List, Dict, Iterable, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+from mvc_index import mvc_key
+from script_utilities import atomic_output
+
+
+# feature store file format, files are partitioned by subject id and date: <folder>/id=03/date=2018-05-11/<file>.parquet
+STORE_EXTENSION = '.parquet'
+
+# number of rows read at once by read_chunks
+CHUNK_ROWS = 2 ** 16
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow.parquet
+        return pyarrow.parquet
+    except ImportError:
+        print('Columnar feature store requires pyarrow package: pip install pyarrow')
+        exit(1)
+
+
+def partition_path(folder: str, filename: str) -> str:
+    """Returns path of feature store file for a given putEMG file name"""
+    filename = os.path.splitext(os.path.basename(filename))[0]
+    _, subject, date = mvc_key(filename)
+    return os.path.join(folder, 'id=' + subject, 'date=' + date, filename + STORE_EXTENSION)
+
+
+def write_features(df: pd.DataFrame, file_url: str):
+    """Writes feature DataFrame to columnar store file, creating partition folders"""
+    _require_pyarrow()
+    os.makedirs(os.path.dirname(file_url), exist_ok=True)
+
+    temp_url = atomic_output(file_url)
+    df.to_parquet(temp_url, engine='pyarrow', compression='zstd')
+    os.replace(temp_url, file_url)
+
+
+class FeatureWriter:
+    """Writes feature DataFrame chunk by chunk, to columnar store file or HDF5 table, the same as written at once by
+    write_features or to_hdf
+
+    Chunks are appended to a temporary file, which is moved in place by close(), so readers never see incomplete file.
+    """
+
+    def __init__(self, file_url: str, output_format: str = 'hdf5'):
+        self.file_url = file_url
+        self.parquet = output_format == 'parquet'
+        if self.parquet:
+            _require_pyarrow()
+        os.makedirs(os.path.dirname(file_url), exist_ok=True)
+        self.temp_url = atomic_output(file_url)
+        self._writer = None
+        self._empty: pd.DataFrame = None
+        self.rows = 0
+
+    def write(self, df: Optional[pd.DataFrame]):
+        """Appends next rows, None (no rows) is ignored"""
+        if df is None:
+            return
+        if self._empty is None:
+            self._empty = df.iloc[:0]
+        if not len(df):
+            return
+
+        if self.parquet:
+            import pyarrow
+            # index is always stored as column, metadata of range index would describe only the first chunk
+            table = pyarrow.Table.from_pandas(df, preserve_index=True)
+            if self._writer is None:
+                self._writer = _require_pyarrow().ParquetWriter(self.temp_url, table.schema, compression='zstd')
+            self._writer.write_table(table)
+        else:
+            if self._writer is None:
+                self._writer = pd.HDFStore(self.temp_url, mode='w', complevel=5)
+            self._writer.append('data', df, format='table', index=False)
+        self.rows += len(df)
+
+    def close(self):
+        """Finishes the file and makes it visible, a file of empty DataFrame is written if no rows were appended"""
+        if self._writer is None:
+            empty = self._empty if self._empty is not None else pd.DataFrame()
+            if self.parquet:
+                empty.to_parquet(self.temp_url, engine='pyarrow', compression='zstd')
+            else:
+                empty.to_hdf(self.temp_url, 'data', format='table', mode='w', complevel=5)
+        else:
+            if not self.parquet:
+                # index of table is created once all chunks are written
+                self._writer.create_table_index('data')
+            self._writer.close()
+        os.replace(self.temp_url, self.file_url)
+
+
+def is_feature_store(folder: str) -> bool:
+    return len(list_feature_files(folder)) > 0
+
+
+def list_feature_files(folder: str) -> List[str]:
+    """Returns all feature files of a store, sorted by file name like HDF5 feature folder listing"""
+    return sorted(glob.glob(os.path.join(folder, '**', '*' + STORE_EXTENSION), recursive=True), key=os.path.basename)
+
+
+def feature_columns(file_url: str) -> List[str]:
+    """Returns column names of a feature file without reading its data"""
+    if file_url.endswith(STORE_EXTENSION):
+        schema = _require_pyarrow().read_schema(file_url)
+        index_columns = (schema.pandas_metadata or {}).get('index_columns', [])
+        return [c for c in schema.names if c not in index_columns]
+
+    with pd.HDFStore(file_url, mode='r') as store:
+        return list(store.select('data', stop=0).columns)
+
+
+def emg_feature_channel(column: str) -> Optional[tuple]:
+    """Returns (feature name, channel number) of EMG feature column (eg. RMS_EMG_9), None for other columns"""
+    if '_EMG_' not in column:
+        return None
+    return column[:column.index('_EMG_')], int(column[column.rindex('_') + 1:])
+
+
+def select_columns(columns: Iterable[str], features: Iterable[str], channel_range: Dict[str, int]) -> List[str]:
+    """Returns columns needed for given EMG features in channel range, all non EMG columns (eg. force) are kept"""
+    features = set(features)
+    selected = list()
+    for c in columns:
+        feature_channel = emg_feature_channel(c)
+        if feature_channel is None or (feature_channel[0] in features and
+                                       channel_range['begin'] <= feature_channel[1] <= channel_range['end']):
+            selected.append(c)
+    return selected
+
+
+def read_features(file_url: str, columns: List[str] = None) -> pd.DataFrame:
+    """Reads selected columns of feature file, either columnar store or HDF5 table"""
+    if file_url.endswith(STORE_EXTENSION):
+        _require_pyarrow()
+        return pd.read_parquet(file_url, engine='pyarrow', columns=columns)
+    return pd.DataFrame(pd.read_hdf(file_url, 'data', columns=columns))
+
+
+def file_rows(file_url: str) -> int:
+    """Returns number of rows of feature file without reading its data"""
+    if file_url.endswith(STORE_EXTENSION):
+        return _require_pyarrow().ParquetFile(file_url).metadata.num_rows
+
+    with pd.HDFStore(file_url, mode='r') as store:
+        storer = store.get_storer('data')
+        return storer.nrows if storer.is_table else storer.shape[0]
+
+
+def feature_dtypes(file_url: str, columns: List[str]) -> List[np.dtype]:
+    """Returns dtypes of selected columns of feature file without reading its data"""
+    if file_url.endswith(STORE_EXTENSION):
+        schema = _require_pyarrow().read_schema(file_url)
+        return [np.dtype(schema.field(c).type.to_pandas_dtype()) for c in columns]
+
+    with pd.HDFStore(file_url, mode='r') as store:
+        return list(store.select('data', stop=0)[columns].dtypes)
+
+
+def _parquet_index(parquet_file) -> pd.Index:
+    """Returns index of DataFrame saved to parquet file, stored either as columns or as metadata of range index"""
+    index_columns = (parquet_file.schema_arrow.pandas_metadata or {}).get('index_columns', [])
+    names = [c for c in index_columns if isinstance(c, str)]
+    if names:
+        return parquet_file.read(columns=names, use_pandas_metadata=True).to_pandas().index
+    if index_columns:
+        return pd.RangeIndex(index_columns[0]['start'], index_columns[0]['stop'], index_columns[0]['step'],
+                             name=index_columns[0]['name'])
+    return pd.RangeIndex(parquet_file.metadata.num_rows)
+
+
+def read_chunks(file_url: str, columns: List[str], chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Yields consecutive row chunks of selected columns of feature file, with index of the file
+
+    Only a single chunk is in memory at once, except of HDF5 files saved in fixed format, which can only be read
+    whole and are yielded as a single chunk.
+    """
+    if file_url.endswith(STORE_EXTENSION):
+        parquet_file = _require_pyarrow().ParquetFile(file_url)
+        index = _parquet_index(parquet_file)
+        begin = 0
+        for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=columns):
+            chunk = batch.to_pandas()[columns]
+            chunk.index = index[begin:begin + len(chunk)]
+            begin += len(chunk)
+            yield chunk
+        return
+
+    with pd.HDFStore(file_url, mode='r') as store:
+        storer = store.get_storer('data')
+        if not storer.is_table:
+            yield pd.DataFrame(store.select('data'))[columns]
+            return
+        for begin in range(0, storer.nrows, chunk_rows):
+            yield pd.DataFrame(store.select('data', columns=columns, start=begin, stop=begin + chunk_rows))[columns]
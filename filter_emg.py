@@ -3,30 +3,166 @@
 import os
 import sys
 import glob
+import hashlib
+import inspect
+
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Dict, List, Tuple
 
 import pandas as pd
 
 from putemg_features import biolab_utilities
 
+import instrumentation
+from instrumentation import stage
+import stream_filter
+from script_utilities import pop_option, pop_flag, atomic_output
+
+
+# in-memory DataFrame is copied a few times while filtering and writing, raw table size is multiplied by this factor
+MEMORY_OVERHEAD = 3
+
 
 def usage():
     print()
     print("Applies denoising filter")
     print()
-    print("Usage: {:s} <input_hdf5_folder> <output_hdf5_folder>".format(os.path.basename(__file__)))
+    print("Usage: {:s} [options] <input_hdf5_folder> <output_hdf5_folder>".format(os.path.basename(__file__)))
     print("     <input_hdf5_folder>:  putEMG HDF5 file folder containing raw experiment data")
     print("     <output_hdf5_folder>: output HDF5 file folder for filtered data")
     print()
+    print("Options:")
+    print("     --jobs <N>:           number of files filtered in parallel, default 1")
+    print("     --max-memory <MB>:    limit of estimated memory used by files being filtered at once, default 4096")
+    print("     --force:              filter all files, even if up-to-date output file exists")
+    print("     --stream:             filter in row chunks, each with margin rows of context on both sides, whole "
+          "recording is never loaded, output matches filtering of the whole recording")
+    print("     --chunk-size <N>:     number of rows per chunk in streaming mode, default {:d}".
+          format(stream_filter.CHUNK_SIZE))
+    print("     --margin <N>:         number of context rows on each side of a chunk, default {:d}".
+          format(stream_filter.MARGIN))
+    print("     --verify:             in streaming mode compare rows around chunk boundaries and recording edges with "
+          "filtering of longer spans at once")
+    print("     --trace <file>:       record stage timings, memory and I/O to trace file (.json - Chrome trace "
+          "format, other - JSON lines) and print summary")
+    print()
     print("Example:")
-    print("{:s} ../putEMG/Data-HDF5 ../putEMG/Data-HDF5-filtered".
+    print("{:s} --jobs 4 ../putEMG/Data-HDF5 ../putEMG/Data-HDF5-filtered".
           format(os.path.basename(__file__)))
     exit(1)
 
 
+def filter_signature() -> str:
+    """Returns hash of denoising filter definition, used to detect outputs created with different filter parameters
+
+    Streaming mode applies the same filter, its outputs have the same signature.
+    """
+    return hashlib.sha1(inspect.getsource(biolab_utilities.apply_filter).encode()).hexdigest()
+
+
+def estimate_memory(file_url: str, chunk_size: int = None, margin: int = stream_filter.MARGIN) -> int:
+    """Estimates number of bytes required to filter given HDF5 file, whole or in chunks of given size"""
+    try:
+        with pd.HDFStore(file_url, mode='r') as store:
+            storer = store.get_storer(store.keys()[0])
+            rows = storer.nrows if chunk_size is None else min(storer.nrows, chunk_size + 2 * margin)
+            return rows * storer.ncols * 8 * MEMORY_OVERHEAD
+    except (AttributeError, TypeError, IndexError):
+        # fixed format files do not expose table shape, assume typical compression ratio
+        return os.path.getsize(file_url) * 4 * MEMORY_OVERHEAD
+
+
+def is_up_to_date(input_file: str, output_file: str, signature: str) -> bool:
+    """Checks if output file is newer than input file and was created with the same filter"""
+    if not os.path.isfile(output_file) or os.path.getmtime(output_file) <= os.path.getmtime(input_file):
+        return False
+
+    try:
+        with pd.HDFStore(output_file, mode='r') as store:
+            return getattr(store.get_storer('data').attrs, 'filter_signature', None) == signature
+    except (OSError, KeyError, AttributeError):
+        return False
+
+
+def filter_file(input_file: str, output_file: str, signature: str,
+                chunk_size: int = None, verify: bool = False, margin: int = stream_filter.MARGIN) -> str:
+    """Reads raw putEMG file, applies denoising filter and saves result, returns output file name
+
+    If chunk_size is given file is filtered in streaming mode, one chunk of rows (with margin rows of context) at
+    a time
+    """
+    print('Denoising file: {:s}'.format(os.path.basename(input_file)), flush=True)
+
+    # write to temporary file first, interrupted run can not leave an output that looks up-to-date
+    temp_file = atomic_output(output_file)
+
+    name = os.path.basename(input_file)
+    if chunk_size is None:
+        # read raw putEMG data file and run filter
+        with stage('read', file=name):
+            df: pd.DataFrame = pd.read_hdf(input_file)
+        with stage('filter', file=name):
+            biolab_utilities.apply_filter(df)
+        with stage('write', file=name):
+            df.to_hdf(temp_file, 'data', format='table', mode='w', complevel=5)
+    else:
+        with stage('filter stream', file=name):
+            stream_filter.filter_file_streaming(input_file, temp_file, biolab_utilities.apply_filter,
+                                                chunk_size, margin)
+        if verify:
+            with stage('verify', file=name):
+                difference = stream_filter.verify_streaming(input_file, temp_file, biolab_utilities.apply_filter,
+                                                            chunk_size, margin)
+            print('Verified {:s}, max difference: {:g}'.format(os.path.basename(input_file), difference), flush=True)
+
+    with pd.HDFStore(temp_file, mode='a') as store:
+        store.get_storer('data').attrs.filter_signature = signature
+    os.replace(temp_file, output_file)
+
+    print('Saved to file: {:s}'.format(os.path.basename(output_file)), flush=True)
+    return output_file
+
+
+def filter_files_parallel(tasks: List[Tuple[str, str]], signature: str, jobs: int, max_memory: int,
+                          chunk_size: int = None, verify: bool = False, margin: int = stream_filter.MARGIN):
+    """Filters files in a process pool, submitting new files only while estimated memory in flight fits the limit"""
+    pending = [(input_file, output_file, estimate_memory(input_file, chunk_size, margin))
+               for input_file, output_file in tasks]
+    # largest files first, so they do not end up running alone at the end
+    pending.sort(key=lambda t: t[2], reverse=True)
+
+    in_flight: Dict[Future, int] = dict()
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        while pending or in_flight:
+            # always allow a single file, even if it exceeds the limit on its own
+            while pending and len(in_flight) < jobs and \
+                    (not in_flight or sum(in_flight.values()) + pending[0][2] <= max_memory):
+                input_file, output_file, memory = pending.pop(0)
+                future = executor.submit(filter_file, input_file, output_file, signature, chunk_size, verify,
+                                         margin)
+                in_flight[future] = memory
+
+            done, _ = wait(in_flight.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                del in_flight[future]
+                # re-raise worker exceptions
+                future.result()
+
+
 if __name__ == '__main__':
     if '-h' in sys.argv or '--help' in sys.argv:
         usage()
 
+    jobs = pop_option(sys.argv, '--jobs', 1, int)
+    max_memory = pop_option(sys.argv, '--max-memory', 4096, int) * 1024 * 1024
+    force = pop_flag(sys.argv, '--force')
+    stream = pop_flag(sys.argv, '--stream')
+    chunk_size = pop_option(sys.argv, '--chunk-size', stream_filter.CHUNK_SIZE, int) if stream else None
+    margin = pop_option(sys.argv, '--margin', stream_filter.MARGIN, int)
+    verify = pop_flag(sys.argv, '--verify')
+    trace = pop_option(sys.argv, '--trace', None)
+
     if len(sys.argv) != 3:
         print("Invalid parameter count")
         usage()
@@ -39,15 +175,28 @@ if __name__ == '__main__':
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
+    if trace is not None:
+        instrumentation.enable(trace)
+
+    # streamed output matches filtering of the whole recording, so both modes share up-to-date outputs
+    signature = filter_signature()
+
+    tasks: List[Tuple[str, str]] = list()
     for file in all_files:
         basename = os.path.basename(file)
         filename = os.path.splitext(basename)[0]
-        print('Denoising file: {:s}'.format(basename))
+        output_file = os.path.join(output_folder, filename + '_filtered.hdf5')
 
-        # read raw putEMG data file and run filter
-        df: pd.DataFrame = pd.read_hdf(file)
-        biolab_utilities.apply_filter(df)
+        if not force and is_up_to_date(file, output_file, signature):
+            print('Skipping up-to-date file: {:s}'.format(basename))
+            continue
+
+        tasks.append((file, output_file))
+
+    if jobs > 1:
+        filter_files_parallel(tasks, signature, jobs, max_memory, chunk_size, verify, margin)
+    else:
+        for input_file, output_file in tasks:
+            filter_file(input_file, output_file, signature, chunk_size, verify, margin)
 
-        output_file = filename + '_filtered.hdf5'
-        print('Saving to file: {:s}'.format(output_file))
-        df.to_hdf(os.path.join(output_folder, output_file), 'data', format='table', mode='w', complevel=5)
+    instrumentation.print_summary()
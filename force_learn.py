@@ -1,23 +1,64 @@
 #!/usr/bin/env python3
 
-import os, sys, glob, pickle, time
+import os, sys, glob, pickle
 
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
+import numpy as np
 import pandas as pd
 
 from putemg_features import biolab_utilities
 
+import feature_store
+import instrumentation
+from instrumentation import stage, reset_peak_rss, current_peak_rss
+from experiment_config import ExperimentConfig, settings_hash
+from force_learn_tasks import SharedArrays, SplitData, Checkpoints, run_tasks, task_key, column_names, \
+    column_positions
+from model_registry import ModelRegistry, record_name
+import results_store
+from result_stats import split_experiment_id
+from subject_loader import SubjectLoader
+from script_utilities import pop_option, pop_flag, atomic_output
+
+
+# trajectory name of multi-output tasks, fitting all trajectories at once
+MULTI_OUTPUT = "All"
+
 
 def usage():
     print()
-    print('Usage: {:s} <putEMG_HDF5_feature_folder> <output_folder>'.format(os.path.basename(__file__)))
+    print('Usage: {:s} [options] <putEMG_HDF5_feature_folder> <output_folder>'.format(os.path.basename(__file__)))
     print()
     print('Arguments:')
-    print('    <putEMG_HDF5_feature_folder>     URL to a folder containing HDF5 files with features')
+    print('    <putEMG_HDF5_feature_folder>     URL to a folder containing HDF5 files with features or columnar '
+          'feature store')
     print('    <output_folder>                  URL to a output folder - results and intermediate '
           'files will be written here')
     print()
+    print('Options:')
+    print('    --config <xml>                   experiment config with feature sets, trajectories, regressors, '
+          'channel bands and sweeps, default force_learn_config.xml')
+    print('    --jobs <N>                       number of regressors fitted in parallel processes, default 1')
+    print('    --results-format <pickle|store>  format of result files - pickled .bin file per subject and day or '
+          'indexed results store, default pickle')
+    print('    --warm-start                     reuse scaler statistics and SVR kernels between trajectories, '
+          'warm-start MLP from previous split')
+    print('    --compare-cold                   with --warm-start, also fit each regressor from scratch and write '
+          'accuracy drift report')
+    print('    --multi-output                   fit all trajectories with a single multi-output regressor (one SVR '
+          'per output, on shared preprocessing and RBF kernel, outputs fitted in threads with --jobs 1), results '
+          'are split back to each trajectory and marked with "multi_output" field')
+    print('    --trace <file>                   record stage timings, memory and I/O to trace file (.json - Chrome '
+          'trace format, other - JSON lines) and print summary')
+    print('    --save-models <folder>           save fitted pipelines to versioned model registry, for '
+          'force_predict.py (not with --warm-start), tasks completed without a model of the same settings are '
+          'fitted again')
+    print('    --force                          run all tasks of the config again, even of completed subjects and '
+          'days, results of tasks no longer in the config are kept unless the config redefines their settings')
+    print('    --max-memory <MB>                memory budget of loaded features of a subject, features are '
+          'downcast to float32 where it is exact and files over budget are memory-mapped from disk')
+    print()
     print('Example:')
     print('{:s} ../putEMG/Data-HDF5-filtered-feature ../putEMG/force_learn_results/'.format(os.path.basename(__file__)))
     exit(1)
@@ -27,6 +68,21 @@ if __name__ == '__main__':
     if '-h' in sys.argv or '--help' in sys.argv:
         usage()
 
+    jobs = pop_option(sys.argv, '--jobs', 1, int)
+    results_format = pop_option(sys.argv, '--results-format', 'pickle')
+    warm_start = pop_flag(sys.argv, '--warm-start')
+    compare_cold = pop_flag(sys.argv, '--compare-cold')
+    multi_output = pop_flag(sys.argv, '--multi-output')
+    force = pop_flag(sys.argv, '--force')
+    max_memory = pop_option(sys.argv, '--max-memory', None, int)
+    trace = pop_option(sys.argv, '--trace', None)
+    models_folder = pop_option(sys.argv, '--save-models', None, os.path.abspath)
+    config_file = pop_option(sys.argv, '--config', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                'force_learn_config.xml'))
+    if results_format not in ('pickle', 'store'):
+        print('Unknown results format - {:s}'.format(results_format))
+        usage()
+
     if len(sys.argv) < 3:
         print('Illegal number of parameters')
         usage()
@@ -42,155 +98,376 @@ if __name__ == '__main__':
         print('{:s} is not a valid folder'.format(result_folder))
         exit(1)
 
-    # defines feature sets to be used in force learn
-    feature_sets = {
-        "ZC": ["ZC"],
-        "WAMP": ["WAMP"],
-        "RMS": ["RMS"],
-        "AAC": ["AAC"],
-        "MNF": ["MNF"],
-        "MNP": ["MNP"],
-        "PKF": ["PKF"],
-        "TimeDomain": ["ZC", "WAMP", "RMS", "AAC"],
-        "FreqDomain": ["PKF", "MNF", "MNP"],
-    }
-
-    # defines the feature of force measurement to be used
-    force_feature = "MEAN"
-
-    # define fingers to be estimated in shallow learn
-    trajectories = {
-        "Index": [2],
-        "Middle": [3],
-        "Thumb": [1],
-        "Ring+Small": [4],
-        # "All": [1, 2, 3, 4],
-    }
-
-    # defines regressors and its options to be used in force learn
-    regressors = {
-        "LR": {
-            "predictor": "LR",
-            "args": {"fit_intercept": True, "normalize": False, "copy_X": True, "n_jobs": None}},
-        "MLPR": {
-            "predictor": "MLPR",
-            "args": {"hidden_layer_sizes": (200, ), "activation": "logistic", "solver": "adam",
-                     "alpha": 0.0001, "batch_size": "auto", "learning_rate": "constant", "learning_rate_init": 0.001,
-                     "power_t": 0.5, "max_iter": 200, "shuffle": True, "random_state": None, "tol": 0.0001,
-                     "verbose": False, "warm_start": False, "momentum": 0.9, "nesterovs_momentum": True,
-                     "early_stopping": False, "validation_fraction": 0.1, "beta_1": 0.9, "beta_2": 0.999,
-                     "epsilon": 1e-08, "n_iter_no_change": 10}},
-        # SVR can be for only single output
-        "SVR": {
-           "predictor": "SVR",
-           "args": {"kernel": "rbf", "degree": 3, "gamma": "scale", "coef0": 0.0, "tol": 0.001,
-                    "C": 1.0, "epsilon": 0.1, "shrinking": True, "cache_size": 200, "verbose": False, "max_iter": -1}},
-    }
-
-    # defines channels configurations for which classification will be run
-    channel_range = {"begin": 9, "end": 16}
-    # "24chn": {"begin": 1, "end": 24},
-    # "8chn_1band": {"begin": 1, "end": 8},
-    # "8chn_2band": {"begin": 9, "end": 16},
-    # "8chn_3band": {"begin": 17, "end": 24}
-
-    # create k-fold validation set, with 3 splits - for each experiment day 3 combination are generated
-    # this results in 6 data combination for each subject
-    n_splits = 3
+    if not os.path.isfile(config_file):
+        print('Experiment config does not exist - {:s}'.format(config_file))
+        exit(1)
+
+    # feature sets, trajectories, regressors and channel bands are defined in experiment config, with sweeps expanded
+    config = ExperimentConfig(config_file)
+    feature_sets = config.feature_sets
+    channel_ranges = config.channel_ranges
+    force_feature = config.force_feature
+    trajectories = config.trajectories
+    regressors = config.regressors
+    n_splits = config.n_splits
+    settings = config.settings()
+
+    if trace is not None:
+        instrumentation.enable(trace)
+
+    registry = None
+    if models_folder is not None:
+        if warm_start:
+            print('Fitted models can not be saved with --warm-start, scaler and regressor are not kept as pipeline')
+            exit(1)
+        registry = ModelRegistry(models_folder)
 
     print('Starting to learn how to Force...')
 
-    all_files = [f for f in sorted(glob.glob(os.path.join(input_folder, "*.hdf5"))) if not ("bias" in f or "mvc" in f)]
+    if feature_store.is_feature_store(input_folder):
+        all_files = [f for f in feature_store.list_feature_files(input_folder) if not ("bias" in f or "mvc" in f)]
+    else:
+        all_files = [f for f in sorted(glob.glob(os.path.join(input_folder, "*.hdf5")))
+                     if not ("bias" in f or "mvc" in f)]
 
     # create list of records
     all_feature_records = [biolab_utilities.Record(os.path.basename(f)) for f in all_files]
+    record_files = dict(zip(all_feature_records, all_files))
+
+    # only columns of used features and selected channels are read
+    used_features = set(f for features in feature_sets.values() for f in features)
+
+    # features and fingers of all feature sets and trajectories, prepared once for each split
+    all_features = sorted(used_features)
+    all_fingers = sorted(set(finger for trajectory in trajectories.values() for finger in trajectory))
+
+    # results of finished tasks are saved here, so interrupted run can be resumed
+    checkpoint_folder = os.path.join(result_folder, 'checkpoints')
+
+    # warm start accuracy drift against regressors fitted from scratch
+    report_rows: List[Dict[str, any]] = list()
+
+    # feature files are loaded within memory budget, only columns of used features and selected channels are read
+    loader = SubjectLoader(lambda f: feature_store.select_columns(feature_store.feature_columns(f), used_features,
+                                                                  config.channel_envelope()),
+                           max_memory * 1024 * 1024 if max_memory is not None else None, result_folder)
 
     # select unique ids list in order to load data for only a single subject (done due to Out of memory problems)
     unique_ids = sorted(set([record.id for record in all_feature_records]))
 
+    # with memory budget, subjects fitting in budget are processed first
+    unique_ids = loader.order({i: [f for r, f in record_files.items() if r.id == i] for i in unique_ids})
+
+    # all tasks of an experiment, in order of serial loop: trajectory, split, feature set, regressor, with hash of
+    # their settings, so a task of the same name with changed settings (eg. regressor arguments) is a different task
+    def experiment_keys(split_count: int) -> List[Tuple[str, int, str, str, str]]:
+        return [(trajectory_name, i_s, feature_set_name, reg_id,
+                 settings_hash(settings, trajectory_name, feature_set_name, reg_id, force_feature, multi_output))
+                for trajectory_name in trajectories
+                for i_s in range(split_count)
+                for feature_set_name in feature_sets
+                for reg_id in regressors]
+
+    # task keys of result file of each experiment, read once until the file is written again
+    stored_keys: Dict[str, set] = dict()
+
+    def written_keys(stem: str) -> set:
+        if stem not in stored_keys:
+            stored_keys[stem] = set(results_store.result_keys(result_folder, stem))
+        return stored_keys[stem]
+
+    # registry key of the model fitted by a task, all trajectories share a single model in multi-output mode
+    def model_key(experiment_id: str, key: Tuple[str, int, str, str, str]) -> Dict[str, any]:
+        subject, date = split_experiment_id(experiment_id)
+        return {"subject": subject, "date": date, "split": key[1], "feature_set": key[2], "reg": key[3],
+                "trajectory": MULTI_OUTPUT if multi_output else key[0]}
+
+    # with --save-models a task is finished only when registry has its model fitted with the same settings
+    def has_model(experiment_id: str, key: Tuple[str, int, str, str, str]) -> bool:
+        if registry is None:
+            return True
+        meta = registry.meta(model_key(experiment_id, key))
+        return meta is not None and meta.get("settings_hash") == key[4]
+
+    # experiment is complete when its result file contains all tasks of the config and no checkpoints of unfinished
+    # tasks are left, results of a previous config are kept and only new combinations are computed
+    def is_completed(experiment_id: str, split_count: int) -> bool:
+        stem = results_store.result_stem(experiment_id)
+        keys = experiment_keys(split_count)
+        return results_store.has_results(result_folder, stem) and \
+            not Checkpoints(os.path.join(checkpoint_folder, experiment_id.replace("/", "_"))).exists() and \
+            set(keys) <= written_keys(stem) and all(has_model(experiment_id, k) for k in keys)
+
     for single_id in unique_ids:
         # Filter based on subject id
         records_filtered_by_subject = biolab_utilities.record_filter(all_feature_records,
                                                                      whitelists={"id": [single_id]})
-        # load feature data to memory
-        dfs: Dict[biolab_utilities.Record, pd.DataFrame] = {}
-        for r in records_filtered_by_subject:
-            print("\tReading features for input file: ", r)
-            filename = os.path.splitext(r.path)[0]
-            dfs[r] = pd.DataFrame(pd.read_hdf(os.path.join(input_folder, filename + '.hdf5')))
 
         # Create splits
         splits_all = biolab_utilities.data_per_id_and_date(records_filtered_by_subject, n_splits=n_splits)
 
+        if not force and all(is_completed(id_, len(id_splits)) for id_, id_splits in splits_all.items()):
+            print('\tSubject {:s} already completed, skipping (use --force to run again)'.format(str(single_id)),
+                  flush=True)
+            continue
+
+        # load feature data to memory
+        reset_peak_rss()
+        # train and test data of a split are copied from loaded data by prepare_force_data, memory of the largest
+        # day of the subject is reserved for them
+        days = sorted(set(r.date for r in records_filtered_by_subject))
+        reserve = loader.reserve([[record_files[r] for r in records_filtered_by_subject if r.date == d]
+                                  for d in days])
+        dfs: Dict[biolab_utilities.Record, pd.DataFrame] = loader.load(
+            {r: record_files[r] for r in records_filtered_by_subject}, reserve)
+
         # for each experiment (single subject, single day)
         for id_, id_splits in splits_all.items():
+            if not force and is_completed(id_, len(id_splits)):
+                print('\tTrial ID: {:s} - already completed, skipping (use --force to run again)'.format(id_),
+                      flush=True)
+                continue
+
             output: Dict[str, any] = dict()
 
             output["trajectories"] = trajectories
             output["regressors"] = regressors
             output["feature_sets"] = feature_sets
+            output["channel_ranges"] = channel_ranges
+            output["n_splits"] = n_splits
             output["id"] = id_
             output["results"]: List[Dict[str, any]] = list()
 
-            print('\tTrial ID: {:s}'.format(id_), flush=True)
-
-            # for each finger trajectory
-            for trajectory_name, trajectory in trajectories.items():
-                print('\t\tFinger trajectory: {:s}'.format(trajectory_name), flush=True)
-
-                # for split in k-fold validation of each day of each subject
-                for i_s, s in enumerate(id_splits):
-                    print('\t\t\tSplit: {:d}'.format(i_s), flush=True)
-
-                    # for each feature set
-                    for feature_set_name, features in feature_sets.items():
-                        print('\t\t\t\tFeature set: {:s} -'.format(feature_set_name), end='', flush=True)
-
-                        data = biolab_utilities.prepare_force_data(dfs, s, features, force_feature, trajectory)
-
-                        # strip columns to include only selected channels, eg. only one band
-                        band_columns = [c for c in data['train']['input'].columns if
-                                        (channel_range["begin"] <= int(c[c.rindex('_') + 1:]) <= channel_range["end"])]
-
-                        train_x = data['train']['input'][band_columns]
-                        train_y = data['train']['output']
+            checkpoints = Checkpoints(os.path.join(checkpoint_folder, id_.replace("/", "_")))
+            if force:
+                checkpoints.clear()
 
-                        test_x = data['test']['input'][band_columns]
-                        test_y_true = data['test']['output']
+            stem = results_store.result_stem(id_)
 
-                        for reg_id, reg_settings in regressors.items():
-                            print(' {:s}'.format(reg_id), end='', flush=True)
+            # tasks already in result file of this experiment are not run again, unless forced or their model is
+            # to be saved and it is missing
+            keys = experiment_keys(len(id_splits))
+            previous = written_keys(stem)
+            reused = set() if force else previous & set(keys)
+            # previous result of a task fitted again for its model is kept if the task fails
+            finished = set(k for k in keys if k in reused or checkpoints.is_done(k))
+            missing_models = set(k for k in finished if not has_model(id_, k))
+            pending = [k for k in keys if k not in finished or k in missing_models]
 
-                            start = time.time()
-                            # prepare regressor pipeline
-                            # fit the regressor to train data
-                            pipeline = biolab_utilities.prepare_pipeline(train_x, train_y,
-                                                                         predictor=reg_settings["predictor"],
-                                                                         norm_per_feature=False,
-                                                                         **reg_settings["args"])
-                            elapsed_fit = time.time() - start
+            print('\tTrial ID: {:s} - {:d} of {:d} tasks to run{:s}'.format(
+                id_, len(pending), len(keys), ', {:d} of them to save missing models'.format(len(missing_models))
+                if missing_models else ''), flush=True)
 
-                            start = time.time()
-                            # run regressor on test data
-                            test_y_pred = pipeline.predict(test_x)
-                            elapsed_predict= time.time() - start
+            tasks: List[Dict[str, any]] = list()
+            records: List[List[Tuple[Dict[str, any], List[int]]]] = list()
 
-                            print(' (fit: {:.1f}s pred: {:.1f}s)'.format(elapsed_fit, elapsed_predict), end='', flush=True)
-
-                            # save classification results to output structure
-                            output["results"].append({"split": i_s, "reg": reg_id, "trajectory": trajectory_name,
-                                                      "force_feature": force_feature, "feature_set": feature_set_name,
-                                                      "y_true": test_y_true.values.astype(float),
-                                                      "y_pred": test_y_pred})
-                        print()
-
-            # Dump regression results to file
-            filename = "force-classification-result_" + id_.replace("/", "_") + ".bin"
-            print('\tWriting trial file: {:s}'.format(filename), flush=True)
+            # train and test data are shared with worker processes as memory-mapped files
+            with SharedArrays(result_folder) as shared:
+                # for split in k-fold validation of each day of each subject
+                for i_s, s in enumerate(id_splits):
+                    split_pending = [k for k in pending if k[1] == i_s]
+                    if not split_pending:
+                        continue
+
+                    print('\t\tSplit: {:d}'.format(i_s), flush=True)
+
+                    # input data depends only on split, a single matrix of all features is prepared for all feature
+                    # sets and trajectories
+                    with stage('prepare_force_data', id=id_, split=i_s):
+                        split_data = SplitData(dfs, s, all_features, force_feature, all_fingers)
+
+                    train_x = shared.put(split_data.train_x)
+                    train_y = shared.put(split_data.train_y)
+                    test_x = shared.put(split_data.test_x)
+                    test_y = shared.put(split_data.test_y)
+
+                    # in multi-output mode all trajectories of the config are a single task of a feature set and
+                    # regressor, run if any of them is pending - its regressor does not depend on results of previous
+                    # runs and records of all trajectories are replaced
+                    groups: Dict[Tuple, List[str]] = dict()
+                    for trajectory_name, _, feature_set_name, reg_id, _ in split_pending:
+                        if multi_output:
+                            groups[(MULTI_OUTPUT, feature_set_name, reg_id)] = list(trajectories)
+                        else:
+                            groups.setdefault((trajectory_name, feature_set_name, reg_id), []).append(trajectory_name)
+
+                    for (task_trajectory, feature_set_name, reg_id), group_trajectories in groups.items():
+                        if multi_output:
+                            output_columns = sorted(set(c for t in group_trajectories for c in
+                                                        column_positions(split_data.output_columns(trajectories[t]))))
+                        else:
+                            # target has the shape prepare_force_data gives the trajectory, eg. Series of one finger
+                            output_columns = split_data.output_columns(trajectories[task_trajectory])
+                        # select only columns of feature set and selected channels, eg. only one band
+                        input_columns = split_data.input_columns(feature_sets[feature_set_name],
+                                                                 channel_ranges[feature_set_name])
+
+                        tasks.append({"key": (task_trajectory, i_s, feature_set_name, reg_id),
+                                      "train_x": train_x, "train_y": train_y, "test_x": test_x, "test_y": test_y,
+                                      "input_columns": input_columns, "output_columns": output_columns,
+                                      "reg_settings": regressors[reg_id], "save_model": registry is not None})
+
+                        # result records of each trajectory, with positions of trajectory in multi-output prediction
+                        task_records = list()
+                        for t in group_trajectories:
+                            columns = split_data.output_columns(trajectories[t])
+                            positions = None
+                            if multi_output:
+                                positions = output_columns.index(columns) if isinstance(columns, int) else \
+                                    [output_columns.index(c) for c in columns]
+                            record = {"split": i_s, "reg": reg_id, "trajectory": t, "force_feature": force_feature,
+                                      "feature_set": feature_set_name,
+                                      "settings_hash": settings_hash(settings, t, feature_set_name, reg_id,
+                                                                     force_feature, multi_output),
+                                      "y_true": split_data.test_y.values[:, columns].astype(float)}
+                            if multi_output:
+                                # prediction of the trajectory comes from a regressor fitted to all trajectories
+                                record["multi_output"] = True
+                            task_records.append((record, positions))
+                        records.append(task_records)
+
+                    del split_data
+
+                # fit in order of original serial loop
+                order = sorted(range(len(records)), key=lambda i: keys.index(task_key(records[i][0][0])))
+                tasks = [tasks[i] for i in order]
+                records = [records[i] for i in order]
+
+                print('\t\tFitting {:d} regressors using {:d} processes'.format(len(tasks), jobs), flush=True)
+
+                for i, result, error in run_tasks(tasks, jobs, warm_start, compare_cold):
+                    description = '{:s} split {:d} {:s} {:s}'.format(*tasks[i]["key"])
+                    if error is not None:
+                        # failed task is recorded and will be run again on restart, others continue
+                        print('\t\t\t{:s} FAILED: {:s}'.format(description, error.strip().splitlines()[-1]),
+                              flush=True)
+                        for record, _ in records[i]:
+                            checkpoints.fail(task_key(record), error)
+                        continue
+
+                    print('\t\t\t{:s} (fit: {:.1f}s pred: {:.1f}s)'.format(description, result["fit_time"],
+                                                                           result["predict_time"]), flush=True)
+
+                    if result.get("pipeline") is not None:
+                        task = tasks[i]
+                        split = id_splits[task["key"][1]]
+                        # all records of a multi-output task have the same settings hash
+                        key = task_key(records[i][0][0])
+                        registry.save(model_key(id_, key),
+                                      {"pipeline": result["pipeline"],
+                                       "input_columns": column_names(task["train_x"], task["input_columns"]),
+                                       "output_columns": column_names(task["train_y"], task["output_columns"]),
+                                       "reg_settings": task["reg_settings"], "force_feature": force_feature,
+                                       "features": feature_sets[task["key"][2]],
+                                       "channel_range": channel_ranges[task["key"][2]], "settings_hash": key[4],
+                                       "train_records": [record_name(r.path) for r in split['train']],
+                                       "test_records": [record_name(r.path) for r in split['test']]})
+
+                    if "report" in result:
+                        report_rows.append(dict(id=id_, trajectory=tasks[i]["key"][0], split=tasks[i]["key"][1],
+                                                feature_set=tasks[i]["key"][2], reg=tasks[i]["key"][3],
+                                                **result["report"]))
+
+                    for record, columns in records[i]:
+                        # multi-output prediction is split back to records of each trajectory
+                        y_pred = result["y_pred"]
+                        if columns is not None:
+                            y_pred = np.asarray(y_pred).reshape(len(y_pred), -1)[:, columns]
+
+                        # save classification results to checkpoint, as soon as task is finished
+                        record["y_pred"] = y_pred
+                        checkpoints.save(task_key(record), record)
+
+            del tasks, records
+
+            failed = [checkpoints.failure(k) for k in keys if not checkpoints.is_done(k) and k not in reused]
+            if failed:
+                output["failed"] = failed
+
+            # results of previous runs are merged, settings of their trajectories, regressors and feature sets are kept
+            previous_records: Dict[Tuple, Dict[str, any]] = dict()
+            if previous:
+                previous_meta, previous_list = results_store.read_experiment(result_folder, stem)
+                for name in ("trajectories", "regressors", "feature_sets", "channel_ranges"):
+                    output[name] = {**previous_meta.get(name, dict()), **output[name]}
+
+                # records of tasks of the config are reused only with the same settings, records of other tasks are
+                # kept only if merged settings still describe them, eg. not if their feature set was redefined
+                current_names = set(k[:4] for k in keys)
+                dropped = 0
+                for d in previous_list:
+                    k = task_key(d)
+                    if k[:4] in current_names:
+                        if k in reused:
+                            previous_records[k] = d
+                        continue
+                    multi = d.get("multi_output", False)
+                    written_with = k[4] if k[4] is not None else \
+                        settings_hash(previous_meta, k[0], k[2], k[3], d["force_feature"], multi)
+                    if written_with == settings_hash(output, k[0], k[2], k[3], d["force_feature"], multi):
+                        previous_records[k] = d
+                    else:
+                        dropped += 1
+                if dropped:
+                    print('\tDropping {:d} previous results whose settings are redefined by the config'.format(dropped),
+                          flush=True)
+
+            def finished_records():
+                # records of current config in serial order, then records of tasks no longer in config
+                for k in keys:
+                    if checkpoints.is_done(k):
+                        yield checkpoints.load(k)
+                    elif k in reused:
+                        yield previous_records[k]
+                current = set(keys)
+                for k, d in previous_records.items():
+                    if k not in current:
+                        yield d
+
+            print('\tWriting trial results: {:s}{:s}'.format(
+                stem, ' ({:d} failed tasks)'.format(len(failed)) if failed else ''), flush=True)
             print()
-            pickle.dump(output, open(os.path.join(result_folder, filename), "wb"))
+
+            if results_format == 'store':
+                # records are appended one by one, whole output is never held in memory
+                writer = results_store.ResultsWriter(result_folder, stem)
+                for record in finished_records():
+                    writer.append(record)
+                writer.close({k: v for k, v in output.items() if k != "results"})
+                results_store.remove_other_format(result_folder, stem, results_store.INDEX_EXTENSION)
+            else:
+                # collect results of all finished tasks to output structure
+                output["results"] = list(finished_records())
+
+                # Dump regression results to file
+                filename = stem + results_store.PICKLE_EXTENSION
+                temp_file = atomic_output(os.path.join(result_folder, filename))
+                pickle.dump(output, open(temp_file, "wb"))
+                os.replace(temp_file, os.path.join(result_folder, filename))
+                results_store.remove_other_format(result_folder, stem, results_store.PICKLE_EXTENSION)
+
+            stored_keys.pop(stem, None)
+
+            # checkpoints are kept only if some tasks failed, so they are retried on restart
+            if not failed:
+                checkpoints.clear()
 
             # Free memory of each output, writing next data to a new file
             del output
         # Free memory of input feature data, new data for next subject will be loaded
         del dfs
+        loader.release()
+        print('\tSubject {:s} peak RSS: {:.0f} MB'.format(str(single_id), current_peak_rss() / 1024 / 1024),
+              flush=True)
+
+    if report_rows:
+        report = pd.DataFrame(report_rows)
+        report["rmse_drift"] = report["warm_rmse"] - report["cold_rmse"]
+        report_file = os.path.join(result_folder, 'warm_start_report.csv')
+        report.to_csv(report_file, index=False)
+
+        print('Warm start accuracy drift (RMSE warm - cold) and fit time:')
+        print(report.groupby('reg')[['rmse_drift', 'warm_fit_time', 'cold_fit_time']].mean().to_string())
+        print('Report written to {:s}'.format(report_file))
+
+    instrumentation.print_summary()
@@ -1,21 +1,27 @@
-import numpy as np
+import pandas as pd
 from tqdm import tqdm
 
-from typing import Dict, Tuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List
 
-import glob, pickle, os, sys
+import os, sys
+
+import result_stats
+from script_utilities import pop_option
 
 
 def usage():
     print()
-    print('Usage: {:s} <result_folder> <output_file>'.format(os.path.basename(__file__)))
+    print('Usage: {:s} [--jobs <N>] <result_folder> <output_file>'.format(os.path.basename(__file__)))
     print()
     print('Arguments:')
     print('    <result_folder>          URL to a folder containing force learn classification results')
-    print('    <output_file>            URL to a file for saving statistic data')
+    print('    <output_file>            URL to a file for saving statistic data, format depends on extension: '
+          '.hdf5, .parquet, .csv or .bin (legacy dict of RMSE and STD lists)')
+    print('    --jobs <N>               number of result files processed in parallel, default number of CPUs')
     print()
     print('Example:')
-    print('{:s} ../putEMG/force_learn_results/ ../putEMG/force_learn_stats.bin'.format(os.path.basename(__file__)))
+    print('{:s} ../putEMG/force_learn_results/ ../putEMG/force_learn_stats.hdf5'.format(os.path.basename(__file__)))
     exit(1)
 
 
@@ -23,6 +29,8 @@ if __name__ == '__main__':
     if '-h' in sys.argv or '--help' in sys.argv:
         usage()
 
+    jobs = pop_option(sys.argv, '--jobs', os.cpu_count(), int)
+
     if len(sys.argv) != 3:
         print('Illegal number of parameters')
         usage()
@@ -34,23 +42,25 @@ if __name__ == '__main__':
 
     output_url = os.path.abspath(sys.argv[2])
 
-    all_files = [f for f in sorted(glob.glob(os.path.join(results_url, "*.bin")))]
-
-    results: Dict[Tuple[str, str, str], Dict[str, any]] = dict()
-
-    for file_url in tqdm(all_files, desc="Processing files"):
-        data = pickle.load(open(file_url, "rb"))
+    # result store stems or pickled .bin files, each holding results of a single subject and day
+    all_files = result_stats.list_result_files(results_url)
 
-        for d in data['results']:
-            error = d['y_true'] - d['y_pred'].reshape(d['y_true'].shape)
-            rmse = np.sqrt(np.mean(np.power(error, 2)))
-            std = np.std(error)
+    rows: Dict[str, List[Dict[str, any]]] = dict()
 
-            key = (d['reg'], d['feature_set'], d['trajectory'])
-            results.setdefault(key, {}).setdefault('rmse', []).append(rmse)
-            results[key].setdefault('std', []).append(std)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(result_stats.result_file_stats, results_url, f): f for f in all_files}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Processing files"):
+            rows[futures[future]] = future.result()
 
-        del data
+    # keep order of result files, so stats lists are the same regardless of completion order
+    stats = pd.DataFrame([row for f in all_files for row in rows[f]],
+                         columns=result_stats.KEY_COLUMNS + ['n'] + result_stats.METRICS)
 
-    pickle.dump(results, open(output_url,"wb"))
+    print()
+    print(stats.groupby(['reg', 'feature_set', 'trajectory'])[result_stats.METRICS].mean().to_string())
+    print()
+    print(stats.groupby(['subject', 'reg'])[result_stats.METRICS].mean().to_string())
+    print()
+    print(stats.groupby(['split', 'reg'])[result_stats.METRICS].mean().to_string())
 
+    result_stats.save_stats(stats, output_url)
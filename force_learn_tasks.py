@@ -0,0 +1,333 @@
+import os
+import time
+import json
+import pickle
+import shutil
+import tempfile
+import traceback
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Iterator, Tuple, Union, Optional
+
+import numpy as np
+import pandas as pd
+
+from putemg_features import biolab_utilities
+
+import instrumentation
+import regressors
+import warm_training
+from script_utilities import atomic_output
+
+
+# process pool is restarted this many times after a worker process dies, then remaining units run in a pool of their own
+MAX_POOL_RESTARTS = 2
+
+# rows of each recording prepared to find layout of prepare_force_data output of a single feature set or trajectory
+LAYOUT_ROWS = 64
+
+
+class SharedArrays:
+    """Scratch folder of memory-mapped arrays, shared read-only by worker processes instead of pickled copies"""
+
+    def __init__(self, parent_folder: str = None):
+        self.folder = tempfile.mkdtemp(prefix='force_learn_', dir=parent_folder)
+        self._count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def put(self, data) -> Dict[str, any]:
+        """Saves DataFrame or Series to memory-mapped file, returns descriptor used to load it in a worker"""
+        path = os.path.join(self.folder, '{:d}.npy'.format(self._count))
+        self._count += 1
+        np.save(path, data.values)
+
+        if isinstance(data, pd.Series):
+            return {"path": path, "name": data.name}
+        return {"path": path, "columns": list(data.columns)}
+
+    @staticmethod
+    def load(descriptor: Dict[str, any], columns: Union[slice, List[int], int] = None):
+        """Returns DataFrame or Series backed by memory-mapped file
+
+        Optionally only selected column positions of a DataFrame are returned, slice of columns does not copy data.
+        A single column position (not a list) selects a Series, as DataFrame.iloc does.
+        """
+        values = np.load(descriptor["path"], mmap_mode='r')
+        if "columns" not in descriptor:
+            return pd.Series(values, name=descriptor["name"], copy=False)
+
+        if columns is None:
+            return pd.DataFrame(values, columns=descriptor["columns"], copy=False)
+        if isinstance(columns, (int, np.integer)):
+            return pd.Series(values[:, columns], name=descriptor["columns"][columns], copy=False)
+        names = descriptor["columns"][columns] if isinstance(columns, slice) else \
+            [descriptor["columns"][c] for c in columns]
+        return pd.DataFrame(values[:, columns], columns=names, copy=False)
+
+
+def column_selector(positions: List[int]) -> Union[slice, List[int]]:
+    """Returns slice if column positions are contiguous, so selection is a view, otherwise list of positions"""
+    if positions and positions == list(range(positions[0], positions[-1] + 1)):
+        return slice(positions[0], positions[-1] + 1)
+    return positions
+
+
+def column_positions(columns: Union[slice, List[int], int]) -> List[int]:
+    """Returns list of positions of a column selection"""
+    if isinstance(columns, slice):
+        return list(range(columns.start, columns.stop))
+    if isinstance(columns, (int, np.integer)):
+        return [int(columns)]
+    return list(columns)
+
+
+class SplitData:
+    """Train and test data of a single split, prepared once for all feature sets and trajectories
+
+    Input matrices contain all features used by any feature set, output matrices all fingers used by any
+    trajectory. Feature set and trajectory data are column selections of them, with columns in the order (and targets
+    in the shape - Series or DataFrame) that prepare_force_data returns for the feature set or trajectory alone. That
+    layout is found by preparing only the first rows of each recording.
+    """
+
+    def __init__(self, dfs: Dict[biolab_utilities.Record, pd.DataFrame], split: Dict[str, any],
+                 features: List[str], force_feature: str, fingers: List[int]):
+        data = biolab_utilities.prepare_force_data(dfs, split, features, force_feature, fingers)
+
+        self.train_x: pd.DataFrame = data['train']['input']
+        self.train_y: pd.DataFrame = pd.DataFrame(data['train']['output'])
+        self.test_x: pd.DataFrame = data['test']['input']
+        self.test_y: pd.DataFrame = pd.DataFrame(data['test']['output'])
+
+        self.split = split
+        self.features = features
+        self.force_feature = force_feature
+        self.fingers = fingers
+        self._samples = {r: df.iloc[:LAYOUT_ROWS] for r, df in dfs.items()}
+
+        self._input_positions = {c: i for i, c in enumerate(self.train_x.columns)}
+        self._output_positions = {c: i for i, c in enumerate(self.train_y.columns)}
+
+    def _layout(self, features: List[str], fingers: List[int]) -> Dict[str, any]:
+        return biolab_utilities.prepare_force_data(self._samples, self.split, features, self.force_feature,
+                                                   fingers)['train']
+
+    def input_columns(self, features: List[str], channel_range: Dict[str, int]) -> Union[slice, List[int]]:
+        """Returns positions of input columns of given features, for channels in given range"""
+        columns = self._layout(features, self.fingers)['input'].columns
+        # strip columns to include only selected channels, eg. only one band
+        return column_selector([self._input_positions[c] for c in columns
+                                if channel_range["begin"] <= int(c[c.rindex('_') + 1:]) <= channel_range["end"]])
+
+    def output_columns(self, trajectory: List[int]) -> Union[List[int], int]:
+        """Returns positions of output columns of given trajectory fingers, a single position for Series target"""
+        output = self._layout(self.features[:1], trajectory)['output']
+        if isinstance(output, pd.Series):
+            return self._output_positions[output.name]
+        return [self._output_positions[c] for c in output.columns]
+
+
+def fit_and_predict(task: Dict[str, any]) -> Dict[str, any]:
+    """Fits regressor pipeline to train data and runs it on test data, returns prediction and fit/predict time
+
+    Task contains regressor settings, descriptors of shared train_x, train_y and test_x of a split and positions
+    of input and output columns of task's feature set and trajectory. Multiple output columns are fitted by a single
+    multi-output regressor (one SVR per column for SVR). If task's save_model is set, fitted pipeline is returned too.
+    """
+    train_x = SharedArrays.load(task["train_x"], task["input_columns"])
+    train_y = SharedArrays.load(task["train_y"], task["output_columns"])
+    test_x = SharedArrays.load(task["test_x"], task["input_columns"])
+    reg_settings = task["reg_settings"]
+
+    start = time.time()
+    # prepare regressor pipeline
+    # fit the regressor to train data
+    pipeline = regressors.prepare_pipeline(train_x, train_y,
+                                           predictor=reg_settings["predictor"],
+                                           norm_per_feature=False,
+                                           **reg_settings["args"])
+    elapsed_fit = time.time() - start
+
+    start = time.time()
+    # run regressor on test data
+    test_y_pred = pipeline.predict(test_x)
+    elapsed_predict = time.time() - start
+
+    result = {"y_pred": test_y_pred, "fit_time": elapsed_fit, "predict_time": elapsed_predict}
+    if task.get("save_model"):
+        # fitted pipeline is sent back to be saved in model registry
+        result["pipeline"] = pipeline
+    return result
+
+
+def column_names(descriptor: Dict[str, any], columns: Union[slice, List[int], int]) -> List[str]:
+    """Returns names of selected columns of shared DataFrame"""
+    if isinstance(columns, slice):
+        return list(descriptor["columns"][columns])
+    return [descriptor["columns"][c] for c in column_positions(columns)]
+
+
+def run_unit(tasks: List[Dict[str, any]], warm_start: bool = False, compare_cold: bool = False) \
+        -> List[Tuple[Optional[Dict[str, any]], Optional[str]]]:
+    """Runs tasks one after another, returns (result, None) or (None, error description) for each task
+
+    With warm start tasks share a single WarmTrainer, if compare_cold is set each task is also fitted from scratch
+    and RMSE of both fits is added to result report.
+    """
+    trainer = warm_training.WarmTrainer() if warm_start else None
+
+    results = list()
+    for task in tasks:
+        try:
+            if trainer is None:
+                result = fit_and_predict(task)
+            else:
+                result = trainer.fit_and_predict(task, SharedArrays.load(task["train_x"], task["input_columns"]),
+                                                 SharedArrays.load(task["train_y"], task["output_columns"]),
+                                                 SharedArrays.load(task["test_x"], task["input_columns"]))
+                if compare_cold:
+                    cold = fit_and_predict(task)
+                    test_y = SharedArrays.load(task["test_y"], task["output_columns"]).values
+                    result["report"] = {"warm_rmse": regressors.rmse(test_y, result["y_pred"]),
+                                        "cold_rmse": regressors.rmse(test_y, cold["y_pred"]),
+                                        "warm_fit_time": result["fit_time"], "cold_fit_time": cold["fit_time"]}
+
+            # fit and predict are timed by each fitting path, recorded as stages of worker process
+            description = '{:s} split {:d} {:s} {:s}'.format(*task["key"])
+            instrumentation.record('fit', result["fit_time"], task=description)
+            instrumentation.record('predict', result["predict_time"], task=description)
+            results.append((result, None))
+        except Exception:
+            results.append((None, traceback.format_exc()))
+    return results
+
+
+def run_tasks(tasks: List[Dict[str, any]], jobs: int = 1, warm_start: bool = False, compare_cold: bool = False) \
+        -> Iterator[Tuple[int, Optional[Dict[str, any]], Optional[str]]]:
+    """Runs all tasks, in a process pool if jobs > 1, yields (task index, result, error) as tasks finish
+
+    Failing task does not stop the run, (index, None, error description) is yielded for it instead. If a worker
+    process dies, unfinished tasks are run again in a new pool, after MAX_POOL_RESTARTS each in a pool of its own.
+    With warm start, tasks of the same feature set are run in order of splits by a single process, as they depend
+    on each other.
+    """
+    if warm_start:
+        groups: Dict[str, List[int]] = dict()
+        for i, task in enumerate(tasks):
+            groups.setdefault(task["key"][2], []).append(i)
+        # split-major order, so inputs of a split are shared by all trajectories before moving to the next one
+        units = [sorted(indexes, key=lambda i: tasks[i]["key"][1]) for indexes in groups.values()]
+    else:
+        units = [[i] for i in range(len(tasks))]
+
+    if jobs <= 1:
+        for unit in units:
+            for i, (result, error) in zip(unit, run_unit([tasks[i] for i in unit], warm_start, compare_cold)):
+                yield i, result, error
+        return
+
+    pending = units
+    for _ in range(MAX_POOL_RESTARTS + 1):
+        lost: List[List[int]] = list()
+        for unit, results in _pool_results(pending, tasks, jobs, warm_start, compare_cold):
+            if results is None:
+                lost.append(unit)
+                continue
+            for i, (result, error) in zip(unit, results):
+                yield i, result, error
+        if not lost:
+            return
+        print('\t\tWorker process died, {:d} unfinished units are run again'.format(len(lost)), flush=True)
+        pending = lost
+
+    # a unit that kills its worker every time (eg. out of memory) fails alone, other units are finished
+    for unit in pending:
+        for _, results in _pool_results([unit], tasks, 1, warm_start, compare_cold):
+            if results is None:
+                results = [(None, 'Worker process died while running the task, eg. out of memory')] * len(unit)
+            for i, (result, error) in zip(unit, results):
+                yield i, result, error
+
+
+def _pool_results(units: List[List[int]], tasks: List[Dict[str, any]], jobs: int, warm_start: bool,
+                  compare_cold: bool) -> Iterator[Tuple[List[int], Optional[List]]]:
+    """Runs units in a process pool, yields (unit, results of run_unit) as units finish
+
+    Results are None for units lost because a worker process died - all units unfinished at that time, as it is
+    not known which of them killed the worker.
+    """
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(run_unit, [tasks[i] for i in unit], warm_start, compare_cold): unit
+                   for unit in units}
+        for future in as_completed(futures):
+            unit = futures[future]
+            try:
+                yield unit, future.result()
+            except BrokenProcessPool:
+                yield unit, None
+            except Exception as e:
+                yield unit, [(None, repr(e))] * len(unit)
+
+
+def task_key(record: Dict[str, any]) -> Tuple[str, int, str, str, Optional[str]]:
+    """Returns (trajectory, split, feature set, regressor, settings hash) identifying task of a result record, results
+    of the same task names fitted with different settings (eg. regressor arguments) have different keys"""
+    return record["trajectory"], record["split"], record["feature_set"], record["reg"], record.get("settings_hash")
+
+
+class Checkpoints:
+    """Folder of per-task result checkpoints of a single subject and day, written atomically as tasks finish"""
+
+    def __init__(self, folder: str):
+        self.folder = folder
+
+    def exists(self) -> bool:
+        return os.path.isdir(self.folder)
+
+    def _path(self, key: Tuple[str, int, str, str, str], extension: str) -> str:
+        filename = '_'.join(str(k) for k in key).replace('/', '_') + extension
+        return os.path.join(self.folder, filename)
+
+    def is_done(self, key: Tuple[str, int, str, str, str]) -> bool:
+        return os.path.isfile(self._path(key, '.pkl'))
+
+    def save(self, key: Tuple[str, int, str, str, str], record: Dict[str, any]):
+        """Saves result record of a task, removing failure of its previous run"""
+        os.makedirs(self.folder, exist_ok=True)
+        path = self._path(key, '.pkl')
+        temp_path = atomic_output(path)
+        with open(temp_path, 'wb') as f:
+            pickle.dump(record, f)
+        os.replace(temp_path, path)
+
+        if os.path.isfile(self._path(key, '.failed')):
+            os.remove(self._path(key, '.failed'))
+
+    def load(self, key: Tuple[str, int, str, str, str]) -> Dict[str, any]:
+        with open(self._path(key, '.pkl'), 'rb') as f:
+            return pickle.load(f)
+
+    def fail(self, key: Tuple[str, int, str, str, str], error: str):
+        """Records failure of a task, it will be run again on restart"""
+        os.makedirs(self.folder, exist_ok=True)
+        with open(self._path(key, '.failed'), 'w') as f:
+            json.dump({"trajectory": key[0], "split": key[1], "feature_set": key[2], "reg": key[3],
+                       "settings_hash": key[4], "error": error}, f)
+
+    def failure(self, key: Tuple[str, int, str, str, str]) -> Dict[str, any]:
+        """Returns failure record of a task"""
+        path = self._path(key, '.failed')
+        if not os.path.isfile(path):
+            return {"trajectory": key[0], "split": key[1], "feature_set": key[2], "reg": key[3],
+                    "settings_hash": key[4], "error": 'not run'}
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def clear(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
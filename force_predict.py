@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import glob
+
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+import feature_store
+from model_registry import ModelRegistry, KEY_FIELDS, record_name
+from mvc_index import mvc_key
+import results_store
+from script_utilities import pop_option
+
+
+# feature rows predicted at once by default
+BATCH_ROWS = 1000000
+
+
+def usage():
+    print()
+    print('Predicts force of feature files with fitted models saved by force_learn.py --save-models')
+    print()
+    print('Usage: {:s} [options] <model_registry> <putEMG_HDF5_feature_folder> <output_folder>'.
+          format(os.path.basename(__file__)))
+    print()
+    print('Arguments:')
+    print('    <model_registry>                 URL to a model registry folder')
+    print('    <putEMG_HDF5_feature_folder>     URL to a folder containing HDF5 files with features or columnar '
+          'feature store')
+    print('    <output_folder>                  URL to a folder for predictions, written as results store')
+    print()
+    print('Options:')
+    print('    --subject, --date, --split, --feature-set, --reg, --trajectory <value>')
+    print('                                     use only models with given key value')
+    print('    --version <N>                    use given model version instead of the latest one')
+    print('    --match <test|subject|day|none>  recordings a model is applied to - test recordings of its split, of '
+          'the same subject, the same subject and day, or all, default test, each prediction has "role" of the '
+          'recording for the model - test, train (recording the model was fitted on) or other')
+    print('    --batch-rows <N>                 number of feature rows of multiple files read and predicted at once, '
+          'bounds memory, default {:d}'.format(BATCH_ROWS))
+    print('    --cache-size <N>                 number of loaded models kept in memory, default 16')
+    print()
+    print('Example:')
+    print('{:s} --reg SVR ../putEMG/force_models/ ../putEMG/Data-HDF5-filtered-feature ../putEMG/force_predictions/'.
+          format(os.path.basename(__file__)))
+    exit(1)
+
+
+class ModelCache:
+    """Models of registry loaded on first use, least recently used ones are released"""
+
+    def __init__(self, registry: ModelRegistry, size: int):
+        self.registry = registry
+        self.size = size
+        self._models: OrderedDict = OrderedDict()
+
+    def get(self, meta: Dict[str, any]) -> Dict[str, any]:
+        name = (tuple(str(meta["key"][f]) for f in KEY_FIELDS), meta["version"])
+        if name in self._models:
+            self._models.move_to_end(name)
+            return self._models[name]
+
+        model = self.registry.load(meta["key"], meta["version"])
+        self._models[name] = model
+        if len(self._models) > self.size:
+            self._models.popitem(last=False)
+        return model
+
+
+def record_role(meta: Dict[str, any], name: str) -> str:
+    """Returns role of a recording for a model - "test" or "train" recording of its split, or "other" """
+    if name in meta.get("test_records", []):
+        return 'test'
+    if name in meta.get("train_records", []):
+        return 'train'
+    return 'other'
+
+
+def applies_to(meta: Dict[str, any], name: str, recording: Tuple[str, str], match: str) -> bool:
+    """Checks if model should be applied to a recording of given name and (subject, date)"""
+    if match == 'test':
+        return record_role(meta, name) == 'test'
+    if match == 'none':
+        return True
+    if str(meta["key"]["subject"]) != recording[0]:
+        return False
+    return match == 'subject' or str(meta["key"]["date"]) == recording[1]
+
+
+def predict_files(registry: ModelRegistry, models: List[Dict[str, any]], files: List[str], output_folder: str,
+                  match: str = 'test', batch_rows: int = BATCH_ROWS, cache_size: int = 16,
+                  meta: Dict[str, any] = None) -> List[str]:
+    """Predicts force of feature files with models of given metadata, returns names of written recordings
+
+    Only columns used by models applied to a file are read, in chunks. Rows of consecutive files are stacked up to
+    batch_rows rows, so each model predicts many files at once, and feature rows held at once are bounded by batch_rows
+    and a chunk read for the next batch.
+    Predictions of a file are written as results store as soon as all its rows are predicted, with "role" of the
+    recording for each model (see record_role). Models whose input columns are missing in a file are skipped.
+    """
+    cache = ModelCache(registry, cache_size)
+
+    # models applied to each file and columns read for them
+    applied: Dict[str, List[int]] = dict()
+    columns: Dict[str, List[str]] = dict()
+    for f in files:
+        name = record_name(f)
+        recording = mvc_key(os.path.basename(f))[1:]
+        candidates = [i for i, m in enumerate(models) if applies_to(m, name, recording, match)]
+        if not candidates:
+            continue
+
+        available = set(feature_store.feature_columns(f))
+        missing = [c for i in candidates for c in models[i]["input_columns"] if c not in available]
+        if missing:
+            candidates = [i for i in candidates if all(c in available for c in models[i]["input_columns"])]
+            print('Skipping models of {:s} without their input columns, eg. {:s} - {:d} models left'.format(
+                name, missing[0], len(candidates)), flush=True)
+        if not candidates:
+            continue
+
+        applied[f] = candidates
+        used = [c for i in candidates for c in models[i]["input_columns"]] + \
+            [c for i in candidates for c in models[i]["output_columns"] if c in available]
+        columns[f] = list(OrderedDict.fromkeys(used))
+
+    # predicted and true values of each model applied to a file, in order of its chunks
+    predictions: Dict[str, Dict[int, Tuple[List[np.ndarray], List[np.ndarray]]]] = dict()
+    pieces: List[Tuple[str, pd.DataFrame]] = list()
+    read: List[str] = list()
+    written: List[str] = list()
+
+    def predict_pieces():
+        # models with the same input columns share stacked inputs of chunks
+        groups: Dict[Tuple[str, ...], List[int]] = dict()
+        for i in sorted(set(i for f, _ in pieces for i in applied[f])):
+            groups.setdefault(tuple(models[i]["input_columns"]), []).append(i)
+
+        for input_columns, group in groups.items():
+            targets = [(f, chunk) for f, chunk in pieces if any(i in applied[f] for i in group)]
+            x = np.concatenate([chunk[list(input_columns)].values for _, chunk in targets])
+            offsets = np.cumsum([0] + [len(chunk) for _, chunk in targets])
+
+            for i in group:
+                model_targets = [j for j, (f, _) in enumerate(targets) if i in applied[f]]
+                # only rows of files the model applies to are predicted
+                target_x = x if len(model_targets) == len(targets) else \
+                    np.concatenate([x[offsets[j]:offsets[j + 1]] for j in model_targets])
+                y_pred = np.asarray(cache.get(models[i])["pipeline"].predict(
+                    pd.DataFrame(target_x, columns=list(input_columns))))
+                y_pred = y_pred.reshape(len(target_x), -1)
+
+                begin = 0
+                for j in model_targets:
+                    f, chunk = targets[j]
+                    y_preds, y_trues = predictions.setdefault(f, dict()).setdefault(i, (list(), list()))
+                    y_preds.append(y_pred[begin:begin + len(chunk)])
+                    begin += len(chunk)
+                    if all(c in chunk.columns for c in models[i]["output_columns"]):
+                        y_trues.append(chunk[models[i]["output_columns"]].values.astype(float))
+        pieces.clear()
+
+        # files read completely are predicted completely now
+        for f in read:
+            write(f)
+        read.clear()
+
+    def write(f: str):
+        name = record_name(f)
+        recording = mvc_key(os.path.basename(f))[1:]
+        results = predictions.pop(f, dict())
+        writer = results_store.ResultsWriter(output_folder, name)
+        for i in applied[f]:
+            m = models[i]
+            y_preds, y_trues = results.get(i, (list(), list()))
+            record = dict(m["key"])
+            record["version"] = m["version"]
+            record["role"] = record_role(m, name)
+            record["y_pred"] = np.concatenate(y_preds) if y_preds else np.empty((0, len(m["output_columns"])))
+            if all(c in columns[f] for c in m["output_columns"]):
+                record["y_true"] = np.concatenate(y_trues) if y_trues else np.empty((0, len(m["output_columns"])))
+            writer.append(record)
+        writer.close({"id": '{:s}/{:s}'.format(*recording), "source": f, "match": match, **(meta or dict())})
+        written.append(name)
+        print('Predictions of {:d} models written to {:s}'.format(len(applied[f]), name), flush=True)
+
+    rows = 0
+    for f in applied:
+        for chunk in feature_store.read_chunks(f, columns[f], batch_rows):
+            if pieces and rows + len(chunk) > batch_rows:
+                predict_pieces()
+                rows = 0
+            pieces.append((f, chunk))
+            rows += len(chunk)
+        read.append(f)
+    predict_pieces()
+    return written
+
+
+if __name__ == '__main__':
+    if '-h' in sys.argv or '--help' in sys.argv:
+        usage()
+
+    filters = {f: pop_option(sys.argv, '--' + f.replace('_', '-'), None) for f in KEY_FIELDS}
+    version = pop_option(sys.argv, '--version', None, int)
+    match = pop_option(sys.argv, '--match', 'test')
+    batch_rows = pop_option(sys.argv, '--batch-rows', BATCH_ROWS, int)
+    cache_size = pop_option(sys.argv, '--cache-size', 16, int)
+    if match not in ('test', 'subject', 'day', 'none'):
+        print('Unknown match - {:s}'.format(match))
+        usage()
+
+    if len(sys.argv) != 4:
+        print('Illegal number of parameters')
+        usage()
+
+    registry_folder = os.path.abspath(sys.argv[1])
+    input_folder = os.path.abspath(sys.argv[2])
+    output_folder = os.path.abspath(sys.argv[3])
+    for folder in (registry_folder, input_folder):
+        if not os.path.isdir(folder):
+            print('{:s} is not a valid folder'.format(folder))
+            usage()
+    os.makedirs(output_folder, exist_ok=True)
+
+    registry = ModelRegistry(registry_folder)
+    # only metadata is read here, models are loaded when they predict their first batch
+    models = registry.list(version, **filters)
+    print('Found {:d} models'.format(len(models)))
+    if match == 'test':
+        unsplit = sum(1 for m in models if "test_records" not in m)
+        if unsplit:
+            print('{:d} models have no test recordings saved, they are applied only with --match subject, day or '
+                  'none'.format(unsplit))
+
+    if feature_store.is_feature_store(input_folder):
+        all_files = [f for f in feature_store.list_feature_files(input_folder) if not ("bias" in f or "mvc" in f)]
+    else:
+        all_files = [f for f in sorted(glob.glob(os.path.join(input_folder, "*.hdf5")))
+                     if not ("bias" in f or "mvc" in f)]
+
+    predict_files(registry, models, all_files, output_folder, match, batch_rows, cache_size, {"filters": filters})
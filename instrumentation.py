@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import resource
+import threading
+
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+
+# trace file is passed to worker processes through environment, so stages run in process pools are recorded too
+TRACE_VARIABLE = 'PUTEMG_TRACE'
+
+# traces with this extension are written in Chrome trace event format (chrome://tracing, Perfetto), others as JSON
+# lines with the same events
+CHROME_EXTENSION = '.json'
+
+
+def peak_rss() -> int:
+    """Returns peak resident memory of this process in bytes"""
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reset_peak_rss():
+    """Resets peak resident memory reported by current_peak_rss, where supported by the system (Linux 4.0+)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def current_peak_rss() -> int:
+    """Returns peak resident memory since last reset_peak_rss, or since process start if reset is not supported"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return peak_rss()
+
+
+def io_counters() -> Tuple[int, int]:
+    """Returns number of bytes read and written by this process, including page cache hits, (0, 0) if unknown"""
+    counters: Dict[str, int] = dict()
+    try:
+        with open('/proc/self/io', 'r') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                counters[name] = int(value)
+    except (OSError, ValueError):
+        pass
+    return counters.get('rchar', 0), counters.get('wchar', 0)
+
+
+def enable(trace_file: str):
+    """Starts recording stages of this process and its workers to given trace file, existing trace is replaced"""
+    trace_file = os.path.abspath(trace_file)
+    with open(trace_file, 'w') as f:
+        if trace_file.endswith(CHROME_EXTENSION):
+            # closing bracket is optional in Chrome trace format, so events can be appended by any process
+            f.write('[\n')
+    os.environ[TRACE_VARIABLE] = trace_file
+
+
+def trace_file() -> str:
+    return os.environ.get(TRACE_VARIABLE)
+
+
+def _emit(name: str, start: float, seconds: float, args: Dict[str, any]):
+    path = trace_file()
+    event = {"name": name, "cat": "putemg", "ph": "X", "ts": int(start * 1e6), "dur": int(seconds * 1e6),
+             "pid": os.getpid(), "tid": threading.get_ident(), "args": args}
+    line = json.dumps(event, default=str) + (',\n' if path.endswith(CHROME_EXTENSION) else '\n')
+    # single append of a whole line, events of concurrent processes are not interleaved
+    with open(path, 'a') as f:
+        f.write(line)
+
+
+@contextmanager
+def stage(name: str, **args):
+    """Records duration, peak memory and bytes read/written of enclosed block, eg. with stage('filter', file=f):
+
+    Does nothing when tracing is not enabled. Bytes of nested stages are included in enclosing stage.
+    """
+    if trace_file() is None:
+        yield
+        return
+
+    read_before, written_before = io_counters()
+    start = time.time()
+    counter = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - counter
+        read_after, written_after = io_counters()
+        args.update({"peak_rss": current_peak_rss(), "read_bytes": read_after - read_before,
+                     "write_bytes": written_after - written_before})
+        _emit(name, start, seconds, args)
+
+
+def record(name: str, seconds: float, **args):
+    """Records stage of already measured duration, ending now (eg. fit time measured in worker)"""
+    if trace_file() is None:
+        return
+    args.update({"peak_rss": current_peak_rss()})
+    _emit(name, time.time() - seconds, seconds, args)
+
+
+def read_trace(file_url: str) -> List[Dict[str, any]]:
+    """Returns events of trace file, in either format"""
+    events = list()
+    with open(file_url, 'r') as f:
+        for line in f:
+            line = line.strip().rstrip(',')
+            if line and line not in ('[', ']'):
+                events.append(json.loads(line))
+    return events
+
+
+def summary(events: List[Dict[str, any]]) -> pd.DataFrame:
+    """Returns table of stages: count, total, mean and max duration, max peak memory and total bytes read/written"""
+    table = pd.DataFrame([{"stage": e["name"], "seconds": e["dur"] / 1e6,
+                           "peak_rss": e["args"].get("peak_rss", 0),
+                           "read_bytes": e["args"].get("read_bytes", 0),
+                           "write_bytes": e["args"].get("write_bytes", 0)} for e in events],
+                         columns=["stage", "seconds", "peak_rss", "read_bytes", "write_bytes"])
+
+    grouped = table.groupby("stage", sort=False)
+    result = pd.DataFrame({"count": grouped["seconds"].count(),
+                           "total_s": grouped["seconds"].sum(),
+                           "mean_s": grouped["seconds"].mean(),
+                           "max_s": grouped["seconds"].max(),
+                           "peak_rss_mb": grouped["peak_rss"].max() / 1024 / 1024,
+                           "read_mb": grouped["read_bytes"].sum() / 1024 / 1024,
+                           "written_mb": grouped["write_bytes"].sum() / 1024 / 1024})
+    return result.sort_values("total_s", ascending=False)
+
+
+def print_summary():
+    """Prints summary of stages recorded to enabled trace file"""
+    if trace_file() is None:
+        return
+    print()
+    print('Stage timings (trace written to {:s}):'.format(trace_file()))
+    print(summary(read_trace(trace_file())).to_string(float_format='{:.2f}'.format))
@@ -0,0 +1,118 @@
+import os
+import glob
+import json
+import time
+import pickle
+
+from typing import Dict, List, Optional
+
+import sklearn
+
+from script_utilities import atomic_output
+
+
+# version of registry layout, stored with every model
+REGISTRY_FORMAT = 1
+
+# fields identifying a model, in order of registry folder levels
+KEY_FIELDS = ['subject', 'date', 'split', 'feature_set', 'reg', 'trajectory']
+
+MODEL_EXTENSION = '.pkl'
+
+
+def record_name(file_url: str) -> str:
+    """Returns name of recording of a feature file, as stored in "train_records" and "test_records" of a model"""
+    return os.path.splitext(os.path.basename(file_url))[0]
+
+
+def _escape(value) -> str:
+    # feature set and regressor names may contain characters not allowed in file names, eg. SVR[C=0.5]
+    return str(value).replace('/', '_').replace(os.sep, '_')
+
+
+class ModelRegistry:
+    """Folder of fitted pipelines keyed by subject, date, split, feature set, regressor and trajectory
+
+    Every save of the same key creates a new version: <folder>/<subject>/<date>/<split>/<feature_set>/<reg>/
+    <trajectory>/v<N>.pkl, with metadata of the model in a JSON file next to it, so models can be listed without
+    unpickling them. A model is a dict of fitted "pipeline", names of "input_columns" and "output_columns", settings
+    it was fitted with and their "settings_hash", and names of "train_records" and "test_records" of its split (see
+    record_name).
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+
+    def _key_folder(self, key: Dict[str, any]) -> str:
+        return os.path.join(self.folder, *[_escape(key[f]) for f in KEY_FIELDS])
+
+    def versions(self, key: Dict[str, any]) -> List[int]:
+        """Returns saved versions of model with given key, ascending"""
+        # key values may contain glob patterns, eg. SVR[C=0.5]
+        files = glob.glob(os.path.join(glob.escape(self._key_folder(key)), 'v*' + MODEL_EXTENSION))
+        return sorted(int(os.path.basename(f)[1:-len(MODEL_EXTENSION)]) for f in files)
+
+    def save(self, key: Dict[str, any], model: Dict[str, any]) -> int:
+        """Saves model as a new version of given key, returns the version"""
+        folder = self._key_folder(key)
+        os.makedirs(folder, exist_ok=True)
+
+        versions = self.versions(key)
+        version = versions[-1] + 1 if versions else 1
+
+        model = dict(model)
+        model["key"] = {f: key[f] for f in KEY_FIELDS}
+        model["version"] = version
+        model["created"] = time.strftime('%Y-%m-%d %H:%M:%S')
+        model["format"] = REGISTRY_FORMAT
+        model["sklearn"] = sklearn.__version__
+
+        path = os.path.join(folder, 'v{:d}'.format(version))
+        temp_file = atomic_output(path + MODEL_EXTENSION)
+        with open(temp_file, 'wb') as f:
+            pickle.dump(model, f)
+
+        # metadata is written first, model file appears last, so a listed model is always complete
+        with open(path + '.json', 'w') as f:
+            json.dump({k: v for k, v in model.items() if k != "pipeline"}, f, default=str)
+        os.replace(temp_file, path + MODEL_EXTENSION)
+        return version
+
+    def meta(self, key: Dict[str, any], version: int = None) -> Optional[Dict[str, any]]:
+        """Returns metadata of model of given key, latest version by default, None if there is no such model"""
+        versions = self.versions(key)
+        if version is None and versions:
+            version = versions[-1]
+        if version not in versions:
+            return None
+        with open(os.path.join(self._key_folder(key), 'v{:d}.json'.format(version)), 'r') as f:
+            return json.load(f)
+
+    def list(self, version: int = None, **filters) -> List[Dict[str, any]]:
+        """Returns metadata of models matching key filters (eg. reg='SVR'), latest version of each key by default"""
+        models = list()
+        pattern = os.path.join(glob.escape(self.folder), *(['*'] * len(KEY_FIELDS)), 'v*' + MODEL_EXTENSION)
+        latest: Dict[str, Dict[str, any]] = dict()
+        for model_file in sorted(glob.glob(pattern)):
+            with open(model_file[:-len(MODEL_EXTENSION)] + '.json', 'r') as f:
+                meta = json.load(f)
+            if not all(v is None or str(meta["key"][k]) == str(v) for k, v in filters.items()):
+                continue
+            if version is not None:
+                if meta["version"] == version:
+                    models.append(meta)
+                continue
+            folder = os.path.dirname(model_file)
+            if folder not in latest or latest[folder]["version"] < meta["version"]:
+                latest[folder] = meta
+        return models if version is not None else list(latest.values())
+
+    def load(self, key: Dict[str, any], version: int = None) -> Optional[Dict[str, any]]:
+        """Loads model of given key, latest version by default, None if there is no such model"""
+        versions = self.versions(key)
+        if version is None and versions:
+            version = versions[-1]
+        if version not in versions:
+            return None
+        with open(os.path.join(self._key_folder(key), 'v{:d}'.format(version) + MODEL_EXTENSION), 'rb') as f:
+            return pickle.load(f)
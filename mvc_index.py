@@ -0,0 +1,87 @@
+import os
+
+from collections import OrderedDict
+from typing import Dict, Tuple, Callable
+
+import numpy as np
+import pandas as pd
+
+
+def mvc_key(filename: str) -> Tuple[str, str, str]:
+    """Returns (experiment, subject id, date) of putEMG file name, eg. emg_force-03-sequential-2018-05-11-..."""
+    elements = os.path.basename(filename).split('-')
+    return elements[0], elements[1], '-'.join(elements[3:6])
+
+
+class MVCIndex:
+    """Index of MVC files of a putEMG folder, shared by all trials of the same subject and day
+
+    Folder is listed once, decoded MVC data is kept in a small least recently used cache, as consecutive
+    trials (sorted file names) use the same MVC file.
+    """
+
+    def __init__(self, folder: str, cache_size: int = 4):
+        self.folder = folder
+        self.cache_size = cache_size
+        self._cache: OrderedDict = OrderedDict()
+
+        self._files: Dict[Tuple[str, str, str], str] = dict()
+        for f in sorted(os.listdir(folder)):
+            elements = f.split('-')
+            if len(elements) > 5 and elements[2] == 'mvc' and f.endswith('.hdf5'):
+                self._files.setdefault(mvc_key(f), os.path.join(folder, f))
+
+    def __len__(self):
+        return len(self._files)
+
+    def find(self, filename: str) -> str:
+        """Returns path of MVC file corresponding to a given trial file"""
+        try:
+            return self._files[mvc_key(filename)]
+        except KeyError:
+            raise ValueError('MVC file for {:s} is not available'.format(os.path.basename(filename)))
+
+    def load(self, mvc_file: str) -> pd.DataFrame:
+        """Returns MVC data, decoding the file only if it is not cached"""
+        if mvc_file in self._cache:
+            self._cache.move_to_end(mvc_file)
+            return self._cache[mvc_file]
+
+        mvc = pd.read_hdf(mvc_file)
+        self._cache[mvc_file] = mvc
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return mvc
+
+
+class LinearNormalisation:
+    """Per-column affine normalisation of recording with MVC data, equal to normalise(data, mvc) (eg.
+    biolab_utilities.normalise_force_data) up to rounding
+
+    Scale and offset of each column are derived once, by normalising probe rows of zeros and ones, so consecutive
+    chunks or blocks of a recording are normalised without going over MVC data again. They are verified against
+    normalise on given sample rows of the recording, ValueError is raised if normalisation is not per-column affine.
+    """
+
+    def __init__(self, normalise: Callable[[pd.DataFrame, pd.DataFrame], pd.DataFrame], mvc: pd.DataFrame,
+                 sample: pd.DataFrame):
+        self.columns = list(sample.columns)
+        probe = normalise(pd.DataFrame(np.array([[0.0] * len(self.columns), [1.0] * len(self.columns)]),
+                                       columns=self.columns), mvc)
+        if sorted(probe.columns) != sorted(self.columns):
+            raise ValueError('Normalisation changes columns of recording, it can not be applied to parts of it')
+        probe = probe[self.columns].values.astype(float)
+        self.offset = probe[0]
+        self.scale = probe[1] - probe[0]
+
+        expected = normalise(sample, mvc)[self.columns].values.astype(float)
+        # (x - min) / range and x * scale + offset differ by rounding relative to the whole range of normalised values
+        tolerance = 1e-9 * np.nanmax(np.abs(expected), initial=1.0)
+        if not np.allclose(self.apply(sample).values, expected, rtol=1e-9, atol=tolerance, equal_nan=True):
+            raise ValueError('Normalisation is not a per-column linear function of recording values, it can not be '
+                             'applied to parts of recording')
+
+    def apply(self, data: pd.DataFrame) -> pd.DataFrame:
+        """Returns normalised copy of recording rows"""
+        return pd.DataFrame(data[self.columns].values * self.scale + self.offset, index=data.index,
+                            columns=self.columns)
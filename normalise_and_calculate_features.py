@@ -4,23 +4,44 @@ import os
 import sys
 import glob
 
+from typing import Dict
+
 import pandas as pd
 
-import putemg_features
 from putemg_features import biolab_utilities
 
+import feature_engine
+from feature_engine import FeatureDescriptor
+from feature_cache import FeatureCache
+import feature_store
+import instrumentation
+from instrumentation import stage
+from mvc_index import MVCIndex
+from script_utilities import pop_option, pop_flag
+
 
 def usage():
     print()
     print('Normalises EMG, FORCE and TRAJ to MVC, calculates signal features')
     print()
-    print('Usage: {:s} <feature_config_xml> <input_hdf5_folder> <output_hdf5_folder>'.format(os.path.basename(__file__)))
+    print('Usage: {:s} [options] <feature_config_xml> <input_hdf5_folder> <output_hdf5_folder>'.
+          format(os.path.basename(__file__)))
     print()
     print('Arguments:')
     print('    <feature_config_xml>            XML file containing feature descriptors')
     print('    <input_hdf5_folder>             putEMG HDF5 folder containing experiment data')
     print("    <output_hdf5_folder>            output HDF5 folder containing calculated feature data")
     print()
+    print('Options:')
+    print('    --batched                       calculate features with batched engine instead of putemg_features, '
+          'check parity with feature_benchmark.py first')
+    print('    --cache <folder>                folder of feature cache, only features missing in cache are calculated')
+    print('    --cache-size <MB>               size limit of feature cache, default 10240')
+    print('    --format <hdf5|parquet>         output format, parquet files are partitioned by subject id and date, '
+          'default hdf5')
+    print('    --trace <file>                  record stage timings, memory and I/O to trace file (.json - Chrome '
+          'trace format, other - JSON lines) and print summary')
+    print()
     print('Example:')
     print('{:s} force_features.xml '
           '../putEMG/Data-HDF5-filtered '
@@ -33,6 +54,15 @@ if __name__ == '__main__':
     if '-h' in sys.argv or '--help' in sys.argv:
         usage()
 
+    batched = pop_flag(sys.argv, '--batched')
+    cache_folder = pop_option(sys.argv, '--cache', None, os.path.abspath)
+    cache_size = pop_option(sys.argv, '--cache-size', 10240, int) * 1024 * 1024
+    output_format = pop_option(sys.argv, '--format', 'hdf5')
+    trace = pop_option(sys.argv, '--trace', None)
+    if output_format not in ('hdf5', 'parquet'):
+        print('Unknown output format - {:s}'.format(output_format))
+        usage()
+
     if len(sys.argv) != 4:
         print('Illegal number of parameters')
         usage()
@@ -51,37 +81,83 @@ if __name__ == '__main__':
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
+    if trace is not None:
+        instrumentation.enable(trace)
+
+    feature_config = feature_engine.FeatureConfig(xml_file_url)
+
     # list all hdf5 files in given input folder that are not bias or mvc
     all_files = [f for f in sorted(glob.glob(os.path.join(input_folder, "*.hdf5"))) if not ("bias" in f or "mvc" in f)]
 
+    # single listing of input folder, MVC file is shared by all trials of a subject in a given day
+    mvc_index = MVCIndex(input_folder)
+
+    cache = FeatureCache(cache_folder, cache_size) if cache_folder is not None else None
+
     for file in all_files:
         basename = os.path.basename(file)
         filename = os.path.splitext(basename)[0]
 
-        print('Loading {:s} file'.format(filename))
-        data = pd.read_hdf(os.path.join(input_folder, basename))
+        mvc_file = mvc_index.find(filename)
+
+        features = feature_config.all_features()
+        cached: Dict[FeatureDescriptor, pd.DataFrame] = dict()
+        keys: Dict[FeatureDescriptor, str] = dict()
+
+        if cache is not None:
+            file_hash = cache.file_hash(file)
+            mvc_hash = cache.file_hash(mvc_file)
+            for f in features:
+                keys[f] = cache.key(file_hash, mvc_hash, feature_config, f,
+                                    feature_engine.engine_description(f, batched))
+                df = cache.get(keys[f])
+                if df is not None:
+                    cached[f] = df
+
+        missing = [f for f in features if f not in cached]
 
-        print('Loading corresponding MVC file')
-        filename_elements = filename.split('-')
-        filename_elements[2] = "mvc"
-        mvc_basename = '-'.join(filename_elements[0:6])
-        mvc_filename_list = list(filter(lambda el: el.startswith(mvc_basename), os.listdir(input_folder)))
+        if missing:
+            print('Loading {:s} file'.format(filename))
+            with stage('read', file=basename):
+                data = pd.read_hdf(file)
 
-        if len(mvc_filename_list) == 0:
-            raise ValueError('MVC file for {:s} is not available'.format(filename))
+            print('Loading corresponding MVC file {:s}'.format(os.path.basename(mvc_file)))
+            with stage('read mvc', file=os.path.basename(mvc_file)):
+                mvc = mvc_index.load(mvc_file)
 
-        mvc = pd.read_hdf(os.path.join(input_folder, mvc_filename_list[0]))
+            print('Normalising {:s} file'.format(filename))
+            with stage('normalise', file=basename):
+                record = biolab_utilities.normalise_force_data(data, mvc)
 
-        print('Normalising {:s} file'.format(filename))
-        record = biolab_utilities.normalise_force_data(data, mvc)
+            print('Calculating {:d} of {:d} features for {:s} file'.format(len(missing), len(features), filename))
+            with stage('features', file=basename):
+                calculated = feature_engine.calculate_each_feature(feature_config, record, missing, batched)
 
-        print('Calculating features for {:s} file'.format(filename))
+            # each feature keeps columns it produced, features of the same name may differ in parameters
+            for f, feature_df in zip(missing, calculated):
+                cached[f] = feature_df
+                if cache is not None:
+                    cache.put(keys[f], cached[f])
+        else:
+            print('All features of {:s} file found in cache'.format(filename))
 
-        # for filtered data file run feature extraction, use xml with limited feature set
-        ft: pd.DataFrame = putemg_features.features_from_xml_on_df(xml_file_url, record)
+        # merge features in order of XML file
+        ft: pd.DataFrame = pd.concat([cached[f] for f in features], axis=1)
 
         # save extracted features file to designated folder with features_filtered_ prefix
         output_file = filename + '_features.hdf5'
-        print('Saving result to {:s} file'.format(output_file))
-        ft.to_hdf(os.path.join(output_folder, output_file),
-                  'data', format='table', mode='w', complevel=5)
+        if output_format == 'parquet':
+            output_file = feature_store.partition_path(output_folder, output_file)
+            print('Saving result to {:s} file'.format(os.path.relpath(output_file, output_folder)))
+            with stage('write', file=basename):
+                feature_store.write_features(ft, output_file)
+        else:
+            print('Saving result to {:s} file'.format(output_file))
+            with stage('write', file=basename):
+                ft.to_hdf(os.path.join(output_folder, output_file),
+                          'data', format='table', mode='w', complevel=5)
+
+    if cache is not None:
+        print('Feature cache hits: {:d}, misses: {:d}'.format(cache.hits, cache.misses))
+
+    instrumentation.print_summary()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import pickle
+
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from putemg_features import biolab_utilities
+
+import feature_engine
+from feature_engine import FeatureConfig
+from mvc_index import MVCIndex, LinearNormalisation
+import process_recordings
+import stream_filter
+from script_utilities import pop_option, pop_flag
+
+
+# default filter lookahead and context of online engine, trade delay and filter cost of each block for exactness -
+# with 0.25 s and 0.5 s, 99th percentile of relative deviation of amplitude features from offline processing is near
+# 1e-3 on synthetic recordings (synthetic_data.py), stream_filter.MARGIN on both sides makes output exact
+LOOKAHEAD = stream_filter.SAMPLING_FREQUENCY // 4
+MARGIN = stream_filter.SAMPLING_FREQUENCY // 2
+
+
+def usage():
+    print()
+    print('Estimates force online - replays putEMG recording in blocks of samples, filters, normalises and calculates '
+          'features incrementally and runs fitted regressor on each new window. Features are those of offline '
+          'processing (process_recordings.py), delayed by filter lookahead and approximated near the newest samples, '
+          'output equal to offline processing costs {:.0f} s of delay (--lookahead {:d} --margin {:d})'.format(
+              stream_filter.MARGIN / stream_filter.SAMPLING_FREQUENCY, stream_filter.MARGIN, stream_filter.MARGIN))
+    print()
+    print('Usage: {:s} [options] <feature_config_xml> <putEMG_HDF5_file>'.format(os.path.basename(__file__)))
+    print()
+    print('Arguments:')
+    print('    <feature_config_xml>            XML file containing feature descriptors (windowing and EMG features)')
+    print('    <putEMG_HDF5_file>              raw putEMG recording, its MVC file has to be in the same folder')
+    print()
+    print('Options:')
+    print('    --model <file>                  pickled model: dict of fitted "pipeline", "input_columns" and '
+          '"output_columns", eg. model registry file saved by force_learn.py --save-models, without model only '
+          'features are calculated')
+    print('    --block-size <N>                number of samples delivered at once, default window step')
+    print('    --budget-ms <ms>                latency budget of a single block, default block duration')
+    print('    --lookahead <N>                 samples received after a sample before it is filtered, algorithmic '
+          'delay of output, default {:d} ({:.0f} ms), output is equal to offline processing from {:d} on'.format(
+              LOOKAHEAD, 1000.0 * LOOKAHEAD / stream_filter.SAMPLING_FREQUENCY, stream_filter.MARGIN))
+    print('    --margin <N>                    received samples before pending ones filtered as their context, '
+          'default {:d}, each block filters margin, lookahead and block samples'.format(MARGIN))
+    print('    --batched                       calculate features with batched engine instead of putemg_features, '
+          'use the same setting as for offline features the model was trained on')
+    print('    --realtime                      deliver blocks at amplifier sampling rate, not as fast as possible')
+    print('    --verify                        compare online features with offline processing of whole recording '
+          '(filter, normalise, features) and report relative deviation, with exact lookahead and margin fail if '
+          'they differ')
+    print('    --output <file>                 save predictions (or features without model) to CSV file')
+    print()
+    print('Example:')
+    print('{:s} --model model.bin force_features.xml ../putEMG/Data-HDF5/emg_force-03-sequential-2018-05-11-...'
+          .format(os.path.basename(__file__)))
+    exit(1)
+
+
+def load_model(file_url: str) -> Dict[str, any]:
+    """Loads pickled model - dict of fitted "pipeline", "input_columns" (feature names) and "output_columns" """
+    with open(file_url, 'rb') as f:
+        return pickle.load(f)
+
+
+class OnlineEstimator:
+    """Incremental filter, normalisation, feature and regression engine for consecutive blocks of a single putEMG
+    recording
+
+    Output approximates the offline pipeline over the whole recording (biolab_utilities.apply_filter,
+    normalise_force_data and features, see offline_features), delayed by lookahead samples: a sample is filtered once
+    lookahead later samples are received, with margin samples before it (stream_filter.LookaheadFilter), flush()
+    processes the rest at the end of recording. With stream_filter.MARGIN as lookahead and margin output is the same as
+    offline. mvc is filtered MVC data, normalisation is derived from it once.
+    """
+
+    def __init__(self, config: FeatureConfig, mvc: pd.DataFrame, model: Dict[str, any] = None, batched: bool = False,
+                 lookahead: int = LOOKAHEAD, margin: int = MARGIN):
+        self.model = model
+        self.filter = stream_filter.LookaheadFilter(biolab_utilities.apply_filter, margin, lookahead)
+        self.normalisation = LinearNormalisation(biolab_utilities.normalise_force_data, mvc,
+                                                 mvc.iloc[:process_recordings.NORMALISATION_SAMPLE_ROWS])
+        self.features = feature_engine.FeatureStream(config, process_recordings.feature_function(config, batched))
+
+    @property
+    def windows(self) -> int:
+        return self.features.windows
+
+    def process(self, block: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Processes next block of raw samples, returns features and predictions of windows completed by filtered
+        samples, both None if there are none
+
+        Predictions are None without model.
+        """
+        return self._estimate(self.filter.push(block))
+
+    def flush(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Processes samples still waiting for lookahead at the end of recording, returns as process"""
+        return self._estimate(self.filter.flush())
+
+    def _estimate(self, filtered: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        if not len(filtered):
+            return None, None
+        features = self.features.push(self.normalisation.apply(filtered))
+        if features is None or self.model is None:
+            return features, None
+        predictions = self.model["pipeline"].predict(features[self.model["input_columns"]])
+        predictions = pd.DataFrame(np.asarray(predictions).reshape(len(features), -1), index=features.index,
+                                   columns=self.model["output_columns"])
+        return features, predictions
+
+
+def offline_features(config: FeatureConfig, data: pd.DataFrame, mvc: pd.DataFrame,
+                     batched: bool = False) -> pd.DataFrame:
+    """Calculates features of whole recording as the offline pipeline does (filter, normalise, features)"""
+    data = data.copy()
+    biolab_utilities.apply_filter(data)
+    record = biolab_utilities.normalise_force_data(data, mvc)
+    return process_recordings.feature_function(config, batched)(record)
+
+
+def relative_deviation(reference: pd.DataFrame, calculated: pd.DataFrame) -> pd.Series:
+    """Returns max absolute difference of each feature column relative to max absolute reference value of the column
+
+    Features of a single frequency bin (eg. PKF) deviate by whole bins, when a small difference changes the peak.
+    """
+    scale = reference.abs().max().replace(0, 1)
+    return ((calculated[reference.columns] - reference).abs().max() / scale).dropna()
+
+
+if __name__ == '__main__':
+    if '-h' in sys.argv or '--help' in sys.argv:
+        usage()
+
+    model_file = pop_option(sys.argv, '--model', None)
+    block_size = pop_option(sys.argv, '--block-size', None, int)
+    budget_ms = pop_option(sys.argv, '--budget-ms', None, float)
+    lookahead = pop_option(sys.argv, '--lookahead', LOOKAHEAD, int)
+    margin = pop_option(sys.argv, '--margin', MARGIN, int)
+    batched = pop_flag(sys.argv, '--batched')
+    realtime = pop_flag(sys.argv, '--realtime')
+    verify = pop_flag(sys.argv, '--verify')
+    output_file = pop_option(sys.argv, '--output', None)
+
+    if len(sys.argv) != 3:
+        print('Illegal number of parameters')
+        usage()
+
+    xml_file_url = os.path.abspath(sys.argv[1])
+    if not os.path.isfile(xml_file_url):
+        print('XML file with feature descriptors does not exist - {:s}'.format(xml_file_url))
+        usage()
+
+    input_file = os.path.abspath(sys.argv[2])
+    if not os.path.isfile(input_file):
+        print('putEMG file does not exist - {:s}'.format(input_file))
+        usage()
+
+    config = FeatureConfig(xml_file_url)
+    block_size = block_size if block_size is not None else config.step
+    # by default a block has to be processed before the next one arrives
+    budget = (budget_ms if budget_ms is not None else 1000.0 * block_size / stream_filter.SAMPLING_FREQUENCY) / 1000
+
+    # MVC is filtered with the same filter as the recording, once before replay
+    mvc_index = MVCIndex(os.path.dirname(input_file))
+    mvc: pd.DataFrame = process_recordings.read_filtered(mvc_index.find(os.path.basename(input_file)))
+
+    model = load_model(model_file) if model_file is not None else None
+    estimator = OnlineEstimator(config, mvc, model, batched, lookahead, margin)
+
+    # recording is loaded before replay, it stands in for amplifier delivering blocks of samples
+    data: pd.DataFrame = pd.read_hdf(input_file)
+
+    latencies = list()
+    outputs: List[pd.DataFrame] = list()
+    online: List[pd.DataFrame] = list()
+
+    def collect(features: pd.DataFrame, predictions: pd.DataFrame):
+        if features is None:
+            return
+        outputs.append(predictions if predictions is not None else features)
+        if verify:
+            online.append(features)
+
+    print('Replaying {:s}: {:d} samples in blocks of {:d}'.format(os.path.basename(input_file), len(data), block_size))
+    replay_start = time.perf_counter()
+    for begin in range(0, len(data), block_size):
+        if realtime:
+            # wait until block would be delivered by amplifier
+            delay = replay_start + (begin + block_size) / stream_filter.SAMPLING_FREQUENCY - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        start = time.perf_counter()
+        features, predictions = estimator.process(data.iloc[begin:begin + block_size])
+        # every block is timed, blocks completing no window still filter and buffer samples
+        latencies.append(time.perf_counter() - start)
+        collect(features, predictions)
+
+    start = time.perf_counter()
+    collect(*estimator.flush())
+    flush_time = time.perf_counter() - start
+    total = time.perf_counter() - replay_start
+
+    latencies = np.array(latencies) * 1000
+    print()
+    print('Windows: {:d}, blocks: {:d}, blocks with output: {:d}'.format(estimator.windows, len(latencies),
+                                                                         len(outputs)))
+    print('Algorithmic delay: {:d} samples ({:.1f} ms) of filter lookahead, window of {:d} samples ({:.1f} ms)'.format(
+        lookahead, 1000.0 * lookahead / stream_filter.SAMPLING_FREQUENCY, config.window,
+        1000.0 * config.window / stream_filter.SAMPLING_FREQUENCY))
+    if len(latencies):
+        print('Block latency p50: {:.3f} ms, p99: {:.3f} ms, max: {:.3f} ms, over budget ({:.1f} ms): {:d}'.format(
+            np.percentile(latencies, 50), np.percentile(latencies, 99), latencies.max(), budget * 1000,
+            int(np.sum(latencies > budget * 1000))))
+    print('End of recording flush: {:.3f} ms'.format(flush_time * 1000))
+    print('Throughput: {:.0f} samples/s ({:.1f}x real time), {:.0f} windows/s'.format(
+        len(data) / total, len(data) / total / stream_filter.SAMPLING_FREQUENCY, estimator.windows / total))
+
+    if verify:
+        reference = offline_features(config, data, mvc, batched)
+        calculated = pd.concat(online) if online else pd.DataFrame(columns=reference.columns)
+        reference = reference[calculated.columns]
+        if not reference.index.equals(calculated.index):
+            print('Online features are calculated for different windows than offline processing')
+            exit(1)
+        deviation = relative_deviation(reference, calculated)
+        if len(deviation):
+            print('Relative deviation from offline processing: median {:.2e}, 99th percentile {:.2e}, max {:.2e} '
+                  '({:s})'.format(deviation.median(), deviation.quantile(0.99), deviation.max(), deviation.idxmax()))
+        if min(lookahead, margin) >= stream_filter.MARGIN:
+            if not np.allclose(reference.values, calculated.values, rtol=1e-7,
+                               atol=1e-9 * np.nanmax(np.abs(reference.values), initial=1.0), equal_nan=True):
+                print('Online features differ from offline processing, margin is too short for the filter')
+                exit(1)
+            print('Online features match offline processing')
+
+    if output_file is not None and outputs:
+        pd.concat(outputs).to_csv(output_file)
+        print('Output written to {:s}'.format(output_file))
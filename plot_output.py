@@ -3,14 +3,39 @@ import matplotlib.pyplot as plt
 from matplotlib.widgets import Slider
 from matplotlib import gridspec
 
-from typing import Dict, List
+from functools import lru_cache
+from threading import Thread
+from typing import Dict, Tuple
 
 import click
-from tqdm import tqdm
 
-import pickle
 import os
-import glob
+
+import results_store
+
+
+def minmax_decimate(y: np.ndarray, start: int, stop: int, buckets: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns x and y of a range of 1D signal reduced to min and max sample of each of given number of buckets
+
+    Shape of decimated trace drawn at given pixel width is the same as of the full signal.
+    """
+    start, stop = max(int(start), 0), min(int(stop), len(y))
+    if stop - start <= 2 * buckets:
+        return np.arange(start, stop), np.asarray(y[start:stop])
+
+    size = -(-(stop - start) // buckets)
+    whole = (stop - start) // size
+    blocks = np.asarray(y[start:start + whole * size]).reshape(whole, size)
+
+    arg_min = np.argmin(blocks, axis=1)
+    arg_max = np.argmax(blocks, axis=1)
+    # min and max of each bucket in order of appearance, so the trace is not drawn backwards
+    x = np.stack((np.minimum(arg_min, arg_max), np.maximum(arg_min, arg_max)), axis=1)
+    x = (x + np.arange(whole)[:, np.newaxis] * size).ravel() + start
+
+    # samples of last, incomplete bucket are kept as they are
+    x = np.concatenate((x, np.arange(start + whole * size, stop)))
+    return x, np.asarray(y[x])
 
 
 @click.command()
@@ -18,31 +43,48 @@ import glob
 @click.option('-r', '--regressor', 'regressor', type=str, required=True)
 @click.option('-t', '--trajectory', 'trajectory', type=str, required=True)
 @click.option('-f', '--feature-set', 'feature_set', type=str, required=True)
-def cls(result_folder, regressor, trajectory, feature_set):
+@click.option('-c', '--cache-size', 'cache_size', type=int, default=8, show_default=True,
+              help='Number of loaded results kept in memory')
+def cls(result_folder, regressor, trajectory, feature_set, cache_size):
     """Displays the results of force learn with a given combination of trajectory, regressor and feature set"""
 
     results_url = os.path.abspath(result_folder)
-    all_files = [f for f in sorted(glob.glob(os.path.join(results_url, "*.bin")))]
-
-    results: List[Dict[str, any]] = list()
-
-    for file_url in tqdm(all_files, desc='Reading force learn data to memory'):
-        data = pickle.load(open(file_url, "rb"))
-
-        for d in data['results']:
-            if d['reg'] == regressor and d['feature_set'] == feature_set and  d['trajectory'] == trajectory:
-                results.append({})
-                results[-1]['y_pred'] = d['y_pred'].reshape(d['y_true'].shape)
-                results[-1]['y_true'] = d['y_true']
-                results[-1]['error'] = np.clip(d['y_true'] - results[-1]['y_pred'], -10, 10)
-                results[-1]['split'] = d['split']
-                results[-1]['id'] = os.path.splitext(os.path.basename(file_url))[0][-13:]
-                results[-1]['rmse'] = np.sqrt(np.mean(np.power(results[-1]['error'], 2)))
-                results[-1]['std'] = np.std(results[-1]['error'])
 
-        del data
-
-    if len(results) > 0:
+    # only locations of matching results are indexed, data is loaded when displayed
+    print('Indexing force learn results...')
+    located = results_store.index_results(results_url, reg=regressor, feature_set=feature_set, trajectory=trajectory)
+
+    @lru_cache(maxsize=cache_size)
+    def load(index: int) -> Dict[str, any]:
+        stem, locator, fields = located[index]
+        d = results_store.load_indexed(results_url, stem, locator)
+
+        result = dict()
+        # single output may be saved as 1-D array, traces are columns of 2-D arrays
+        y_true = np.asarray(d['y_true'])
+        result['y_true'] = y_true.reshape(len(y_true), -1)
+        result['y_pred'] = np.asarray(d['y_pred']).reshape(result['y_true'].shape)
+        result['error'] = np.clip(result['y_true'] - result['y_pred'], -10, 10)
+        result['split'] = fields['split']
+        result['id'] = stem[-13:]
+        result['rmse'] = np.sqrt(np.mean(np.power(result['error'], 2)))
+        result['std'] = np.std(result['error'])
+        return result
+
+    def prefetch(index: int):
+        # neighbours are loaded in background, so stepping with slider or arrow keys does not wait for data, only
+        # records of results store are mapped on their own - a record of pickled .bin file needs the whole file
+        # loaded, which is cached by load_indexed
+        if not isinstance(located[index][1], dict):
+            return
+
+        def run():
+            for i in (index + 1, index - 1):
+                if 0 <= i < len(located):
+                    load(i)
+        Thread(target=run, daemon=True).start()
+
+    if len(located) > 0:
         fig = plt.figure('Regressor: ' + regressor + ', Feature set: ' + feature_set + ', Trajectory: ' + trajectory,
                          figsize=(15, 9))
 
@@ -52,12 +94,13 @@ def cls(result_folder, regressor, trajectory, feature_set):
         error_ax = plt.subplot(gs[1], sharex=main_ax)
         slider_ax = plt.subplot(gs[2])
 
-        main_plot = main_ax.plot(np.hstack((results[0]['y_pred'], results[0]['y_true'])))
-        error_plot = error_ax.plot(results[0]['error'])
+        first = load(0)
+        output_size = first['y_pred'].shape[1]
 
-        res_slider = Slider(slider_ax, 'IDs/Splits:', 0, len(results)-1, valinit=0, valstep=1)
+        main_plot = main_ax.plot(np.zeros((0, 2 * output_size)))
+        error_plot = error_ax.plot(np.zeros((0, output_size)))
 
-        output_size = results[0]['y_pred'].shape[1]
+        res_slider = Slider(slider_ax, 'IDs/Splits:', 0, len(located)-1, valinit=0, valstep=1)
 
         main_ax.set_ylim(-0.2, 0.7)
         error_ax.set_ylim(-1, 1)
@@ -77,25 +120,33 @@ def cls(result_folder, regressor, trajectory, feature_set):
             fig.suptitle(id + " - SPLIT " + str(split) + " ------ RMSE: " +
                          str(round(rmse, 3)) + " STDE: " + str(round(std, 3)))
 
-        set_title(results[0]['id'], results[0]['split'], results[0]['rmse'], results[0]['std'])
-
         fig.subplots_adjust(0.08, 0.02, 0.95, 0.95)
 
-        def update(res):
+        current = {'index': 0}
+
+        def draw_visible(*_):
+            # traces are decimated to pixel width of axes, only visible range is drawn
+            result = load(current['index'])
+            start, stop = main_ax.get_xlim()
+            start, stop = int(np.floor(start)), int(np.ceil(stop)) + 1
+            buckets = max(int(main_ax.bbox.width), 1)
+
             for i in range(output_size):
-                error_plot[i].set_data([np.arange(len(results[int(res)]['error'])),
-                                        results[int(res)]['error'][:, i]])
+                error_plot[i].set_data(*minmax_decimate(result['error'][:, i], start, stop, buckets))
+                main_plot[i].set_data(*minmax_decimate(result['y_pred'][:, i], start, stop, buckets))
+                main_plot[i + output_size].set_data(*minmax_decimate(result['y_true'][:, i], start, stop, buckets))
 
-                main_plot[i].set_data([np.arange(len(results[int(res)]['y_pred'])),
-                                       results[int(res)]['y_pred'][:, i]])
+            fig.canvas.draw_idle()
 
-                main_plot[i + output_size].set_data([np.arange(len(results[int(res)]['y_true'])),
-                                                     results[int(res)]['y_true'][:, i]])
+        def update(res):
+            current['index'] = int(res)
+            result = load(current['index'])
 
-            set_title(results[int(res)]['id'], results[int(res)]['split'],
-                      results[int(res)]['rmse'], results[int(res)]['std'])
+            set_title(result['id'], result['split'], result['rmse'], result['std'])
 
-            fig.canvas.draw_idle()
+            # setting limits of shared x axis redraws traces through xlim_changed callback
+            main_ax.set_xlim(0, len(result['y_true']))
+            prefetch(current['index'])
 
         def key_press_event(event):
             if event.key == 'left':
@@ -105,6 +156,11 @@ def cls(result_folder, regressor, trajectory, feature_set):
                 if res_slider.val < res_slider.valmax:
                     res_slider.set_val(res_slider.val + 1)
 
+        main_ax.callbacks.connect('xlim_changed', draw_visible)
+        fig.canvas.mpl_connect('resize_event', draw_visible)
+
+        update(0)
+
         res_slider.on_changed(update)
         key_presser = fig.canvas.mpl_connect('key_press_event', key_press_event)
 
@@ -115,4 +171,4 @@ def cls(result_folder, regressor, trajectory, feature_set):
 
 
 if __name__ == '__main__':
-    cls()
\ No newline at end of file
+    cls()
@@ -1,7 +1,13 @@
 import numpy as np
 import matplotlib.pyplot as plt
 
-import pickle, os, sys
+import pandas as pd
+
+import os, sys
+
+from typing import Tuple, List
+
+import result_stats
 
 
 def usage():
@@ -9,21 +15,32 @@ def usage():
     print('Usage: {:s} <stats_file>'.format(os.path.basename(__file__)))
     print()
     print('Arguments:')
-    print('    <stats_file>>            URL to a file containing statistic data of force learn')
+    print('    <stats_file>>            URL to a file containing statistic data of force learn (table or legacy '
+          '.bin dict)')
     print()
     print('Example:')
     print('{:s} ../putEMG/force_learn_stats.bin'.format(os.path.basename(__file__)))
     exit(1)
 
 
-def stats_using_key_partial_match(tuple_key, dictionary):
-    rmse = []
-    std = []
-    for key, value in dictionary.items():
-        if all(k1 == k2 or k2 is None for k1, k2 in zip(key, tuple_key)):
-            rmse += value['rmse']
-            std += value['std']
-    return rmse, std
+# dimensions of stats index, in order of key tuples used in queries
+INDEX_COLUMNS = ['reg', 'feature_set', 'trajectory']
+
+
+def index_stats(stats: pd.DataFrame) -> pd.DataFrame:
+    """Returns stats table indexed by (reg, feature_set, trajectory), sorted for fast partial key lookup"""
+    return stats.set_index(INDEX_COLUMNS).sort_index()
+
+
+def stats_using_key_partial_match(tuple_key: Tuple, stats: pd.DataFrame) -> Tuple[List[float], List[float]]:
+    """Returns RMSE and STD lists of rows matching key, None element of key matches any value"""
+    selector = tuple(slice(None) if k is None else k for k in tuple_key)
+    selector += (slice(None), ) * (stats.index.nlevels - len(selector))
+    try:
+        selected = stats.loc[selector, :]
+    except KeyError:
+        return [], []
+    return list(selected['rmse']), list(selected['std'])
 
 
 if __name__ == '__main__':
@@ -39,12 +56,14 @@ if __name__ == '__main__':
         print('File containing statistics does not exist - {:s}'.format(stats_url))
         usage()
 
-    results = pickle.load(open(stats_url, "rb"))
+    results = index_stats(result_stats.load_stats(stats_url))
+
+    # group means are calculated once for all combinations
+    means = results.groupby(level=INDEX_COLUMNS)[['rmse', 'std']].mean()
 
-    result_elements = list(zip(*results.keys()))
-    regressors = list(set(result_elements[0]))
-    feature_sets = list(set(result_elements[1]))
-    trajectories = list(set(result_elements[2]))
+    regressors = list(results.index.unique('reg'))
+    feature_sets = list(results.index.unique('feature_set'))
+    trajectories = list(results.index.unique('trajectory'))
 
     figs = list()
     axes = list()
@@ -60,14 +79,9 @@ if __name__ == '__main__':
 
         for r_index, reg in enumerate(regressors):
 
-            rmse_means = []
-            std_means = []
-
-            for f_set in feature_sets:
-                rmse_v, std_v = stats_using_key_partial_match((reg, f_set, trajectory), results)
-
-                rmse_means.append(np.mean(rmse_v))
-                std_means.append(np.mean(std_v))
+            selected = means.reindex([(reg, f_set, trajectory) for f_set in feature_sets])
+            rmse_means = list(selected['rmse'])
+            std_means = list(selected['std'])
 
             print('rmse', rmse_means)
             print('std', std_means)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import glob
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Callable
+
+import pandas as pd
+
+from putemg_features import biolab_utilities
+
+import feature_engine
+import feature_store
+import filter_emg
+import instrumentation
+from instrumentation import stage
+from mvc_index import MVCIndex, LinearNormalisation
+import stream_filter
+from script_utilities import pop_option, pop_flag, atomic_output
+
+
+def usage():
+    print()
+    print('Filters, normalises and calculates features of putEMG recordings in a single pass, without writing '
+          'intermediate folders')
+    print()
+    print('Usage: {:s} [options] <feature_config_xml> <input_hdf5_folder> <output_feature_folder>'.
+          format(os.path.basename(__file__)))
+    print()
+    print('Arguments:')
+    print('    <feature_config_xml>            XML file containing feature descriptors')
+    print('    <input_hdf5_folder>             putEMG HDF5 folder containing raw experiment data')
+    print('    <output_feature_folder>         output folder containing calculated feature data')
+    print()
+    print('Options:')
+    print('    --jobs <N>                      number of files processed in parallel, default 1')
+    print('    --stream                        read, filter, normalise and calculate features of recordings in row '
+          'chunks, memory is bounded by chunk size, output is the same as without it')
+    print('    --chunk-size <N>                number of rows per chunk in streaming mode, default {:d}'.
+          format(stream_filter.CHUNK_SIZE))
+    print('    --keep-filtered <folder>        also save filtered trials and their MVC recordings, the same as '
+          'filter_emg.py output, bias recordings are not filtered')
+    print('    --batched                       calculate features with batched engine instead of putemg_features, '
+          'check parity with feature_benchmark.py first')
+    print('    --format <hdf5|parquet>         output format, parquet files are partitioned by subject id and date, '
+          'default hdf5')
+    print('    --trace <file>                  record stage timings, memory and I/O to trace file (.json - Chrome '
+          'trace format, other - JSON lines) and print summary')
+    print()
+    print('Example:')
+    print('{:s} --jobs 4 force_features.xml ../putEMG/Data-HDF5 ../putEMG/Data-HDF5-filtered-feature'.
+          format(os.path.basename(__file__)))
+    exit(1)
+
+
+# number of first rows of a recording normalisation of chunks is verified on
+NORMALISATION_SAMPLE_ROWS = 1024
+
+
+def read_filtered(file_url: str) -> pd.DataFrame:
+    """Reads raw putEMG recording and applies denoising filter"""
+    name = os.path.basename(file_url)
+    with stage('read', file=name):
+        df: pd.DataFrame = pd.read_hdf(file_url)
+    with stage('filter', file=name):
+        biolab_utilities.apply_filter(df)
+    return df
+
+
+@lru_cache(maxsize=4)
+def _filtered_mvc(mvc_file: str) -> pd.DataFrame:
+    return read_filtered(mvc_file)
+
+
+def filtered_mvc(mvc_file: str) -> pd.DataFrame:
+    """Returns filtered MVC recording, filtered once for all trials of a subject in a given day processed by this
+    worker, each caller gets its own copy"""
+    return _filtered_mvc(mvc_file).copy()
+
+
+def write_filtered(df: pd.DataFrame, filtered_file: str):
+    """Saves filtered recording the same way as filter_emg.py, with signature of the filter"""
+    with stage('write filtered', file=os.path.basename(filtered_file)):
+        temp_file = atomic_output(filtered_file)
+        df.to_hdf(temp_file, 'data', format='table', mode='w', complevel=5)
+        with pd.HDFStore(temp_file, mode='a') as store:
+            store.get_storer('data').attrs.filter_signature = filter_emg.filter_signature()
+        os.replace(temp_file, filtered_file)
+
+
+def write_features(ft: pd.DataFrame, output_file: str, output_format: str):
+    if output_format == 'parquet':
+        feature_store.write_features(ft, output_file)
+    else:
+        temp_file = atomic_output(output_file)
+        ft.to_hdf(temp_file, 'data', format='table', mode='w', complevel=5)
+        os.replace(temp_file, output_file)
+
+
+def feature_function(feature_config: feature_engine.FeatureConfig,
+                     batched: bool = False) -> Callable[[pd.DataFrame], pd.DataFrame]:
+    """Returns function calculating all features of feature_config on normalised recording, with the batched engine
+    or putemg_features, time of each feature is recorded either way"""
+    def calculate(df: pd.DataFrame) -> pd.DataFrame:
+        return feature_engine.features_from_config_on_df(feature_config, df, batched=batched)
+    return calculate
+
+
+def process_stream(file_url: str, mvc: pd.DataFrame, feature_config: feature_engine.FeatureConfig,
+                   calculate: Callable[[pd.DataFrame], pd.DataFrame], output_file: str, output_format: str,
+                   chunk_size: int, filtered_file: str = None):
+    """Filters, normalises and calculates features of a recording in chunks of rows, filtered data and features are
+    written as chunks are produced
+
+    Chunks are filtered with margin of context (stream_filter.filtered_chunks), so filtered data is the same as of
+    the whole recording, and features are calculated over the same windows. Normalisation is applied as per-column
+    scale and offset derived once from MVC data (mvc_index.LinearNormalisation).
+    """
+    name = os.path.basename(file_url)
+    features = feature_engine.FeatureStream(feature_config, calculate)
+    writer = feature_store.FeatureWriter(output_file, output_format)
+
+    filtered, filtered_temp = None, None
+    if filtered_file is not None:
+        filtered_temp = atomic_output(filtered_file)
+        filtered = pd.HDFStore(filtered_temp, mode='w', complevel=5)
+
+    normalisation = None
+    with stage('stream', file=name):
+        for chunk in stream_filter.filtered_chunks(file_url, biolab_utilities.apply_filter, chunk_size):
+            if filtered is not None:
+                filtered.append('data', chunk, format='table', index=False)
+            if normalisation is None:
+                normalisation = LinearNormalisation(biolab_utilities.normalise_force_data, mvc,
+                                                    chunk.iloc[:NORMALISATION_SAMPLE_ROWS])
+            writer.write(features.push(normalisation.apply(chunk)))
+    writer.close()
+
+    if filtered is not None:
+        if 'data' in filtered:
+            filtered.create_table_index('data')
+            filtered.get_storer('data').attrs.filter_signature = filter_emg.filter_signature()
+        filtered.close()
+        os.replace(filtered_temp, filtered_file)
+
+
+def process_file(file_url: str, mvc_file: str, xml_file_url: str, output_file: str, output_format: str,
+                 chunk_size: int = None, filtered_file: str = None, batched: bool = False,
+                 filtered_mvc_file: str = None) -> str:
+    """Filters, normalises and calculates features of a single recording, returns output file name
+
+    With chunk_size the recording is processed in chunks of rows (see process_stream), otherwise at once. Filtered
+    recording is saved to filtered_file and filtered MVC recording to filtered_mvc_file, if given.
+    """
+    name = os.path.basename(file_url)
+    print('Processing file: {:s}'.format(name), flush=True)
+
+    mvc = filtered_mvc(mvc_file)
+    if filtered_mvc_file is not None:
+        write_filtered(mvc, filtered_mvc_file)
+    feature_config = feature_engine.FeatureConfig(xml_file_url)
+
+    calculate = feature_function(feature_config, batched)
+
+    if chunk_size is not None:
+        process_stream(file_url, mvc, feature_config, calculate, output_file, output_format, chunk_size,
+                       filtered_file)
+        print('Saved to file: {:s}'.format(os.path.basename(output_file)), flush=True)
+        return output_file
+
+    data = read_filtered(file_url)
+    if filtered_file is not None:
+        write_filtered(data, filtered_file)
+
+    with stage('normalise', file=name):
+        record = biolab_utilities.normalise_force_data(data, mvc)
+    del data
+
+    with stage('features', file=name):
+        ft = calculate(record)
+    del record
+
+    with stage('write', file=name):
+        write_features(ft, output_file, output_format)
+
+    print('Saved to file: {:s}'.format(os.path.basename(output_file)), flush=True)
+    return output_file
+
+
+if __name__ == '__main__':
+    if '-h' in sys.argv or '--help' in sys.argv:
+        usage()
+
+    jobs = pop_option(sys.argv, '--jobs', 1, int)
+    stream = pop_flag(sys.argv, '--stream')
+    chunk_size = pop_option(sys.argv, '--chunk-size', stream_filter.CHUNK_SIZE, int) if stream else None
+    filtered_folder = pop_option(sys.argv, '--keep-filtered', None, os.path.abspath)
+    batched = pop_flag(sys.argv, '--batched')
+    output_format = pop_option(sys.argv, '--format', 'hdf5')
+    trace = pop_option(sys.argv, '--trace', None)
+    if output_format not in ('hdf5', 'parquet'):
+        print('Unknown output format - {:s}'.format(output_format))
+        usage()
+
+    if len(sys.argv) != 4:
+        print('Illegal number of parameters')
+        usage()
+
+    xml_file_url = os.path.abspath(sys.argv[1])
+    if not os.path.isfile(xml_file_url):
+        print('XML file with feature descriptors does not exist - {:s}'.format(xml_file_url))
+        usage()
+
+    input_folder = os.path.abspath(sys.argv[2])
+    if not os.path.isdir(input_folder):
+        print('{:s} is not a valid folder'.format(input_folder))
+        usage()
+
+    output_folder = os.path.abspath(sys.argv[3])
+    for folder in (output_folder, filtered_folder):
+        if folder is not None and not os.path.exists(folder):
+            os.makedirs(folder)
+
+    if trace is not None:
+        instrumentation.enable(trace)
+
+    # raw MVC files are filtered the same way as trials, as done by filter_emg.py for the whole folder
+    mvc_index = MVCIndex(input_folder)
+
+    all_files = [f for f in sorted(glob.glob(os.path.join(input_folder, "*.hdf5"))) if not ("bias" in f or "mvc" in f)]
+
+    tasks = list()
+    written_mvc = set()
+    for file in all_files:
+        filename = os.path.splitext(os.path.basename(file))[0]
+
+        # output names are the same as of separate filter_emg.py and normalise_and_calculate_features.py runs
+        output_file = filename + '_filtered_features.hdf5'
+        if output_format == 'parquet':
+            output_file = feature_store.partition_path(output_folder, output_file)
+        else:
+            output_file = os.path.join(output_folder, output_file)
+
+        mvc_file = mvc_index.find(filename)
+        filtered_file, filtered_mvc_file = None, None
+        if filtered_folder is not None:
+            filtered_file = os.path.join(filtered_folder, filename + '_filtered.hdf5')
+            # MVC recording is shared by trials of a subject in a given day, it is saved with the first of them
+            if mvc_file not in written_mvc:
+                written_mvc.add(mvc_file)
+                filtered_mvc_file = os.path.join(filtered_folder,
+                                                 os.path.splitext(os.path.basename(mvc_file))[0] + '_filtered.hdf5')
+        tasks.append((file, mvc_file, xml_file_url, output_file, output_format, chunk_size, filtered_file, batched,
+                      filtered_mvc_file))
+
+    if jobs > 1 and tasks:
+        # trials are sorted by subject and day, so consecutive trials of a worker usually share filtered MVC
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for _ in executor.map(process_file, *zip(*tasks), chunksize=max(len(tasks) // (jobs * 4), 1)):
+                pass
+    else:
+        for task in tasks:
+            process_file(*task)
+
+    instrumentation.print_summary()
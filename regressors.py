@@ -0,0 +1,254 @@
+import os
+import multiprocessing
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Callable
+
+import numpy as np
+import pandas as pd
+
+from sklearn.base import BaseEstimator, RegressorMixin, clone
+from sklearn.kernel_approximation import Nystroem, RBFSampler
+from sklearn.linear_model import SGDRegressor
+from sklearn.metrics.pairwise import rbf_kernel
+from sklearn.pipeline import Pipeline
+from sklearn.svm import SVR
+
+from putemg_features import biolab_utilities
+
+
+# precomputed SVR kernel is used only up to this number of train samples, Gram matrix of float64 takes 128 MB, larger
+# ones do not fit memory of parallel workers
+MAX_KERNEL_SAMPLES = 4000
+
+# number of train rows biolab_utilities.prepare_pipeline is run on to find out its preprocessing steps
+PREPROCESSING_PROBE_ROWS = 64
+
+
+# number of random train rows kernel approximation and default RBF gamma of ApproximateKernelSVR are set up on
+INITIALISATION_ROWS = 10000
+
+
+# predictors implemented here, others are prepared by biolab_utilities.prepare_pipeline
+APPROXIMATE_SVR = "ASVR"
+
+
+def as_target(y):
+    """Returns 1D target for single output, as expected by SVR and MLP"""
+    y = np.asarray(y)
+    return y.ravel() if y.ndim == 1 or y.shape[1] == 1 else y
+
+
+def rmse(y_true: np.ndarray, y_pred: np.ndarray) -> float:
+    y_true = np.asarray(y_true)
+    return float(np.sqrt(np.mean(np.square(y_true - np.asarray(y_pred).reshape(y_true.shape)))))
+
+
+def uses_precomputed_kernel(args: Dict[str, any], samples: int) -> bool:
+    """Checks if SVR with given arguments can be fitted on precomputed RBF kernel of given number of samples"""
+    return args.get("kernel", "rbf") == "rbf" and samples <= MAX_KERNEL_SAMPLES
+
+
+def rbf_gamma(train: np.ndarray, gamma) -> float:
+    """Returns numeric RBF kernel coefficient, 'scale' and 'auto' are resolved the same way as by SVR"""
+    if gamma == 'scale':
+        return 1.0 / (train.shape[1] * train.var())
+    if gamma == 'auto':
+        return 1.0 / train.shape[1]
+    return float(gamma)
+
+
+def precomputed_args(args: Dict[str, any]) -> Dict[str, any]:
+    """Returns SVR arguments for fitting on precomputed kernel instead of the kernel they define"""
+    args = {a: v for a, v in args.items() if a not in ("kernel", "gamma", "degree", "coef0")}
+    args["kernel"] = 'precomputed'
+    return args
+
+
+def output_threads(outputs: int) -> int:
+    """Returns number of threads fitting SVRs of multiple outputs - one in worker processes, eg. of
+    force_learn_tasks.run_tasks, where parallelism is left to the process pool"""
+    if multiprocessing.parent_process() is not None:
+        return 1
+    return max(1, min(outputs, os.cpu_count() or 1))
+
+
+def fit_svrs(train: np.ndarray, target: np.ndarray, args: Dict[str, any]) -> List[SVR]:
+    """Fits SVR to scaled train data, one SVR per output column, one after another
+
+    If train is RBF Gram matrix of train samples, args are those of precomputed_args, so a single kernel calculation is
+    shared by all outputs. Outputs are not fitted in threads, parallelism is left to task processes.
+    """
+    if target.ndim == 1:
+        return [SVR(**args).fit(train, target)]
+    return [SVR(**args).fit(train, target[:, column]) for column in range(target.shape[1])]
+
+
+def predict_svrs(svrs: List[SVR], test: np.ndarray, ndim: int) -> np.ndarray:
+    """Returns prediction of SVRs of fit_svrs, of the same number of dimensions (ndim) as their target"""
+    if ndim == 1:
+        return svrs[0].predict(test)
+    return np.stack([svr.predict(test) for svr in svrs], axis=1)
+
+
+class MultiOutputSVR(BaseEstimator, RegressorMixin):
+    """SVR fitted to each output column of shared inputs, predicts (samples, outputs) array
+
+    RBF kernel of train samples is calculated once and shared by SVRs of all outputs, as is the kernel of predicted
+    samples against them, if the number of train samples allows it (see uses_precomputed_kernel). SVRs of outputs are
+    fitted in n_jobs threads, libsvm runs without holding the GIL.
+    """
+
+    def __init__(self, args: Dict[str, any] = None, n_jobs: int = 1):
+        self.args = args
+        self.n_jobs = n_jobs
+
+    def fit(self, x, y):
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float).reshape(len(x), -1)
+        args = dict(self.args or dict())
+        self.gamma_ = None
+        train = x
+        if uses_precomputed_kernel(args, len(x)):
+            # train samples are kept, kernel of predicted samples is calculated against all of them
+            self.gamma_ = rbf_gamma(x, args.get("gamma", "scale"))
+            self.train_ = x
+            train = rbf_kernel(x, gamma=self.gamma_)
+            args = precomputed_args(args)
+
+        with ThreadPoolExecutor(max_workers=self.n_jobs) as executor:
+            self.estimators_ = list(executor.map(lambda column: SVR(**args).fit(train, y[:, column]),
+                                                 range(y.shape[1])))
+        return self
+
+    def predict(self, x) -> np.ndarray:
+        x = np.asarray(x, dtype=float)
+        if self.gamma_ is not None:
+            x = rbf_kernel(x, self.train_, gamma=self.gamma_)
+        return np.stack([estimator.predict(x) for estimator in self.estimators_], axis=1)
+
+
+class ApproximateKernelSVR(BaseEstimator, RegressorMixin):
+    """RBF kernel SVR approximated by a linear epsilon-insensitive regressor on Nystroem or random Fourier features
+
+    Fit cost grows linearly with number of samples. Regressor is trained with SGD in mini-batches of shuffled rows,
+    only a mini-batch is transformed and copied at once, so train data can be memory-mapped. Feature map and default
+    gamma are set up on a random sample of INITIALISATION_ROWS rows. partial_fit can be called with consecutive chunks
+    of data too large to be loaded at once, its feature map and default regularisation are set up on the first chunk.
+    Multiple outputs are fitted by separate regressors on shared features.
+    """
+
+    def __init__(self, approximation: str = 'nystroem', n_components: int = 500, gamma='scale', C: float = 1.0,
+                 epsilon: float = 0.1, alpha: float = None, batch_size: int = 1024, epochs: int = 5,
+                 random_state: int = None):
+        self.approximation = approximation
+        self.n_components = n_components
+        self.gamma = gamma
+        self.C = C
+        self.epsilon = epsilon
+        self.alpha = alpha
+        self.batch_size = batch_size
+        self.epochs = epochs
+        self.random_state = random_state
+
+    def _initialise(self, x: np.ndarray, y: np.ndarray, samples: int):
+        gamma = rbf_gamma(x, self.gamma)
+        if self.approximation == 'nystroem':
+            self.feature_map_ = Nystroem(kernel='rbf', gamma=gamma, n_components=min(self.n_components, len(x)),
+                                         random_state=self.random_state).fit(x)
+        elif self.approximation == 'rff':
+            self.feature_map_ = RBFSampler(gamma=gamma, n_components=self.n_components,
+                                           random_state=self.random_state).fit(x)
+        else:
+            raise ValueError('Unknown kernel approximation {:s}'.format(self.approximation))
+
+        # SVR minimises C * sum of losses + |w|^2 / 2, SGD mean of losses + alpha * |w|^2 / 2
+        alpha = self.alpha if self.alpha is not None else 1.0 / (self.C * samples)
+        self.single_output_ = y.ndim == 1
+        self.regressors_ = [SGDRegressor(loss='epsilon_insensitive', epsilon=self.epsilon, alpha=alpha,
+                                         random_state=self.random_state)
+                            for _ in range(1 if y.ndim == 1 else y.shape[1])]
+
+    def _fit_batch(self, x: np.ndarray, y: np.ndarray):
+        z = self.feature_map_.transform(x)
+        for i, regressor in enumerate(self.regressors_):
+            regressor.partial_fit(z, y[:, i])
+
+    def partial_fit(self, x, y):
+        """Fits regressors to a single chunk of samples, in mini-batches"""
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        if not hasattr(self, 'regressors_'):
+            self._initialise(x, y, len(x))
+        y = y.reshape(len(y), -1)
+
+        for begin in range(0, len(x), self.batch_size):
+            self._fit_batch(x[begin:begin + self.batch_size], y[begin:begin + self.batch_size])
+        return self
+
+    def fit(self, x, y, transform: Callable = None):
+        """Fits regressors with given number of epochs over shuffled samples
+
+        transform maps rows of x (DataFrame or array) to regressor inputs, eg. fitted preprocessing steps, it is
+        applied to each mini-batch, so x is never transformed or copied as a whole.
+        """
+        y = np.asarray(y, dtype=float)
+        for attribute in ('feature_map_', 'regressors_', 'single_output_'):
+            self.__dict__.pop(attribute, None)
+
+        def rows(index: np.ndarray) -> np.ndarray:
+            selected = x.iloc[index] if isinstance(x, pd.DataFrame) else np.asarray(x)[index]
+            return np.asarray(transform(selected) if transform is not None else selected, dtype=float)
+
+        rng = np.random.RandomState(self.random_state)
+        sample = np.sort(rng.choice(len(y), min(len(y), INITIALISATION_ROWS), replace=False))
+        self._initialise(rows(sample), y[sample], len(y))
+
+        target = y.reshape(len(y), -1)
+        for _ in range(self.epochs):
+            order = rng.permutation(len(y))
+            for begin in range(0, len(order), self.batch_size):
+                batch = order[begin:begin + self.batch_size]
+                self._fit_batch(rows(batch), target[batch])
+        return self
+
+    def predict(self, x) -> np.ndarray:
+        z = self.feature_map_.transform(np.asarray(x, dtype=float))
+        prediction = np.stack([regressor.predict(z) for regressor in self.regressors_], axis=1)
+        return prediction.ravel() if self.single_output_ else prediction
+
+
+def preprocessing(train_x: pd.DataFrame, train_y: pd.DataFrame, norm_per_feature: bool = False) -> Pipeline:
+    """Returns preprocessing steps of biolab_utilities.prepare_pipeline (all steps but the regressor) fitted to train
+    data, so inputs transformed by it are the same as seen by regressor of a pipeline fitted to the same data"""
+    probe = biolab_utilities.prepare_pipeline(train_x.iloc[:PREPROCESSING_PROBE_ROWS],
+                                              train_y.iloc[:PREPROCESSING_PROBE_ROWS], predictor='LR',
+                                              norm_per_feature=norm_per_feature)
+    if not isinstance(probe, Pipeline) or len(probe.steps) < 2:
+        raise ValueError('biolab_utilities.prepare_pipeline does not return a pipeline of preprocessing steps and '
+                         'regressor, its preprocessing can not be reused')
+    # steps are cloned unfitted and fitted to all train data
+    return clone(probe[:-1]).fit(train_x, as_target(train_y))
+
+
+def prepare_pipeline(train_x: pd.DataFrame, train_y: pd.DataFrame, predictor: str, norm_per_feature: bool = False,
+                     **args):
+    """Returns regressor pipeline fitted to train data, as biolab_utilities.prepare_pipeline with additional
+    predictors - ASVR (preprocessing of biolab_utilities.prepare_pipeline and ApproximateKernelSVR)
+
+    SVR is single output, for multiple output columns preprocessing of biolab_utilities.prepare_pipeline is fitted
+    once and followed by MultiOutputSVR, fitting SVRs of all outputs on a shared kernel, in parallel threads outside of
+    worker processes.
+    """
+    if predictor == "SVR" and np.ndim(train_y) > 1 and np.shape(train_y)[1] > 1:
+        steps = preprocessing(train_x, train_y, norm_per_feature)
+        regressor = MultiOutputSVR(args, output_threads(np.shape(train_y)[1]))
+        regressor.fit(steps.transform(train_x), as_target(train_y))
+        return Pipeline(steps.steps + [('multioutputsvr', regressor)])
+
+    if predictor == APPROXIMATE_SVR:
+        # inputs are preprocessed as by biolab_utilities.prepare_pipeline, regressor transforms them per mini-batch
+        steps = preprocessing(train_x, train_y, norm_per_feature)
+        regressor = ApproximateKernelSVR(**args).fit(train_x, as_target(train_y), transform=steps.transform)
+        return Pipeline(steps.steps + [('approximatekernelsvr', regressor)])
+
+    return biolab_utilities.prepare_pipeline(train_x, train_y, predictor=predictor,
+                                             norm_per_feature=norm_per_feature, **args)
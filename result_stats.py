@@ -0,0 +1,145 @@
+import pickle
+
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+import results_store
+
+
+# columns identifying a single result record in stats table
+KEY_COLUMNS = ['subject', 'date', 'split', 'reg', 'feature_set', 'trajectory']
+
+# metrics calculated for every result record
+METRICS = ['rmse', 'std', 'mae', 'r2']
+
+# number of samples of prediction arrays processed at once by error_metrics
+BLOCK_SIZE = 1 << 16
+
+
+def _merge_moments(count: int, mean, m2, block: np.ndarray) -> Tuple[int, any, any]:
+    """Merges count, mean and sum of squared deviations of block rows into running ones (Chan et al.), of each column
+    of two dimensional block"""
+    block_mean = block.mean(axis=0)
+    deviation = block - block_mean
+    total = count + len(block)
+    delta = block_mean - mean
+    return total, mean + delta * len(block) / total, \
+        m2 + np.einsum('i...,i...->...', deviation, deviation) + delta * delta * count * len(block) / total
+
+
+def error_metrics(y_true: np.ndarray, y_pred: np.ndarray) -> Dict[str, float]:
+    """Calculates RMSE, STD and MAE of prediction error and R2 score in a single pass over prediction arrays
+
+    Error is defined as in legacy stats - y_true - y_pred reshaped to shape of y_true, RMSE is sqrt(mean(error^2)),
+    STD is np.std(error). R2 of multiple output columns is the mean of R2 of each column, as r2_score of sklearn
+    (uniform_average), a column of constant y_true scores 1.0 if predicted exactly, 0.0 otherwise. Arrays (eg.
+    memory-mapped) are read block by block of rows, all sums are collected from a block while it is in cache.
+    Deviations are summed around block means and merged, so STD and R2 are as accurate as of two-pass np.std, unlike
+    E[x^2] - E[x]^2.
+    """
+    y_true = np.asarray(y_true)
+    n = y_true.size
+    if n == 0:
+        return {"n": 0, "rmse": np.nan, "std": np.nan, "mae": np.nan, "r2": np.nan}
+    # rows of output columns, a single column of one dimensional y_true
+    true_values = y_true.reshape(len(y_true), -1) if y_true.ndim else y_true.reshape(1, 1)
+    predicted_values = np.asarray(y_pred).reshape(true_values.shape)
+
+    rows = max(1, BLOCK_SIZE // true_values.shape[1])
+    error_square_sum = 0.0
+    error_abs_sum = 0.0
+    error_moments = (0, 0.0, 0.0)
+    true_moments = (0, 0.0, 0.0)
+    for begin in range(0, len(true_values), rows):
+        true_block = np.asarray(true_values[begin:begin + rows], dtype=float)
+        error = true_block - np.asarray(predicted_values[begin:begin + rows], dtype=float)
+
+        error_square_sum = error_square_sum + np.einsum('ij,ij->j', error, error)
+        error_abs_sum += np.abs(error).sum()
+        error_moments = _merge_moments(*error_moments, error.reshape(-1))
+        true_moments = _merge_moments(*true_moments, true_block)
+
+    total_sum_of_squares = true_moments[2]
+    varying = total_sum_of_squares > 0
+    r2 = np.where(error_square_sum == 0, 1.0, 0.0)
+    r2[varying] = 1.0 - error_square_sum[varying] / total_sum_of_squares[varying]
+    return {"n": n,
+            "rmse": np.sqrt(error_square_sum.sum() / n),
+            "std": np.sqrt(error_moments[2] / n),
+            "mae": error_abs_sum / n,
+            "r2": r2.mean()}
+
+
+def split_experiment_id(experiment_id: str) -> Tuple[str, str]:
+    """Returns subject and date of experiment id, eg. 03/2018-05-11"""
+    subject, _, date = experiment_id.replace('_', '/').partition('/')
+    return subject, date
+
+
+def list_result_files(folder: str) -> List[str]:
+    """Returns stems of results of folder, each holding results of a single subject and day in any format"""
+    return [stem for stem, _ in results_store.list_results(folder)]
+
+
+def result_file_stats(folder: str, result_file: str) -> List[Dict[str, any]]:
+    """Returns stats rows of all result records of a single subject and day"""
+    if results_store.result_format(folder, result_file) == results_store.INDEX_EXTENSION:
+        experiment_id = results_store.read_meta(folder, result_file)["id"]
+        records = (results_store.load_record(folder, result_file, e)
+                   for e in results_store.read_index(folder, result_file))
+    else:
+        data = results_store.read_pickle(folder, result_file)
+        experiment_id = data["id"]
+        records = data["results"]
+
+    subject, date = split_experiment_id(experiment_id)
+
+    rows = list()
+    for d in records:
+        row = {"subject": subject, "date": date, "split": d["split"], "reg": d["reg"],
+               "feature_set": d["feature_set"], "trajectory": d["trajectory"]}
+        row.update(error_metrics(d["y_true"], d["y_pred"]))
+        rows.append(row)
+    return rows
+
+
+def save_stats(stats: pd.DataFrame, file_url: str):
+    """Saves stats table, format is chosen by extension: .parquet, .csv, .bin (legacy dict of lists) or HDF5"""
+    if file_url.endswith('.parquet'):
+        stats.to_parquet(file_url)
+    elif file_url.endswith('.csv'):
+        stats.to_csv(file_url, index=False)
+    elif file_url.endswith('.bin'):
+        pickle.dump(to_legacy_dict(stats), open(file_url, "wb"))
+    else:
+        stats.to_hdf(file_url, 'data', format='table', mode='w', complevel=5)
+
+
+def load_stats(file_url: str) -> pd.DataFrame:
+    """Loads stats table saved with save_stats, legacy dict of lists is converted to a table"""
+    if file_url.endswith('.parquet'):
+        return pd.read_parquet(file_url)
+    if file_url.endswith('.csv'):
+        return pd.read_csv(file_url, dtype={"subject": str, "date": str})
+    if file_url.endswith('.bin'):
+        return from_legacy_dict(pickle.load(open(file_url, "rb")))
+    return pd.DataFrame(pd.read_hdf(file_url, 'data'))
+
+
+def to_legacy_dict(stats: pd.DataFrame) -> Dict[Tuple[str, str, str], Dict[str, List[float]]]:
+    """Converts stats table to dict of (reg, feature_set, trajectory) -> {'rmse': [...], 'std': [...]}"""
+    results: Dict[Tuple[str, str, str], Dict[str, List[float]]] = dict()
+    for key, group in stats.groupby(['reg', 'feature_set', 'trajectory'], sort=False):
+        results[key] = {'rmse': list(group['rmse']), 'std': list(group['std'])}
+    return results
+
+
+def from_legacy_dict(results: Dict[Tuple[str, str, str], Dict[str, List[float]]]) -> pd.DataFrame:
+    """Converts legacy dict of lists to stats table, only RMSE and STD are available"""
+    rows = list()
+    for (reg, feature_set, trajectory), value in results.items():
+        for rmse, std in zip(value['rmse'], value['std']):
+            rows.append({"reg": reg, "feature_set": feature_set, "trajectory": trajectory, "rmse": rmse, "std": std})
+    return pd.DataFrame(rows, columns=['reg', 'feature_set', 'trajectory', 'rmse', 'std'])
@@ -0,0 +1,265 @@
+import os
+import glob
+import json
+import pickle
+import threading
+
+from collections import OrderedDict
+from typing import Dict, List, Iterator, Tuple, Optional
+
+import numpy as np
+
+from script_utilities import atomic_output
+
+
+# results of single subject and day are kept in three files:
+# <stem>.index.jsonl - one line per result record, scalar fields and location of its arrays in data file
+# <stem>.data        - raw array data, read through memory mapping
+# <stem>.meta.pkl    - experiment settings (trajectories, regressors, feature sets, id, failed tasks)
+INDEX_EXTENSION = '.index.jsonl'
+DATA_EXTENSION = '.data'
+META_EXTENSION = '.meta.pkl'
+PICKLE_EXTENSION = '.bin'
+
+# number of unpickled .bin files kept by load_indexed, records of a file are usually browsed one after another
+PICKLE_CACHE_SIZE = 2
+
+
+def result_stem(experiment_id: str) -> str:
+    """Returns base name of result files of a single subject and day"""
+    return "force-classification-result_" + experiment_id.replace("/", "_")
+
+
+def result_format(folder: str, stem: str) -> Optional[str]:
+    """Returns extension of results of given stem - INDEX_EXTENSION or PICKLE_EXTENSION, None if not written
+
+    Raises ValueError if results of the stem are in both formats, it is not known which of them is current.
+    """
+    written = [e for e in (INDEX_EXTENSION, PICKLE_EXTENSION) if os.path.isfile(os.path.join(folder, stem + e))]
+    if len(written) > 1:
+        raise ValueError('Results of {:s} are both in results store and pickled {:s} file in {:s}, remove one of them'
+                         .format(stem, PICKLE_EXTENSION, folder))
+    return written[0] if written else None
+
+
+def has_results(folder: str, stem: str) -> bool:
+    """Checks if results of given stem were written, in any format"""
+    return result_format(folder, stem) is not None
+
+
+def list_results(folder: str) -> List[Tuple[str, str]]:
+    """Returns (stem, extension) of all results of folder, sorted by stem
+
+    A folder may contain both results store and pickled .bin files (eg. results format changed between runs), but
+    results of a single stem have to be in one format, ValueError is raised otherwise.
+    """
+    units: Dict[str, str] = dict()
+    for extension in (INDEX_EXTENSION, PICKLE_EXTENSION):
+        for file_url in glob.glob(os.path.join(folder, '*' + extension)):
+            stem = os.path.basename(file_url)[:-len(extension)]
+            if stem in units:
+                result_format(folder, stem)
+            units[stem] = extension
+    return sorted(units.items())
+
+
+def remove_other_format(folder: str, stem: str, extension: str):
+    """Removes results of given stem written in the other format than extension, called once new results are written"""
+    other = [INDEX_EXTENSION, META_EXTENSION, DATA_EXTENSION] if extension == PICKLE_EXTENSION else [PICKLE_EXTENSION]
+    for e in other:
+        if os.path.isfile(os.path.join(folder, stem + e)):
+            os.remove(os.path.join(folder, stem + e))
+
+
+class ResultsWriter:
+    """Appends result records of a single subject and day to results store
+
+    Files are written under temporary names and moved in place by close(), index file last, so readers never
+    see incomplete results.
+    """
+
+    def __init__(self, folder: str, stem: str):
+        self.paths = {e: os.path.join(folder, stem + e) for e in (INDEX_EXTENSION, DATA_EXTENSION, META_EXTENSION)}
+        self.temp_paths = {e: atomic_output(p) for e, p in self.paths.items()}
+
+        self._data = open(self.temp_paths[DATA_EXTENSION], 'wb')
+        self._index = open(self.temp_paths[INDEX_EXTENSION], 'w')
+
+    def append(self, record: Dict[str, any]):
+        """Appends single result record, numpy arrays are saved to data file, other fields to index"""
+        entry: Dict[str, any] = dict()
+        for key, value in record.items():
+            if isinstance(value, np.ndarray):
+                value = np.ascontiguousarray(value)
+                entry[key] = {"offset": self._data.tell(), "shape": list(value.shape), "dtype": value.dtype.str}
+                self._data.write(value.tobytes())
+            else:
+                entry[key] = value
+        self._index.write(json.dumps(entry) + '\n')
+
+    def close(self, meta: Dict[str, any]):
+        """Saves experiment settings and makes results visible to readers"""
+        self._data.close()
+        self._index.close()
+        with open(self.temp_paths[META_EXTENSION], 'wb') as f:
+            pickle.dump(meta, f)
+
+        for extension in (DATA_EXTENSION, META_EXTENSION, INDEX_EXTENSION):
+            os.replace(self.temp_paths[extension], self.paths[extension])
+
+
+def write_output(folder: str, stem: str, output: Dict[str, any]):
+    """Writes output structure of force_learn (settings and list of results) to results store"""
+    writer = ResultsWriter(folder, stem)
+    for record in output["results"]:
+        writer.append(record)
+    writer.close({k: v for k, v in output.items() if k != "results"})
+
+
+def list_stems(folder: str) -> List[str]:
+    return sorted(os.path.basename(f)[:-len(INDEX_EXTENSION)]
+                  for f in glob.glob(os.path.join(folder, '*' + INDEX_EXTENSION)))
+
+
+def read_index(folder: str, stem: str) -> List[Dict[str, any]]:
+    """Returns index entries of all result records of a single subject and day"""
+    with open(os.path.join(folder, stem + INDEX_EXTENSION), 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def read_meta(folder: str, stem: str) -> Dict[str, any]:
+    with open(os.path.join(folder, stem + META_EXTENSION), 'rb') as f:
+        return pickle.load(f)
+
+
+def matches(entry: Dict[str, any], filters: Dict[str, any]) -> bool:
+    """Checks if record fields are equal to filters, filter value None matches any value"""
+    return all(v is None or entry.get(k) == v for k, v in filters.items())
+
+
+def load_record(folder: str, stem: str, entry: Dict[str, any]) -> Dict[str, any]:
+    """Returns result record of given index entry, arrays are memory-mapped, not read"""
+    record: Dict[str, any] = dict()
+    data_path = os.path.join(folder, stem + DATA_EXTENSION)
+    for key, value in entry.items():
+        if isinstance(value, dict) and "offset" in value:
+            shape = tuple(value["shape"])
+            record[key] = np.memmap(data_path, dtype=np.dtype(value["dtype"]), mode='r',
+                                    offset=value["offset"], shape=shape) if np.prod(shape) > 0 \
+                else np.empty(shape, dtype=np.dtype(value["dtype"]))
+        else:
+            record[key] = value
+    return record
+
+
+def query(folder: str, **filters) -> Iterator[Tuple[str, Dict[str, any]]]:
+    """Yields (stem, index entry) of records matching filters, eg. query(folder, reg='SVR', trajectory='Thumb')"""
+    for stem in list_stems(folder):
+        for entry in read_index(folder, stem):
+            if matches(entry, filters):
+                yield stem, entry
+
+
+def read_pickle(folder: str, stem: str) -> Dict[str, any]:
+    """Returns output structure of force_learn saved as pickled .bin file"""
+    with open(os.path.join(folder, stem + PICKLE_EXTENSION), 'rb') as f:
+        return pickle.load(f)
+
+
+def read_results(folder: str, **filters) -> Iterator[Tuple[str, Dict[str, any]]]:
+    """Yields (stem, result record) of records matching filters, of results in any format
+
+    Results store is queried by index and only matching records are mapped, pickled .bin files are loaded whole.
+    """
+    for stem, extension in list_results(folder):
+        if extension == INDEX_EXTENSION:
+            for entry in read_index(folder, stem):
+                if matches(entry, filters):
+                    yield stem, load_record(folder, stem, entry)
+            continue
+
+        data = read_pickle(folder, stem)
+        for d in data['results']:
+            if matches(d, filters):
+                yield stem, d
+        del data
+
+
+def index_results(folder: str, **filters) -> List[Tuple[str, any, Dict[str, any]]]:
+    """Returns (stem, locator, fields) of records matching filters, without keeping their arrays in memory
+
+    Locator is used by load_indexed to read a single record - index entry for results store, position of record for
+    pickled .bin file. Fields contain scalar values of record (eg. split). Pickled .bin files have no index, so each
+    of them is loaded once and only positions of matching records are kept.
+    """
+    located = list()
+    for stem, extension in list_results(folder):
+        if extension == INDEX_EXTENSION:
+            located.extend((stem, entry, {k: v for k, v in entry.items() if not isinstance(v, dict)})
+                           for entry in read_index(folder, stem) if matches(entry, filters))
+            continue
+
+        data = read_pickle(folder, stem)
+        for position, d in enumerate(data['results']):
+            if matches(d, filters):
+                located.append((stem, position, {k: v for k, v in d.items() if not isinstance(v, np.ndarray)}))
+        del data
+    return located
+
+
+_pickle_cache: OrderedDict = OrderedDict()
+_pickle_cache_lock = threading.Lock()
+
+
+def _cached_pickle(folder: str, stem: str) -> Dict[str, any]:
+    """Returns output structure of pickled .bin file, the file is unpickled once while it is among recently used ones"""
+    path = os.path.join(folder, stem + PICKLE_EXTENSION)
+    # modification time is a part of the key, a rewritten file is loaded again
+    key = (path, os.path.getmtime(path))
+    with _pickle_cache_lock:
+        if key in _pickle_cache:
+            _pickle_cache.move_to_end(key)
+            return _pickle_cache[key]
+
+        data = read_pickle(folder, stem)
+        _pickle_cache[key] = data
+        while len(_pickle_cache) > PICKLE_CACHE_SIZE:
+            _pickle_cache.popitem(last=False)
+        return data
+
+
+def load_indexed(folder: str, stem: str, locator: any) -> Dict[str, any]:
+    """Returns single result record located by index_results
+
+    Records of results store are memory-mapped, records of pickled .bin file come from its cached unpickled content
+    (see PICKLE_CACHE_SIZE), so browsing records of one file does not unpickle it for each of them.
+    """
+    if isinstance(locator, dict):
+        return load_record(folder, stem, locator)
+
+    return _cached_pickle(folder, stem)['results'][locator]
+
+
+def read_experiment(folder: str, stem: str) -> Tuple[Dict[str, any], List[Dict[str, any]]]:
+    """Returns settings and all result records of a single subject and day, in any format
+
+    Records of results store are memory-mapped, pickled .bin file is loaded whole.
+    """
+    if result_format(folder, stem) == INDEX_EXTENSION:
+        return read_meta(folder, stem), [load_record(folder, stem, e) for e in read_index(folder, stem)]
+
+    data = read_pickle(folder, stem)
+    return {k: v for k, v in data.items() if k != "results"}, data["results"]
+
+
+def result_keys(folder: str, stem: str) -> List[Tuple[str, int, str, str, Optional[str]]]:
+    """Returns (trajectory, split, feature set, regressor, settings hash) of all result records written for a single
+    subject and day, empty if there are no results, settings hash is None for records written without it"""
+    extension = result_format(folder, stem)
+    if extension == INDEX_EXTENSION:
+        records = read_index(folder, stem)
+    elif extension == PICKLE_EXTENSION:
+        records = read_pickle(folder, stem)["results"]
+    else:
+        return list()
+    return [(d["trajectory"], d["split"], d["feature_set"], d["reg"], d.get("settings_hash")) for d in records]
@@ -0,0 +1,38 @@
+import os
+
+from typing import List, Callable
+
+
+def pop_option(argv: List[str], name: str, default: any = None, cast: Callable[[str], any] = str) -> any:
+    """Removes option with a value (eg. --jobs 4) from argument list and returns its value"""
+    if name not in argv:
+        return default
+
+    index = argv.index(name)
+    if index + 1 >= len(argv):
+        print('Option {:s} requires a value'.format(name))
+        exit(1)
+
+    value = argv[index + 1]
+    del argv[index:index + 2]
+
+    try:
+        return cast(value)
+    except ValueError:
+        print('Invalid value of option {:s} - {:s}'.format(name, value))
+        exit(1)
+
+
+def pop_flag(argv: List[str], name: str) -> bool:
+    """Removes flag option (eg. --force) from argument list and returns whether it was present"""
+    if name not in argv:
+        return False
+
+    argv.remove(name)
+    return True
+
+
+def atomic_output(file_url: str) -> str:
+    """Returns temporary path in the same folder as given output, to be moved over it with os.replace when complete"""
+    folder, basename = os.path.split(file_url)
+    return os.path.join(folder, '.' + basename + '.' + str(os.getpid()) + '.tmp')
@@ -0,0 +1,174 @@
+from typing import List, Iterator, Callable, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+# putEMG amplifier sampling frequency
+SAMPLING_FREQUENCY = 5120
+
+# default number of rows read, filtered and written at once
+CHUNK_SIZE = 2 ** 18
+
+# rows of context filtered together with each chunk on both sides, response of a denoising filter applied forward
+# and backward (band-pass with power line notch) to samples this far away is below 1e-10 of the signal amplitude
+MARGIN = 4 * SAMPLING_FREQUENCY
+
+
+def emg_columns(df: pd.DataFrame) -> List[str]:
+    """Returns EMG channel columns of putEMG DataFrame"""
+    return [c for c in df.columns if c.startswith('EMG_')]
+
+
+class LookaheadFilter:
+    """Filters consecutive blocks of a recording as if the whole recording was filtered, with a fixed delay
+
+    filter_function filters a DataFrame in place, like biolab_utilities.apply_filter. Pending samples are filtered
+    together with margin received rows before them and lookahead rows after them, so the output matches filtering of
+    the whole recording for filters whose response decays within margin and lookahead rows (see MARGIN). Samples are
+    returned once lookahead later samples are received, flush() returns the rest at the end of the recording.
+    """
+
+    def __init__(self, filter_function: Callable[[pd.DataFrame], None], margin: int = MARGIN,
+                 lookahead: int = MARGIN):
+        self.filter_function = filter_function
+        self.margin = margin
+        self.lookahead = lookahead
+        # raw rows from margin before the first pending sample, _start is position of the first of them
+        self._raw: pd.DataFrame = None
+        self._start = 0
+        self.received = 0
+        self.emitted = 0
+
+    def push(self, block: pd.DataFrame) -> pd.DataFrame:
+        """Returns filtered samples that got lookahead rows of context with the next block, possibly none"""
+        self._raw = block.copy() if self._raw is None else pd.concat([self._raw, block])
+        self.received += len(block)
+        return self._filter(self.received - self.lookahead)
+
+    def flush(self) -> pd.DataFrame:
+        """Returns all remaining filtered samples, filtered with the end of the recording as the right edge"""
+        return self._filter(self.received)
+
+    def _filter(self, ready: int) -> pd.DataFrame:
+        if self._raw is None:
+            return pd.DataFrame()
+        if ready <= self.emitted:
+            return self._raw.iloc[:0]
+
+        span = self._raw.copy()
+        self.filter_function(span)
+        filtered = span.iloc[self.emitted - self._start:ready - self._start]
+
+        self.emitted = ready
+        start = max(ready - self.margin, 0)
+        self._raw = self._raw.iloc[start - self._start:]
+        self._start = start
+        return filtered
+
+
+def _table(store: pd.HDFStore, file_url: str, key: str) -> Tuple[str, int]:
+    """Returns key and number of rows of putEMG table, requires file saved with format='table'"""
+    if key not in store:
+        key = store.keys()[0]
+    storer = store.get_storer(key)
+    if not storer.is_table:
+        raise ValueError('{:s} is not saved in table format, chunked reading is not possible'.format(file_url))
+    return key, storer.nrows
+
+
+def read_chunks(file_url: str, chunk_size: int = CHUNK_SIZE, key: str = 'data') -> Iterator[pd.DataFrame]:
+    """Yields consecutive row chunks of a putEMG HDF5 table, requires file saved with format='table'"""
+    with pd.HDFStore(file_url, mode='r') as store:
+        key, _ = _table(store, file_url, key)
+        for chunk in store.select(key, chunksize=chunk_size):
+            yield chunk
+
+
+def read_rows(file_url: str, start: int, stop: int, key: str = 'data') -> pd.DataFrame:
+    """Returns rows [start, stop) of a putEMG HDF5 table"""
+    with pd.HDFStore(file_url, mode='r') as store:
+        key, _ = _table(store, file_url, key)
+        return store.select(key, start=start, stop=stop)
+
+
+def table_rows(file_url: str, key: str = 'data') -> int:
+    """Returns number of rows of a putEMG HDF5 table without reading it"""
+    with pd.HDFStore(file_url, mode='r') as store:
+        return _table(store, file_url, key)[1]
+
+
+def filtered_chunks(file_url: str, filter_function: Callable[[pd.DataFrame], None], chunk_size: int = CHUNK_SIZE,
+                    margin: int = MARGIN, key: str = 'data') -> Iterator[pd.DataFrame]:
+    """Yields consecutive filtered row chunks of a putEMG HDF5 table, filtered as if the whole recording was filtered
+
+    filter_function filters a DataFrame in place, like biolab_utilities.apply_filter. Each chunk is read and filtered
+    together with margin rows of the recording before and after it and only the chunk itself is yielded, so the
+    result matches filtering of the whole recording for any linear filter whose response decays within margin rows
+    (including zero-phase filters applied forward and backward). Rows at the beginning and the end of the recording
+    are filtered with the same edges as in the whole recording. At most chunk_size + 2 * margin rows are in memory.
+    """
+    with pd.HDFStore(file_url, mode='r') as store:
+        key, rows = _table(store, file_url, key)
+        for begin in range(0, rows, chunk_size):
+            end = min(begin + chunk_size, rows)
+            start, stop = max(begin - margin, 0), min(end + margin, rows)
+            df = store.select(key, start=start, stop=stop)
+            filter_function(df)
+            yield df.iloc[begin - start:end - start]
+
+
+def filter_file_streaming(input_file: str, output_file: str, filter_function: Callable[[pd.DataFrame], None],
+                          chunk_size: int = CHUNK_SIZE, margin: int = MARGIN) -> int:
+    """Filters putEMG HDF5 file chunk by chunk and appends results to output table, returns number of rows"""
+    rows = 0
+
+    with pd.HDFStore(output_file, mode='w', complevel=5, complib='zlib') as output:
+        for chunk in filtered_chunks(input_file, filter_function, chunk_size, margin):
+            output.append('data', chunk, format='table', index=False)
+            rows += len(chunk)
+        # index is created once all chunks are written
+        if rows > 0:
+            output.create_table_index('data', optlevel=6, kind='medium')
+
+    return rows
+
+
+def verify_streaming(input_file: str, output_file: str, filter_function: Callable[[pd.DataFrame], None],
+                     chunk_size: int = CHUNK_SIZE, margin: int = MARGIN, rtol: float = 1e-6,
+                     atol: float = 1e-6) -> float:
+    """Compares streamed output with filtering of longer spans of the input at once, returns max absolute difference
+
+    Rows around the beginning, the end and the first and the last chunk boundary are checked. Each reference span is
+    filtered with 2 * margin rows of context on both sides, twice as much as streaming used, so insufficient margin
+    is detected. Only a few spans are read, memory stays bounded by margin, not by the recording. Tolerance atol is
+    relative to the largest absolute value of the compared reference rows.
+    """
+    rows = table_rows(input_file)
+    boundaries = [b for b in (chunk_size, (rows - 1) // chunk_size * chunk_size) if 0 < b < rows]
+    context = 2 * margin
+
+    difference = 0.0
+    for point in sorted(set([0, rows] + boundaries)):
+        start, stop = max(point - 2 * context, 0), min(point + 2 * context, rows)
+        reference = read_rows(input_file, start, stop)
+        filter_function(reference)
+
+        # rows compared have full context in the reference span, or share an edge of the recording with it
+        begin = start + context if start > 0 else 0
+        end = stop - context if stop < rows else rows
+        if end <= begin:
+            continue
+        reference = reference.iloc[begin - start:end - start]
+        streamed = read_rows(output_file, begin, end)
+
+        columns = emg_columns(reference)
+        expected, actual = reference[columns].values, streamed[columns].values
+        if not expected.size:
+            continue
+        span_difference = float(np.abs(expected - actual).max())
+        if not np.allclose(actual, expected, rtol=rtol, atol=atol * np.abs(expected).max()):
+            raise ValueError('Streamed output of {:s} differs from filtering of the whole recording at rows {:d}-{:d}, '
+                             'max difference {:g}'.format(input_file, begin, end, span_difference))
+        difference = max(difference, span_difference)
+    return difference
@@ -0,0 +1,137 @@
+import os
+import shutil
+import tempfile
+
+from typing import Dict, List, Callable
+
+import numpy as np
+import pandas as pd
+
+import feature_store
+from instrumentation import stage
+
+
+def estimate_bytes(file_url: str, columns: List[str]) -> int:
+    """Returns estimated memory of selected columns and index of feature file, all of them as 8 byte values
+
+    Columns are downcast to float32 only if it keeps their values exactly, which is not known before reading.
+    """
+    return feature_store.file_rows(file_url) * 8 * (len(columns) + 1)
+
+
+def downcast(df: pd.DataFrame) -> pd.DataFrame:
+    """Converts float64 EMG feature columns to float32 where float32 keeps all their values exactly
+
+    Force columns are kept in full precision, as they are regression targets and saved with results.
+    """
+    for c in df.columns:
+        if feature_store.emg_feature_channel(c) is None or df[c].dtype != np.float64:
+            continue
+        values = df[c].values
+        with np.errstate(over='ignore'):
+            converted = values.astype(np.float32)
+        if np.array_equal(converted.astype(np.float64), values, equal_nan=True):
+            df[c] = converted
+    return df
+
+
+class SubjectLoader:
+    """Loads feature files of a single subject within a memory budget
+
+    Only selected columns are read. With a budget, EMG features are downcast to float32 where it is exact and files
+    that do not fit in the remaining budget are read chunk by chunk to a memory-mapped file in scratch folder, instead
+    of kept in memory. Without a budget files are read as they are, the same as loading them directly.
+    """
+
+    def __init__(self, select_columns: Callable[[str], List[str]], max_bytes: int = None,
+                 parent_folder: str = None):
+        self.select_columns = select_columns
+        self.max_bytes = max_bytes
+        self.parent_folder = parent_folder
+        self.spill_folder = None
+        self.spilled = 0
+
+    def estimate(self, files: List[str]) -> int:
+        """Returns estimated memory of all given files after loading"""
+        return sum(estimate_bytes(f, self.select_columns(f)) for f in files)
+
+    def reserve(self, groups: List[List[str]]) -> int:
+        """Returns memory to be left in budget for a copy of the largest group of files, eg. train and test data of a
+        split prepared from all recordings of a day, 0 without a budget"""
+        if self.max_bytes is None:
+            return 0
+        return max([self.estimate(files) for files in groups] + [0])
+
+    def order(self, groups: Dict[any, List[str]]) -> List[any]:
+        """Returns group keys in processing order - groups fitting in budget first, then larger ones by size
+
+        Without a budget order of groups is kept.
+        """
+        keys = list(groups)
+        if self.max_bytes is None:
+            return keys
+
+        sizes = {k: self.estimate(groups[k]) for k in keys}
+        return sorted(keys, key=lambda k: (sizes[k] > self.max_bytes, sizes[k] if sizes[k] > self.max_bytes else 0,
+                                           keys.index(k)))
+
+    def load(self, record_files: Dict[any, str], reserve: int = 0) -> Dict[any, pd.DataFrame]:
+        """Loads feature files of records, returns dict of record -> DataFrame
+
+        With a budget, reserve bytes of it are left for data copied from loaded DataFrames (see reserve()), files not
+        fitting in the rest of it are memory-mapped.
+        """
+        self.release()
+        dfs: Dict[any, pd.DataFrame] = dict()
+        used = 0
+        for r, file_url in record_files.items():
+            print("\tReading features for input file: ", r)
+            columns = self.select_columns(file_url)
+            with stage('read features', file=os.path.basename(file_url)):
+                if self.max_bytes is None:
+                    dfs[r] = feature_store.read_features(file_url, columns)
+                    continue
+
+                if used + estimate_bytes(file_url, columns) > self.max_bytes - reserve:
+                    dfs[r] = self._spill(file_url, columns)
+                    continue
+
+                dfs[r] = downcast(feature_store.read_features(file_url, columns))
+                used += int(dfs[r].memory_usage(index=True, deep=False).sum())
+        return dfs
+
+    def _spill(self, file_url: str, columns: List[str]) -> pd.DataFrame:
+        """Reads selected columns of feature file chunk by chunk to a memory-mapped file, returns DataFrame of it
+
+        Columns are kept in a single 2-D array in their order, so DataFrame is built on the mapped array without
+        a copy. Files with non-numeric columns are read to memory.
+        """
+        dtype = np.result_type(*feature_store.feature_dtypes(file_url, columns)) if columns else None
+        if dtype is None or not np.issubdtype(dtype, np.number):
+            return feature_store.read_features(file_url, columns)
+
+        if self.spill_folder is None:
+            self.spill_folder = tempfile.mkdtemp(prefix='force_learn_spill_', dir=self.parent_folder)
+        path = os.path.join(self.spill_folder, '{:d}.npy'.format(self.spilled))
+        self.spilled += 1
+
+        mapped = np.lib.format.open_memmap(path, mode='w+', dtype=dtype,
+                                           shape=(feature_store.file_rows(file_url), len(columns)))
+        indexes: List[pd.Index] = list()
+        begin = 0
+        for chunk in feature_store.read_chunks(file_url, columns):
+            mapped[begin:begin + len(chunk)] = chunk.values
+            begin += len(chunk)
+            indexes.append(chunk.index)
+        mapped.flush()
+        del mapped
+
+        index = indexes[0].append(indexes[1:]) if indexes else pd.RangeIndex(0)
+        return pd.DataFrame(np.load(path, mmap_mode='r'), index=index, columns=columns, copy=False)
+
+    def release(self):
+        """Removes memory-mapped files of previously loaded subject"""
+        if self.spill_folder is not None:
+            shutil.rmtree(self.spill_folder, ignore_errors=True)
+        self.spill_folder = None
+        self.spilled = 0
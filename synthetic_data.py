@@ -0,0 +1,100 @@
+import os
+import datetime
+
+from typing import List
+
+import numpy as np
+import pandas as pd
+from scipy import signal
+
+from stream_filter import SAMPLING_FREQUENCY
+
+
+# putEMG HDF5 schema: 24 EMG channels (3 bands of 8), force sensors and finger trajectories (1 - thumb ... 4 - ring
+# and small finger), trajectory the subject was asked to follow is TRAJ_GT
+EMG_CHANNELS = 24
+FORCE_CHANNELS = 10
+FINGERS = 4
+
+# trials recorded for each subject and day, MVC recording is added to each day
+TRAJECTORIES = ['sequential', 'repeats_long', 'repeats_short']
+
+# seconds of MVC recording, long enough for a press of each finger
+MVC_DURATION = 12.0
+
+
+def file_name(subject: int, trajectory: str, day: datetime.datetime) -> str:
+    """Returns putEMG file name, eg. emg_force-03-sequential-2018-05-11-11-05-00-595.hdf5"""
+    return 'emg_force-{:02d}-{:s}-{:s}-{:03d}.hdf5'.format(subject, trajectory, day.strftime('%Y-%m-%d-%H-%M-%S'),
+                                                         day.microsecond // 1000)
+
+
+def finger_activations(samples: int, rng: np.random.RandomState, mvc: bool = False) -> np.ndarray:
+    """Returns (samples, fingers) smooth force activations between 0 and 1, consecutive presses of random fingers
+
+    MVC recording contains a single maximal press of each finger.
+    """
+    activations = np.zeros((samples, FINGERS))
+    press = int(2 * SAMPLING_FREQUENCY)
+    begin = 0
+    finger = 0
+    while begin + press <= samples:
+        level = 1.0 if mvc else rng.uniform(0.1, 0.7)
+        activations[begin:begin + press, finger] = level * np.sin(np.linspace(0, np.pi, press)) ** 2
+        begin += press + int(rng.uniform(0.2, 1.0) * SAMPLING_FREQUENCY)
+        finger = (finger + 1) % FINGERS if mvc else rng.randint(FINGERS)
+    return activations
+
+
+def recording(duration: float, rng: np.random.RandomState, mvc: bool = False) -> pd.DataFrame:
+    """Returns synthetic recording of given duration in seconds, in putEMG DataFrame layout
+
+    EMG is band-limited noise modulated by finger activations mixed over channels, with 50 Hz interference, force
+    sensors and trajectories follow activations.
+    """
+    samples = int(duration * SAMPLING_FREQUENCY)
+    activations = finger_activations(samples, rng, mvc)
+
+    # each finger drives neighbouring electrodes of every band stronger
+    mixing = rng.uniform(0.0, 0.3, (FINGERS, EMG_CHANNELS))
+    for finger in range(FINGERS):
+        for band in range(0, EMG_CHANNELS, 8):
+            mixing[finger, band + finger * 2:min(band + finger * 2 + 3, band + 8)] += 0.7
+
+    sos = signal.butter(4, (20.0, 450.0), btype='bandpass', fs=SAMPLING_FREQUENCY, output='sos')
+    noise = signal.sosfilt(sos, rng.standard_normal((samples, EMG_CHANNELS)), axis=0)
+    amplitude = 50.0 + 2000.0 * activations @ mixing
+    time = np.arange(samples) / SAMPLING_FREQUENCY
+    hum = 20.0 * np.sin(2 * np.pi * 50.0 * time[:, np.newaxis] + rng.uniform(0, 2 * np.pi, EMG_CHANNELS))
+
+    data = dict()
+    emg = noise * amplitude + hum
+    for c in range(EMG_CHANNELS):
+        data['EMG_{:d}'.format(c + 1)] = emg[:, c]
+    for c in range(FORCE_CHANNELS):
+        finger = min(c // 2, FINGERS - 1)
+        data['FORCE_{:d}'.format(c + 1)] = 100.0 * activations[:, finger] + rng.normal(0.0, 0.5, samples)
+    for finger in range(FINGERS):
+        data['TRAJ_{:d}'.format(finger + 1)] = activations[:, finger]
+    data['TRAJ_GT'] = activations.max(axis=1)
+
+    return pd.DataFrame(data)
+
+
+def generate(folder: str, subjects: int, duration: float, seed: int = 0) -> List[str]:
+    """Writes synthetic putEMG recordings of given number of subjects (one day each) to folder, returns file paths
+
+    Every day contains MVC recording and a trial of each trajectory, saved in table format like filtered data.
+    """
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.RandomState(seed)
+
+    files = list()
+    for subject in range(1, subjects + 1):
+        day = datetime.datetime(2018, 5, 11, 10, 0, 0, 123000) + datetime.timedelta(days=subject)
+        for i, trajectory in enumerate(['mvc'] + TRAJECTORIES):
+            file_url = os.path.join(folder, file_name(subject, trajectory, day + datetime.timedelta(minutes=10 * i)))
+            df = recording(MVC_DURATION if trajectory == 'mvc' else duration, rng, trajectory == 'mvc')
+            df.to_hdf(file_url, 'data', format='table', mode='w', complevel=5)
+            files.append(file_url)
+    return files
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# scripts of this repository are top-level modules, tests import them from repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,28 @@
+import os
+
+from experiment_config import ExperimentConfig, settings_hash
+
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'force_learn_config.xml')
+
+
+def test_settings_hash_follows_task_settings():
+    config = ExperimentConfig(CONFIG_FILE)
+    settings = config.settings()
+    trajectory, feature_set, reg = next(iter(config.trajectories)), next(iter(config.feature_sets)), \
+        next(iter(config.regressors))
+    reference = settings_hash(settings, trajectory, feature_set, reg, config.force_feature)
+
+    # unrelated settings and order of entries do not change the hash
+    reordered = {k: dict(reversed(list(v.items()))) if isinstance(v, dict) else v for k, v in settings.items()}
+    assert settings_hash(dict(reordered, trajectories=dict(reordered["trajectories"], Other=[9])),
+                         trajectory, feature_set, reg, config.force_feature) == reference
+
+    changed_regressor = dict(settings["regressors"][reg], args=dict(settings["regressors"][reg]["args"], x=1))
+    changed = [dict(settings, regressors=dict(settings["regressors"], **{reg: changed_regressor})),
+               dict(settings, channel_ranges=dict(settings["channel_ranges"], **{feature_set: {"begin": 1, "end": 8}})),
+               dict(settings, n_splits=settings["n_splits"] + 1)]
+    for s in changed:
+        assert settings_hash(s, trajectory, feature_set, reg, config.force_feature) != reference
+    assert settings_hash(settings, trajectory, feature_set, reg, 'MIN') != reference
+    assert settings_hash(settings, trajectory, feature_set, reg, config.force_feature, multi_output=True) != reference
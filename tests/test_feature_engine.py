@@ -0,0 +1,150 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import signal
+
+import feature_engine
+from feature_engine import FeatureConfig
+
+
+XML_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'force_features.xml')
+
+
+def recording(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(rng.normal(size=(rows, 4)) * 50, columns=['EMG_{:d}'.format(c) for c in range(1, 5)],
+                      index=np.arange(1000, 1000 + rows))
+    df['FORCE_1'] = np.cumsum(rng.normal(size=rows))
+    df['TRAJ_1'] = (np.arange(rows) // 700 % 2).astype(float)
+    return df
+
+
+def test_power_matches_periodogram():
+    windows = np.random.default_rng(1).normal(size=(3, 2, 513))
+    for length in (512, 513):
+        im = feature_engine.WindowIntermediates(windows[..., :length])
+        _, expected = signal.periodogram(windows[..., :length], feature_engine.SAMPLING_FREQUENCY, axis=-1)
+        np.testing.assert_allclose(im.power, expected, rtol=1e-10, atol=1e-12)
+
+
+@pytest.mark.parametrize('rows', [511, 512, 767, 768, 10000])
+def test_window_index_matches_per_window_loop(rows):
+    index = pd.RangeIndex(rows)
+    ends = [begin + 511 for begin in range(0, rows - 511, 256)]
+    assert list(feature_engine.window_index(index, 512, 256)) == ends
+
+
+def test_batches_match_per_window_loop(monkeypatch):
+    # small batches, so windows of a single call span several of them
+    monkeypatch.setattr(feature_engine, 'WINDOW_BATCH', 7)
+    config = FeatureConfig(XML_FILE)
+    df = recording(40 * 256 + 100)
+    values = df[feature_engine.emg_columns(df)].values
+
+    calculated = feature_engine.calculate_features_on_array(values, config.emg_features, config.window, config.step)
+
+    begins = range(0, len(values) - config.window + 1, config.step)
+    for f in config.emg_features:
+        single = np.stack([feature_engine.calculate_features_on_array(
+            values[b:b + config.window], [f], config.window, config.step)[f][0] for b in begins])
+        np.testing.assert_allclose(calculated[f], single, rtol=1e-12, err_msg=f.name)
+
+
+@pytest.mark.parametrize('rows', [5000, 5000 + 255])
+def test_batched_engine_matches_putemg_features(rows):
+    pytest.importorskip('putemg_features')
+    config = FeatureConfig(XML_FILE)
+    df = recording(rows)
+
+    for f in config.all_features():
+        reference = feature_engine.reference_features(config, [f], df)
+        batched = feature_engine.features_from_config_on_df(config, df, [f])
+
+        assert list(batched.columns) == list(reference.columns), f.name
+        assert batched.index.equals(reference.index), f.name
+        np.testing.assert_allclose(batched.values, reference.values, rtol=1e-6, atol=1e-9, err_msg=f.name)
+
+
+def test_putemg_features_engine_records_each_feature(tmp_path, monkeypatch):
+    pytest.importorskip('putemg_features')
+    import instrumentation
+
+    trace = str(tmp_path / 'trace.jsonl')
+    monkeypatch.setenv(instrumentation.TRACE_VARIABLE, trace)
+    config = FeatureConfig(XML_FILE)
+    df = recording(3000)
+
+    calculated = feature_engine.features_from_config_on_df(config, df, batched=False)
+    reference = feature_engine.reference_features(config, config.all_features(), df)
+
+    pd.testing.assert_frame_equal(calculated, reference)
+    names = [e["name"] for e in instrumentation.read_trace(trace)]
+    assert names == ['feature ' + f.name for f in config.all_features()]
+
+
+def test_features_of_the_same_name_are_kept_apart():
+    config = FeatureConfig(XML_FILE)
+    df = recording(5000)
+    tm3 = feature_engine.FeatureDescriptor('TM', {'order': '3'})
+    tm4 = feature_engine.FeatureDescriptor('TM', {'order': '4'})
+
+    first, second = feature_engine.calculate_each_feature(config, df, [tm3, tm4])
+
+    assert list(first.columns) == list(second.columns) == ['TM_' + c for c in feature_engine.emg_columns(df)]
+    np.testing.assert_allclose(first.values, feature_engine.calculate_each_feature(config, df, [tm3])[0].values)
+    np.testing.assert_allclose(second.values, feature_engine.calculate_each_feature(config, df, [tm4])[0].values)
+    assert not np.allclose(first.values, second.values)
+
+
+def test_reference_xml_is_written_once_per_config(monkeypatch):
+    pytest.importorskip('putemg_features')
+    import pickle
+    import tempfile
+
+    written = list()
+    mkstemp = tempfile.mkstemp
+    monkeypatch.setattr(tempfile, 'mkstemp', lambda **kwargs: written.append(1) or mkstemp(**kwargs))
+
+    config = FeatureConfig(XML_FILE)
+    features = config.emg_features[:2]
+    df = recording(3000)
+    for chunk in (df.iloc[:1500], df.iloc[1500:]):
+        feature_engine.reference_features(config, features, chunk)
+    assert len(written) == 1
+
+    xml_file_url = config.reference(features).xml_file_url
+    assert os.path.isfile(xml_file_url)
+    # copies sent to worker processes write their own XML files
+    assert pickle.loads(pickle.dumps(config))._references == dict()
+    del config
+    assert not os.path.isfile(xml_file_url)
+
+
+def test_cache_key_depends_on_engine():
+    from feature_cache import FeatureCache
+
+    config = FeatureConfig(XML_FILE)
+    rms = feature_engine.FeatureDescriptor('RMS', {})
+    batched = FeatureCache.key('a', 'b', config, rms, feature_engine.engine_description(rms))
+    assert batched == FeatureCache.key('a', 'b', config, rms, feature_engine.engine_description(rms))
+    assert batched != FeatureCache.key('a', 'b', config, rms, ['putemg_features', 'version'])
+    assert batched != FeatureCache.key('a', 'b', config, feature_engine.FeatureDescriptor('RMS', {'x': '1'}),
+                                       feature_engine.engine_description(rms))
+
+
+@pytest.mark.parametrize('chunk', [100, 256, 777, 5000])
+def test_feature_stream_matches_whole_recording(chunk):
+    config = FeatureConfig(XML_FILE)
+    df = recording(12 * 256 + 300)
+    supported = [f for f in config.all_features() if feature_engine.is_supported(f)]
+    expected = feature_engine.features_from_config_on_df(config, df, supported)
+
+    stream = feature_engine.FeatureStream(
+        config, lambda d: feature_engine.features_from_config_on_df(config, d, supported))
+    calculated = [stream.push(df.iloc[b:b + chunk]) for b in range(0, len(df), chunk)]
+
+    calculated = pd.concat([c for c in calculated if c is not None])
+    assert stream.windows == len(expected)
+    pd.testing.assert_frame_equal(calculated, expected, check_exact=False, rtol=1e-12)
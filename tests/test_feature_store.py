@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import feature_store
+
+
+def extension(output_format: str) -> str:
+    return feature_store.STORE_EXTENSION if output_format == 'parquet' else '.hdf5'
+
+@pytest.mark.parametrize('output_format', ['hdf5', 'parquet'])
+def test_feature_writer_matches_whole_write(tmp_path, output_format):
+    if output_format == 'parquet':
+        pytest.importorskip('pyarrow')
+    df = pd.DataFrame(np.random.default_rng(0).normal(size=(100, 3)),
+                      columns=['RMS_EMG_1', 'RMS_EMG_2', 'MEAN_FORCE_1'], index=np.arange(511, 511 + 100 * 256, 256))
+    file_url = str(tmp_path / 'sub' / ('f' + extension(output_format)))
+
+    writer = feature_store.FeatureWriter(file_url, output_format)
+    for begin, end in ((0, 30), (30, 30), (30, 70), (70, 100)):
+        writer.write(df.iloc[begin:end])
+    writer.write(None)
+    writer.close()
+
+    pd.testing.assert_frame_equal(feature_store.read_features(file_url), df, check_index_type=False,
+                                  check_names=False)
+    assert feature_store.file_rows(file_url) == len(df)
+
+
+def test_feature_writer_of_no_rows(tmp_path):
+    pytest.importorskip('pyarrow')
+    output_format = 'parquet'
+    df = pd.DataFrame(columns=['RMS_EMG_1'], dtype=float)
+    file_url = str(tmp_path / ('f' + extension(output_format)))
+
+    writer = feature_store.FeatureWriter(file_url, output_format)
+    writer.write(df)
+    writer.close()
+
+    assert list(feature_store.read_features(file_url).columns) == ['RMS_EMG_1']
+    assert feature_store.file_rows(file_url) == 0
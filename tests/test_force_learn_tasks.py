@@ -0,0 +1,270 @@
+import os
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+import pytest
+
+biolab_utilities = pytest.importorskip('putemg_features.biolab_utilities')
+
+import force_learn_tasks
+import regressors
+from force_learn_tasks import SharedArrays, SplitData, column_selector, column_positions, run_tasks
+
+
+FEATURE_SETS = {"RMS": ["RMS"], "MAV_RMS": ["MAV", "RMS"], "WL_MAV_band": ["WL", "MAV"]}
+CHANNEL_RANGES = {"RMS": {"begin": 1, "end": 8}, "MAV_RMS": {"begin": 1, "end": 8},
+                  "WL_MAV_band": {"begin": 3, "end": 6}}
+TRAJECTORIES = {"Thumb": [1], "Index": [2], "Two": [2, 3]}
+REGRESSORS = {"LR": {"predictor": "LR", "args": {}},
+              "MLPR": {"predictor": "MLPR", "args": {"hidden_layer_sizes": (8, ), "max_iter": 20, "random_state": 0}},
+              "SVR": {"predictor": "SVR", "args": {"kernel": "rbf", "C": 1.0, "epsilon": 0.1}}}
+FORCE_FEATURE = "MEAN"
+
+
+def combinations():
+    """Regressors of each trajectory, SVR is single output only"""
+    for trajectory_name, trajectory in TRAJECTORIES.items():
+        for reg_id, reg_settings in REGRESSORS.items():
+            if len(trajectory) == 1 or reg_settings["predictor"] != "SVR":
+                yield trajectory_name, trajectory, reg_id, reg_settings
+
+
+RECORDINGS = ['emg_force-03-repeats_long-2018-05-11-11-05-00-595', 'emg_force-03-sequential-2018-05-11-11-10-00-595',
+              'emg_force-03-repeats_short-2018-05-11-11-15-00-595']
+
+
+@pytest.fixture(scope='module')
+def recordings():
+    rng = np.random.default_rng(0)
+    dfs = dict()
+    for name in RECORDINGS:
+        rows = 300
+        data = dict()
+        for feature in ("WL", "MAV", "RMS"):
+            for channel in range(1, 9):
+                data['{:s}_EMG_{:d}'.format(feature, channel)] = rng.normal(size=rows)
+        for finger in range(1, 6):
+            for source in ("FORCE", "TRAJ"):
+                data['{:s}_{:s}_{:d}'.format(FORCE_FEATURE, source, finger)] = rng.normal(size=rows)
+        dfs[biolab_utilities.Record(name + '_filtered_features.hdf5')] = pd.DataFrame(data)
+    return dfs
+
+
+def serial_results(dfs):
+    """Results of the original serial loop, each combination prepared with prepare_force_data on its own"""
+    results = dict()
+    for id_, splits in biolab_utilities.data_per_id_and_date(list(dfs), n_splits=3).items():
+        for trajectory_name, trajectory, reg_id, reg_settings in combinations():
+            for i_s, s in enumerate(splits):
+                for feature_set_name, features in FEATURE_SETS.items():
+                    data = biolab_utilities.prepare_force_data(dfs, s, features, FORCE_FEATURE, trajectory)
+                    channel_range = CHANNEL_RANGES[feature_set_name]
+                    band_columns = [c for c in data['train']['input'].columns if
+                                    channel_range["begin"] <= int(c[c.rindex('_') + 1:]) <= channel_range["end"]]
+                    pipeline = biolab_utilities.prepare_pipeline(data['train']['input'][band_columns],
+                                                                 data['train']['output'],
+                                                                 predictor=reg_settings["predictor"],
+                                                                 norm_per_feature=False, **reg_settings["args"])
+                    results[(trajectory_name, i_s, feature_set_name, reg_id)] = (
+                        data['test']['output'].values.astype(float),
+                        pipeline.predict(data['test']['input'][band_columns]))
+    return results
+
+
+def split_tasks(recordings, shared):
+    """Tasks of all combinations and splits with their data put to shared arrays, and test targets of each task"""
+    all_features = sorted(set(f for features in FEATURE_SETS.values() for f in features))
+    all_fingers = sorted(set(f for fingers in TRAJECTORIES.values() for f in fingers))
+    splits = list(biolab_utilities.data_per_id_and_date(list(recordings), n_splits=3).values())[0]
+
+    tasks, y_true = list(), list()
+    for i_s, s in enumerate(splits):
+        split_data = SplitData(recordings, s, all_features, FORCE_FEATURE, all_fingers)
+        descriptors = {name: shared.put(getattr(split_data, name))
+                       for name in ("train_x", "train_y", "test_x", "test_y")}
+        for trajectory_name, trajectory, reg_id, reg_settings in combinations():
+            for feature_set_name, features in FEATURE_SETS.items():
+                output_columns = split_data.output_columns(trajectory)
+                tasks.append(dict(key=(trajectory_name, i_s, feature_set_name, reg_id), **descriptors,
+                                  input_columns=split_data.input_columns(features, CHANNEL_RANGES[feature_set_name]),
+                                  output_columns=output_columns, reg_settings=reg_settings))
+                y_true.append(split_data.test_y.values[:, output_columns].astype(float))
+    return tasks, y_true
+
+
+def test_parallel_tasks_match_serial_loop(recordings, tmp_path):
+    expected = serial_results(recordings)
+
+    with SharedArrays(str(tmp_path)) as shared:
+        tasks, y_true = split_tasks(recordings, shared)
+        results = {i: (result, error) for i, result, error in run_tasks(tasks, jobs=2)}
+
+    assert set(expected) == set(task["key"] for task in tasks)
+    for i, task in enumerate(tasks):
+        result, error = results[i]
+        assert error is None, error
+        expected_y_true, expected_y_pred = expected[task["key"]]
+        assert y_true[i].shape == expected_y_true.shape
+        np.testing.assert_array_equal(y_true[i], expected_y_true)
+        assert np.shape(result["y_pred"]) == np.shape(expected_y_pred)
+        np.testing.assert_allclose(result["y_pred"], expected_y_pred, rtol=1e-10, atol=1e-12)
+
+
+def test_warm_start_uses_pipeline_preprocessing(recordings, tmp_path):
+    expected = serial_results(recordings)
+
+    with SharedArrays(str(tmp_path)) as shared:
+        tasks, _ = split_tasks(recordings, shared)
+        results = {i: (result, error) for i, result, error in run_tasks(tasks, jobs=1, warm_start=True)}
+
+    for i, task in enumerate(tasks):
+        result, error = results[i]
+        assert error is None, error
+        trajectory_name, split, _, reg_id = task["key"]
+        # MLP continues from weights of the previous split, only the first one is fitted from scratch
+        if reg_id != "MLPR" or split == 0:
+            np.testing.assert_allclose(np.reshape(result["y_pred"], np.shape(expected[task["key"]][1])),
+                                       expected[task["key"]][1], rtol=1e-6, atol=1e-8)
+
+
+def test_warm_svr_kernels_are_timed_as_fit_and_predict(recordings, tmp_path, monkeypatch):
+    import warm_training
+
+    split = list(biolab_utilities.data_per_id_and_date(list(recordings), n_splits=3).values())[0][0]
+    split_data = SplitData(recordings, split, ["RMS"], FORCE_FEATURE, [1, 2, 3])
+    kernels, kernels_at_fit = list(), list()
+    rbf_kernel, fit_svrs = warm_training.rbf_kernel, warm_training.fit_svrs
+
+    def counted_kernel(*args, **kwargs):
+        kernels.append(1)
+        return rbf_kernel(*args, **kwargs)
+
+    def counted_fit(*args):
+        kernels_at_fit.append(len(kernels))
+        return fit_svrs(*args)
+
+    monkeypatch.setattr(warm_training, 'rbf_kernel', counted_kernel)
+    monkeypatch.setattr(warm_training, 'fit_svrs', counted_fit)
+
+    trainer = warm_training.WarmTrainer()
+    input_columns = split_data.input_columns(["RMS"], CHANNEL_RANGES["RMS"])
+    with SharedArrays(str(tmp_path)) as shared:
+        train_x = shared.put(split_data.train_x)
+        for trajectory in ("Thumb", "Index"):
+            task = dict(key=(trajectory, 0, "RMS", "SVR"), input_columns=input_columns, reg_settings=REGRESSORS["SVR"],
+                        train_x=train_x)
+            output_columns = split_data.output_columns(TRAJECTORIES[trajectory])
+            result = trainer.fit_and_predict(task, split_data.train_x.iloc[:, input_columns],
+                                             split_data.train_y.iloc[:, output_columns],
+                                             split_data.test_x.iloc[:, input_columns])
+            assert result["predict_time"] > 0
+
+    # train kernel is calculated before the first fit, test kernel after it, both are shared by the next task
+    assert kernels_at_fit == [1, 2]
+    assert len(kernels) == 2
+
+
+def test_shared_arrays_round_trip(tmp_path):
+    df = pd.DataFrame(np.arange(20.0).reshape(4, 5), columns=list('abcde'))
+    with SharedArrays(str(tmp_path)) as shared:
+        descriptor = shared.put(df)
+        pd.testing.assert_frame_equal(SharedArrays.load(descriptor), df)
+        pd.testing.assert_frame_equal(SharedArrays.load(descriptor, column_selector([1, 2, 3])), df[['b', 'c', 'd']])
+        pd.testing.assert_frame_equal(SharedArrays.load(descriptor, [4, 0]), df[['e', 'a']])
+        pd.testing.assert_series_equal(SharedArrays.load(descriptor, 2), df['c'])
+        assert force_learn_tasks.column_names(descriptor, slice(0, 2)) == ['a', 'b']
+        assert column_positions(slice(1, 3)) == [1, 2]
+
+
+def crashing_fit_and_predict(task):
+    """Kills worker process for tasks of 'crash' trajectory"""
+    if task["key"][0] == 'crash':
+        os._exit(1)
+    return {"y_pred": np.full(2, float(task["key"][1])), "fit_time": 0.0, "predict_time": 0.0}
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason='patched function is inherited by fork')
+def test_run_tasks_recovers_from_dead_worker(monkeypatch):
+    monkeypatch.setattr(force_learn_tasks, 'fit_and_predict', crashing_fit_and_predict)
+    tasks = [{"key": ('crash' if i == 3 else 'ok', i, 'RMS', 'LR')} for i in range(8)]
+
+    results = {i: (result, error) for i, result, error in run_tasks(tasks, jobs=2)}
+
+    assert sorted(results) == list(range(8))
+    assert results[3][0] is None and 'died' in results[3][1]
+    for i in range(8):
+        if i != 3:
+            assert results[i][1] is None
+            assert (results[i][0]["y_pred"] == i).all()
+
+
+def test_multi_output_svr_uses_prepare_pipeline(recordings, tmp_path):
+    split = list(biolab_utilities.data_per_id_and_date(list(recordings), n_splits=3).values())[0][0]
+    data = biolab_utilities.prepare_force_data(recordings, split, ["RMS"], FORCE_FEATURE, TRAJECTORIES["Two"])
+    expected = np.stack([biolab_utilities.prepare_pipeline(data['train']['input'], data['train']['output'].iloc[:, c],
+                                                           predictor="SVR", norm_per_feature=False,
+                                                           **REGRESSORS["SVR"]["args"]).predict(data['test']['input'])
+                         for c in range(2)], axis=1)
+
+    with SharedArrays(str(tmp_path)) as shared:
+        split_data = SplitData(recordings, split, ["RMS"], FORCE_FEATURE, TRAJECTORIES["Two"])
+        task = dict(key=("Two", 0, "RMS", "SVR"),
+                    input_columns=split_data.input_columns(["RMS"], CHANNEL_RANGES["RMS"]),
+                    output_columns=split_data.output_columns(TRAJECTORIES["Two"]), reg_settings=REGRESSORS["SVR"],
+                    save_model=True, **{name: shared.put(getattr(split_data, name))
+                                        for name in ("train_x", "train_y", "test_x", "test_y")})
+        result = force_learn_tasks.fit_and_predict(task)
+
+    np.testing.assert_allclose(result["y_pred"], expected, rtol=1e-10, atol=1e-12)
+    np.testing.assert_allclose(result["pipeline"].predict(data['test']['input']), expected, rtol=1e-10, atol=1e-12)
+    assert result["predict_time"] > 0
+
+
+def test_multi_output_svr_shares_preprocessing_and_kernel(recordings, monkeypatch):
+    split = list(biolab_utilities.data_per_id_and_date(list(recordings), n_splits=3).values())[0][0]
+    data = biolab_utilities.prepare_force_data(recordings, split, ["RMS"], FORCE_FEATURE, TRAJECTORIES["Two"])
+
+    calls = {"prepare_pipeline": 0, "rbf_kernel": 0}
+
+    def counted(name, function):
+        def call(*args, **kwargs):
+            calls[name] += 1
+            return function(*args, **kwargs)
+        return call
+    monkeypatch.setattr(biolab_utilities, 'prepare_pipeline', counted('prepare_pipeline',
+                                                                      biolab_utilities.prepare_pipeline))
+    monkeypatch.setattr(regressors, 'rbf_kernel', counted('rbf_kernel', regressors.rbf_kernel))
+
+    pipeline = regressors.prepare_pipeline(data['train']['input'], data['train']['output'], predictor="SVR",
+                                           **REGRESSORS["SVR"]["args"])
+    # preprocessing is probed and fitted once, train kernel is calculated once for both outputs
+    assert calls == {"prepare_pipeline": 1, "rbf_kernel": 1}
+    assert pipeline[-1].n_jobs == regressors.output_threads(2)
+
+    assert pipeline.predict(data['test']['input']).shape == (len(data['test']['input']), 2)
+    assert calls["rbf_kernel"] == 2
+
+
+def test_approximate_svr_uses_pipeline_preprocessing_in_mini_batches(recordings, monkeypatch):
+    split = list(biolab_utilities.data_per_id_and_date(list(recordings), n_splits=3).values())[0][0]
+    data = biolab_utilities.prepare_force_data(recordings, split, ["RMS"], FORCE_FEATURE, TRAJECTORIES["Two"])
+    train_x, train_y, test_x = data['train']['input'], data['train']['output'], data['test']['input']
+    args = {"n_components": 20, "batch_size": 16, "epochs": 2, "random_state": 0}
+
+    steps = regressors.preprocessing(train_x, train_y)
+    transform = steps.transform
+    transformed = list()
+    monkeypatch.setattr(steps, 'transform', lambda x: transformed.append(len(x)) or transform(x), raising=False)
+    norm_per_feature = list()
+    monkeypatch.setattr(regressors, 'preprocessing', lambda x, y, norm: norm_per_feature.append(norm) or steps)
+    monkeypatch.setattr(regressors, 'INITIALISATION_ROWS', 32)
+
+    pipeline = regressors.prepare_pipeline(train_x, train_y, predictor=regressors.APPROXIMATE_SVR,
+                                           norm_per_feature=True, **args)
+
+    assert norm_per_feature == [True]
+    # train data is transformed only in initialisation sample and mini-batches
+    assert max(transformed) <= 32 and sum(transformed) == 32 + 2 * len(train_x)
+    expected = regressors.ApproximateKernelSVR(**args).fit(train_x, regressors.as_target(train_y), transform=transform)
+    np.testing.assert_allclose(pipeline.predict(test_x), expected.predict(transform(test_x)))
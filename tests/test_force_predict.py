@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LinearRegression
+
+import force_predict
+from model_registry import ModelRegistry, record_name
+import results_store
+
+
+INPUTS = ['RMS_EMG_1', 'RMS_EMG_2', 'RMS_EMG_3']
+OUTPUTS = ['MEAN_FORCE_1']
+NAMES = ['emg_force-01-sequential-2018-05-12-10-10-00-123', 'emg_force-01-repeats_long-2018-05-12-10-20-00-123',
+         'emg_force-01-repeats_short-2018-05-12-10-30-00-123', 'emg_force-01-pinch-2018-05-12-10-40-00-123']
+
+
+def features(tmp_path):
+    """Feature files of a subject, the last one without an input column, and model fitted on the first one"""
+    rng = np.random.default_rng(0)
+    folder = tmp_path / 'features'
+    folder.mkdir()
+    files = list()
+    for i, name in enumerate(NAMES):
+        df = pd.DataFrame(rng.normal(size=(120 + 10 * i, 4)), columns=INPUTS + OUTPUTS,
+                          index=np.arange(120 + 10 * i) * 256 + 511)
+        if i == len(NAMES) - 1:
+            df = df.drop(columns=INPUTS[-1])
+        files.append(str(folder / (name + '.hdf5')))
+        df.to_hdf(files[-1], 'data', format='table', mode='w')
+
+    train = pd.read_hdf(files[0])
+    registry = ModelRegistry(str(tmp_path / 'models'))
+    registry.save({"subject": '01', "date": '2018-05-12', "split": 0, "feature_set": 'RMS', "reg": 'LR',
+                   "trajectory": 'Thumb'},
+                  {"pipeline": LinearRegression().fit(train[INPUTS], train[OUTPUTS[0]]), "input_columns": INPUTS,
+                   "output_columns": OUTPUTS, "settings_hash": '0', "train_records": [record_name(files[0])],
+                   "test_records": [record_name(f) for f in files[1:]]})
+    return files, registry
+
+
+def predict(tmp_path, match, batch_rows):
+    files, registry = features(tmp_path)
+    output_folder = str(tmp_path / ('predictions_' + match))
+    os.makedirs(output_folder)
+    written = force_predict.predict_files(registry, registry.list(), files, output_folder, match, batch_rows)
+
+    pipeline = registry.load(registry.list()[0]["key"])["pipeline"]
+    for name in written:
+        meta, records = results_store.read_experiment(output_folder, name)
+        assert meta["id"] == '01/2018-05-12' and meta["match"] == match
+        assert len(records) == 1
+        df = pd.read_hdf(files[NAMES.index(name)])
+        np.testing.assert_allclose(np.asarray(records[0]["y_pred"]).ravel(), pipeline.predict(df[INPUTS]))
+        np.testing.assert_array_equal(records[0]["y_true"], df[OUTPUTS].values)
+    return {name: results_store.read_experiment(output_folder, name)[1][0]["role"] for name in written}
+
+
+def test_predicts_test_recordings_of_split(tmp_path, capsys):
+    # batches of files are smaller than a file, files are read and predicted in chunks
+    assert predict(tmp_path, 'test', 50) == {NAMES[1]: 'test', NAMES[2]: 'test'}
+    # model is not applied to file without its input columns
+    assert 'Skipping models of {:s} without their input columns, eg. RMS_EMG_3'.format(NAMES[3]) in \
+        capsys.readouterr().out
+
+
+def test_marks_role_of_recordings(tmp_path):
+    # a batch spans multiple files
+    assert predict(tmp_path, 'subject', 300) == {NAMES[0]: 'train', NAMES[1]: 'test', NAMES[2]: 'test'}
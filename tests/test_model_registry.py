@@ -0,0 +1,47 @@
+import numpy as np
+from sklearn.linear_model import LinearRegression
+
+from model_registry import ModelRegistry, record_name
+
+
+KEY = {"subject": '01', "date": '2018-05-12', "split": 0, "feature_set": 'RMS', "reg": 'SVR[C=0.5]',
+       "trajectory": 'Thumb'}
+
+
+def model(seed: int):
+    rng = np.random.default_rng(seed)
+    pipeline = LinearRegression().fit(rng.normal(size=(20, 2)), rng.normal(size=20))
+    return {"pipeline": pipeline, "input_columns": ['RMS_EMG_1', 'RMS_EMG_2'], "output_columns": ['MEAN_FORCE_1'],
+            "settings_hash": str(seed), "train_records": ['emg_force-01-sequential-2018-05-12-10-10-00-123'],
+            "test_records": ['emg_force-01-repeats_long-2018-05-12-10-20-00-123']}
+
+
+def test_registry_round_trip(tmp_path):
+    registry = ModelRegistry(str(tmp_path))
+    assert registry.load(KEY) is None and registry.meta(KEY) is None
+
+    assert registry.save(KEY, model(1)) == 1
+    assert registry.save(KEY, model(2)) == 2
+    other = dict(KEY, reg='LR')
+    registry.save(other, model(3))
+    assert registry.versions(KEY) == [1, 2]
+
+    x = np.arange(10.0).reshape(5, 2)
+    for version, seed in ((1, 1), (2, 2), (None, 2)):
+        loaded = registry.load(KEY, version)
+        np.testing.assert_array_equal(loaded["pipeline"].predict(x), model(seed)["pipeline"].predict(x))
+        assert loaded["key"] == KEY and loaded["settings_hash"] == str(seed)
+
+    meta = registry.meta(KEY)
+    assert "pipeline" not in meta and meta["version"] == 2 and meta["key"] == KEY
+    assert meta["train_records"] == model(2)["train_records"] and meta["test_records"] == model(2)["test_records"]
+    assert registry.meta(KEY, 1)["settings_hash"] == '1'
+
+    assert sorted(m["key"]["reg"] for m in registry.list()) == ['LR', 'SVR[C=0.5]']
+    assert [m["version"] for m in registry.list(reg='SVR[C=0.5]')] == [2]
+    assert [m["key"]["reg"] for m in registry.list(version=1)] == ['LR', 'SVR[C=0.5]']
+
+
+def test_record_name_of_feature_file():
+    assert record_name('/data/emg_force-01-sequential-2018-05-12-10-10-00-123.hdf5') == \
+        'emg_force-01-sequential-2018-05-12-10-10-00-123'
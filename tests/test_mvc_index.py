@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from mvc_index import LinearNormalisation, mvc_key
+
+
+def recording(rows: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"EMG_1": rng.normal(size=rows) * 50, "EMG_2": rng.normal(size=rows) * 20,
+                         "FORCE_1": 100 + rng.normal(size=rows)}, index=np.arange(7, 7 + rows))
+
+
+def normalise(data: pd.DataFrame, mvc: pd.DataFrame) -> pd.DataFrame:
+    """EMG divided by MVC amplitude, force scaled to MVC range, like putEMG normalisation"""
+    data = data.copy()
+    for c in data.columns:
+        if c.startswith('EMG_'):
+            data[c] = data[c] / np.abs(mvc[c]).max()
+        else:
+            data[c] = (data[c] - mvc[c].min()) / (mvc[c].max() - mvc[c].min())
+    return data
+
+
+def test_linear_normalisation_matches_normalise():
+    mvc, data = recording(500, 0), recording(3000, 1)
+    normalisation = LinearNormalisation(normalise, mvc, data.iloc[:100])
+
+    for begin in (0, 1000, 2900):
+        chunk = data.iloc[begin:begin + 1000]
+        pd.testing.assert_frame_equal(normalisation.apply(chunk), normalise(chunk, mvc), check_exact=False,
+                                      rtol=1e-12, atol=1e-12)
+
+
+def test_non_linear_normalisation_fails():
+    mvc, data = recording(500, 0), recording(100, 1)
+    with pytest.raises(ValueError):
+        LinearNormalisation(lambda d, m: normalise(d, m) ** 2, mvc, data)
+    with pytest.raises(ValueError):
+        LinearNormalisation(lambda d, m: normalise(d, m).drop(columns='FORCE_1'), mvc, data)
+
+
+def test_mvc_key():
+    assert mvc_key('emg_force-03-sequential-2018-05-11-11-05-00-595.hdf5') == ('emg_force', '03', '2018-05-11')
@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import LinearRegression
+
+biolab_utilities = pytest.importorskip('putemg_features.biolab_utilities')
+
+import online_force
+import process_recordings
+import stream_filter
+import synthetic_data
+from feature_engine import FeatureConfig
+
+
+XML_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'force_features.xml')
+
+
+@pytest.mark.parametrize('batched', [True, False])
+def test_online_matches_offline_pipeline(tmp_path, batched):
+    files = synthetic_data.generate(str(tmp_path / 'raw'), 1, 6.0)
+    mvc = process_recordings.read_filtered(files[0])
+    data: pd.DataFrame = pd.read_hdf(files[1])
+    config = FeatureConfig(XML_FILE)
+
+    expected = online_force.offline_features(config, data, mvc, batched)
+    input_columns = list(expected.columns[:4])
+    pipeline = LinearRegression().fit(expected[input_columns], np.arange(len(expected)))
+    model = {"pipeline": pipeline, "input_columns": input_columns, "output_columns": ['FORCE_1']}
+
+    estimator = online_force.OnlineEstimator(config, mvc, model, batched, lookahead=stream_filter.MARGIN,
+                                             margin=stream_filter.MARGIN)
+    outputs = [estimator.process(data.iloc[begin:begin + 1500]) for begin in range(0, len(data), 1500)]
+    outputs.append(estimator.flush())
+    features = pd.concat([f for f, _ in outputs if f is not None])
+    predictions = pd.concat([p for _, p in outputs if p is not None])
+
+    pd.testing.assert_index_equal(features.index, expected.index)
+    assert estimator.windows == len(expected)
+    scale = expected.abs().max().replace(0, 1)
+    assert ((features[expected.columns] - expected).abs() / scale).max().max() < 1e-8
+    np.testing.assert_allclose(predictions['FORCE_1'].values, pipeline.predict(expected[input_columns]), rtol=1e-6,
+                               atol=1e-6 * len(expected))
+
+
+def test_default_lookahead_deviates_little_from_offline(tmp_path):
+    files = synthetic_data.generate(str(tmp_path / 'raw'), 1, 6.0)
+    mvc = process_recordings.read_filtered(files[0])
+    data: pd.DataFrame = pd.read_hdf(files[1])
+    config = FeatureConfig(XML_FILE)
+    expected = online_force.offline_features(config, data, mvc, True)
+
+    estimator = online_force.OnlineEstimator(config, mvc, batched=True)
+    outputs = [estimator.process(data.iloc[begin:begin + 1500]) for begin in range(0, len(data), 1500)]
+    outputs.append(estimator.flush())
+    features = pd.concat([f for f, _ in outputs if f is not None])
+
+    pd.testing.assert_index_equal(features.index, expected.index)
+    amplitude = [c for c in expected.columns if c.startswith(('RMS_', 'MAV_'))]
+    assert amplitude
+    assert online_force.relative_deviation(expected[amplitude], features[amplitude]).max() < 0.05
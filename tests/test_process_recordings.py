@@ -0,0 +1,52 @@
+import os
+
+import pandas as pd
+import pytest
+
+biolab_utilities = pytest.importorskip('putemg_features.biolab_utilities')
+
+import process_recordings
+import synthetic_data
+
+
+XML_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'force_features.xml')
+
+
+@pytest.mark.parametrize('batched', [True, False])
+def test_stream_matches_whole_recording(tmp_path, batched):
+    files = synthetic_data.generate(str(tmp_path / 'raw'), 1, 3.0)
+    mvc_file, trial = files[0], files[1]
+
+    outputs = dict()
+    for chunk_size in (None, 7000):
+        name = 'whole' if chunk_size is None else 'stream'
+        outputs[name] = (str(tmp_path / (name + '_features.hdf5')), str(tmp_path / (name + '_filtered.hdf5')))
+        process_recordings.process_file(trial, mvc_file, XML_FILE, outputs[name][0], 'hdf5', chunk_size,
+                                        outputs[name][1], batched)
+
+    for whole, stream in zip(outputs['whole'], outputs['stream']):
+        expected, calculated = pd.read_hdf(whole), pd.read_hdf(stream)
+        pd.testing.assert_index_equal(calculated.index, expected.index)
+        assert list(calculated.columns) == list(expected.columns)
+        scale = expected.abs().max().replace(0, 1)
+        assert ((calculated - expected).abs() / scale).max().max() < 1e-8
+
+
+def test_filtered_mvc_is_copy(tmp_path):
+    mvc_file = synthetic_data.generate(str(tmp_path / 'raw'), 1, 1.0)[0]
+    process_recordings.filtered_mvc(mvc_file)['EMG_1'] = 0.0
+    assert (process_recordings.filtered_mvc(mvc_file)['EMG_1'] != 0.0).any()
+
+
+def test_filtered_mvc_is_the_same_as_filter_emg_output(tmp_path):
+    import filter_emg
+
+    mvc_file, trial = synthetic_data.generate(str(tmp_path / 'raw'), 1, 1.0)[:2]
+    kept = str(tmp_path / 'kept_mvc_filtered.hdf5')
+    process_recordings.process_file(trial, mvc_file, XML_FILE, str(tmp_path / 'features.hdf5'), 'hdf5',
+                                    filtered_mvc_file=kept)
+    expected = str(tmp_path / 'mvc_filtered.hdf5')
+    filter_emg.filter_file(mvc_file, expected, filter_emg.filter_signature())
+
+    pd.testing.assert_frame_equal(pd.read_hdf(kept), pd.read_hdf(expected))
+    assert filter_emg.is_up_to_date(mvc_file, kept, filter_emg.filter_signature())
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.metrics import r2_score
+
+import result_stats
+
+
+def legacy_metrics(y_true, y_pred):
+    """RMSE and STD as calculated by legacy force_learn_calculate_stats.py"""
+    error = y_true - y_pred.reshape(y_true.shape)
+    return np.sqrt(np.mean(np.power(error, 2))), np.std(error)
+
+
+@pytest.mark.parametrize('offset', [0.0, 1e6])
+@pytest.mark.parametrize('block_size', [7, 1 << 16])
+def test_error_metrics_match_legacy(monkeypatch, offset, block_size):
+    monkeypatch.setattr(result_stats, 'BLOCK_SIZE', block_size)
+    rng = np.random.default_rng(0)
+    y_true = rng.normal(size=(1000, 1)) + offset
+    y_pred = (y_true[:, 0] + rng.normal(size=1000) * 0.1 + offset * 1e-6).astype(np.float32)
+
+    metrics = result_stats.error_metrics(y_true, y_pred)
+    rmse, std = legacy_metrics(y_true, y_pred)
+
+    assert metrics["n"] == 1000
+    assert metrics["rmse"] == pytest.approx(rmse, rel=1e-12)
+    assert metrics["std"] == pytest.approx(std, rel=1e-9)
+    error = y_true.ravel() - y_pred
+    assert metrics["mae"] == pytest.approx(np.mean(np.abs(error)), rel=1e-12)
+    r2 = 1 - np.sum(error ** 2) / np.sum((y_true - y_true.mean()) ** 2)
+    assert metrics["r2"] == pytest.approx(r2, rel=1e-9)
+
+
+@pytest.mark.parametrize('block_size', [7, 1 << 16])
+def test_error_metrics_of_multiple_outputs(monkeypatch, block_size):
+    monkeypatch.setattr(result_stats, 'BLOCK_SIZE', block_size)
+    rng = np.random.default_rng(1)
+    y_true, y_pred = rng.normal(size=(300, 4)), rng.normal(size=1200)
+    rmse, std = legacy_metrics(y_true, y_pred)
+    metrics = result_stats.error_metrics(y_true, y_pred)
+    assert metrics["rmse"] == pytest.approx(rmse, rel=1e-12)
+    assert metrics["std"] == pytest.approx(std, rel=1e-12)
+
+    # columns of different scale and fit, R2 of each column is averaged
+    y_true = y_true * [1.0, 10.0, 0.1, 100.0] + [0.0, 5.0, -3.0, 1e3]
+    y_pred = y_true + rng.normal(size=y_true.shape) * [0.5, 1.0, 0.2, 10.0]
+    metrics = result_stats.error_metrics(y_true, y_pred)
+    assert metrics["r2"] == pytest.approx(r2_score(y_true, y_pred), rel=1e-9)
+    assert metrics["r2"] != pytest.approx(r2_score(y_true.ravel(), y_pred.ravel()), rel=1e-3)
+
+    y_true[:, 0] = 1.0
+    y_pred[:, 0] = 1.0
+    assert result_stats.error_metrics(y_true, y_pred)["r2"] == pytest.approx(r2_score(y_true, y_pred), rel=1e-9)
+
+
+def test_legacy_dict_round_trip():
+    stats = pd.DataFrame({"reg": ['LR', 'LR', 'SVR'], "feature_set": ['RMS'] * 3, "trajectory": ['Thumb'] * 3,
+                          "rmse": [0.1, 0.2, 0.3], "std": [0.01, 0.02, 0.03]})
+    converted = result_stats.from_legacy_dict(result_stats.to_legacy_dict(stats))
+    pd.testing.assert_frame_equal(converted, stats[['reg', 'feature_set', 'trajectory', 'rmse', 'std']])
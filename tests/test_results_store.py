@@ -0,0 +1,98 @@
+import pickle
+
+import numpy as np
+import pytest
+
+import results_store
+
+
+def records(count: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    return [{"split": i % 3, "reg": 'LR' if i % 2 else 'SVR', "trajectory": 'Thumb', "feature_set": 'RMS',
+             "force_feature": 'MEAN', "y_true": rng.normal(size=(50, 1)), "y_pred": rng.normal(size=50)}
+            for i in range(count)]
+
+
+def write_pickle(folder, stem, output):
+    with open(str(folder / (stem + results_store.PICKLE_EXTENSION)), 'wb') as f:
+        pickle.dump(output, f)
+
+
+def assert_records_equal(actual, expected):
+    assert set(actual) == set(expected)
+    for key, value in expected.items():
+        if isinstance(value, np.ndarray):
+            assert np.asarray(actual[key]).dtype == value.dtype
+            np.testing.assert_array_equal(actual[key], value)
+        else:
+            assert actual[key] == value
+
+
+def test_store_round_trip(tmp_path):
+    written = records(6)
+    meta = {"id": '03/2018-05-11', "trajectories": {"Thumb": [1]}}
+    results_store.write_output(str(tmp_path), 'a', dict(meta, results=written))
+
+    read_meta, read = results_store.read_experiment(str(tmp_path), 'a')
+    assert read_meta == meta
+    for actual, expected in zip(read, written):
+        assert_records_equal(actual, expected)
+
+    assert results_store.result_keys(str(tmp_path), 'a') == [('Thumb', d["split"], 'RMS', d["reg"], None)
+                                                                for d in written]
+    selected = list(results_store.read_results(str(tmp_path), reg='LR', split=1))
+    assert [stem for stem, _ in selected] == ['a']
+    assert_records_equal(selected[0][1], written[1])
+
+    located = results_store.index_results(str(tmp_path), reg='SVR')
+    assert [fields["split"] for _, _, fields in located] == [0, 2, 1]
+    assert_records_equal(results_store.load_indexed(str(tmp_path), *located[1][:2]), written[2])
+
+
+def test_empty_arrays_round_trip(tmp_path):
+    written = [{"split": 0, "y_true": np.empty((0, 1)), "y_pred": np.empty(0)}]
+    results_store.write_output(str(tmp_path), 'a', {"id": 'x', "results": written})
+    assert_records_equal(results_store.read_experiment(str(tmp_path), 'a')[1][0], written[0])
+
+
+def test_mixed_folder_reads_both_formats(tmp_path):
+    store_records, pickle_records = records(2, 0), records(3, 1)
+    results_store.write_output(str(tmp_path), 'a', {"id": 'a', "results": store_records})
+    write_pickle(tmp_path, 'b', {"id": 'b', "results": pickle_records})
+
+    assert results_store.list_results(str(tmp_path)) == [('a', results_store.INDEX_EXTENSION),
+                                                         ('b', results_store.PICKLE_EXTENSION)]
+    read = list(results_store.read_results(str(tmp_path)))
+    assert [stem for stem, _ in read] == ['a'] * 2 + ['b'] * 3
+    for (_, actual), expected in zip(read, store_records + pickle_records):
+        assert_records_equal(actual, expected)
+
+    located = results_store.index_results(str(tmp_path), reg='LR')
+    assert [(stem, fields["split"]) for stem, _, fields in located] == [('a', 1), ('b', 1)]
+    assert_records_equal(results_store.load_indexed(str(tmp_path), *located[1][:2]), pickle_records[1])
+    assert results_store.has_results(str(tmp_path), 'b') and not results_store.has_results(str(tmp_path), 'c')
+
+
+def test_stem_in_both_formats_fails(tmp_path):
+    results_store.write_output(str(tmp_path), 'a', {"id": 'a', "results": records(1)})
+    write_pickle(tmp_path, 'a', {"id": 'a', "results": records(1)})
+
+    with pytest.raises(ValueError):
+        list(results_store.read_results(str(tmp_path)))
+    with pytest.raises(ValueError):
+        results_store.has_results(str(tmp_path), 'a')
+
+    results_store.remove_other_format(str(tmp_path), 'a', results_store.PICKLE_EXTENSION)
+    assert results_store.list_results(str(tmp_path)) == [('a', results_store.PICKLE_EXTENSION)]
+
+
+def test_pickled_file_is_loaded_once_for_its_records(tmp_path, monkeypatch):
+    written = records(4)
+    write_pickle(tmp_path, 'b', {"id": 'b', "results": written})
+    loads = list()
+    read_pickle = results_store.read_pickle
+    monkeypatch.setattr(results_store, 'read_pickle', lambda *args: loads.append(args) or read_pickle(*args))
+
+    for position, expected in enumerate(written):
+        assert_records_equal(results_store.load_indexed(str(tmp_path), 'b', position), expected)
+    assert len(loads) == 1
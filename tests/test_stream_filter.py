@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import signal
+
+import stream_filter
+
+
+SOS = np.vstack((signal.butter(4, (20.0, 700.0), btype='bandpass', fs=stream_filter.SAMPLING_FREQUENCY,
+                               output='sos'),
+                 signal.tf2sos(*signal.iirnotch(50.0, 30.0, fs=stream_filter.SAMPLING_FREQUENCY))))
+
+
+def zero_phase_filter(df: pd.DataFrame):
+    """Zero-phase denoising filter applied to the whole DataFrame in place, stands in for apply_filter"""
+    columns = stream_filter.emg_columns(df)
+    df[columns] = signal.sosfiltfilt(SOS, df[columns].values, axis=0)
+
+
+@pytest.fixture
+def recording(tmp_path):
+    rng = np.random.default_rng(0)
+    rows = 150000
+    df = pd.DataFrame(rng.normal(size=(rows, 3)) * 100 + np.sin(np.arange(rows) / 100)[:, np.newaxis] * 50,
+                      columns=['EMG_1', 'EMG_2', 'EMG_3'])
+    df['TRAJ_1'] = rng.integers(0, 2, rows)
+    file_url = str(tmp_path / 'raw.hdf5')
+    df.to_hdf(file_url, 'data', format='table', mode='w')
+    return file_url, df
+
+
+def test_filtered_chunks_match_whole_recording(recording):
+    file_url, df = recording
+    expected = df.copy()
+    zero_phase_filter(expected)
+
+    streamed = pd.concat(stream_filter.filtered_chunks(file_url, zero_phase_filter, chunk_size=40000))
+
+    assert streamed.index.equals(expected.index)
+    assert (streamed['TRAJ_1'].values == df['TRAJ_1'].values).all()
+    np.testing.assert_allclose(streamed.values, expected.values, rtol=0, atol=1e-9 * np.abs(expected.values).max())
+
+
+def test_filter_file_streaming_and_verify(recording, tmp_path):
+    file_url, df = recording
+    output_file = str(tmp_path / 'filtered.hdf5')
+
+    rows = stream_filter.filter_file_streaming(file_url, output_file, zero_phase_filter, chunk_size=40000)
+
+    assert rows == len(df)
+    assert stream_filter.verify_streaming(file_url, output_file, zero_phase_filter, chunk_size=40000) < 1e-6
+
+
+def test_verify_detects_insufficient_margin(recording, tmp_path):
+    file_url, _ = recording
+    output_file = str(tmp_path / 'filtered.hdf5')
+    stream_filter.filter_file_streaming(file_url, output_file, zero_phase_filter, chunk_size=40000, margin=50)
+
+    with pytest.raises(ValueError):
+        stream_filter.verify_streaming(file_url, output_file, zero_phase_filter, chunk_size=40000, margin=50)
+
+
+def test_fixed_format_is_rejected(tmp_path):
+    file_url = str(tmp_path / 'fixed.hdf5')
+    pd.DataFrame({'EMG_1': np.zeros(10)}).to_hdf(file_url, 'data', format='fixed', mode='w')
+
+    with pytest.raises(ValueError):
+        list(stream_filter.filtered_chunks(file_url, zero_phase_filter))
+
+
+@pytest.mark.parametrize('block_size', [1000, 12345])
+def test_lookahead_filter_matches_whole_recording(recording, block_size):
+    _, df = recording
+    expected = df.copy()
+    zero_phase_filter(expected)
+
+    lookahead_filter = stream_filter.LookaheadFilter(zero_phase_filter)
+    blocks = [lookahead_filter.push(df.iloc[begin:begin + block_size]) for begin in range(0, len(df), block_size)]
+    # a sample is returned only with lookahead samples after it
+    assert sum(len(b) for b in blocks) == len(df) - stream_filter.MARGIN
+    streamed = pd.concat(blocks + [lookahead_filter.flush()])
+
+    assert streamed.index.equals(expected.index)
+    columns = stream_filter.emg_columns(df)
+    np.testing.assert_allclose(streamed[columns].values, expected[columns].values, rtol=1e-6,
+                               atol=1e-6 * np.abs(expected[columns].values).max())
+
+
+def test_denoising_filter_response_decays_within_margin():
+    biolab_utilities = pytest.importorskip('putemg_features.biolab_utilities')
+    import synthetic_data
+
+    # impulse response of apply_filter itself, notch of the power line is the slowest to decay
+    df = synthetic_data.recording(4.0 * stream_filter.MARGIN / stream_filter.SAMPLING_FREQUENCY,
+                                  np.random.RandomState(0))
+    columns = stream_filter.emg_columns(df)
+    center = len(df) // 2
+    df[columns] = 0.0
+    df.iloc[center, df.columns.get_indexer(columns)] = 1.0
+    biolab_utilities.apply_filter(df)
+
+    response = np.abs(df[columns].values)
+    peak = response.max()
+    assert response[:center - stream_filter.MARGIN].max() < 1e-10 * peak
+    assert response[center + stream_filter.MARGIN:].max() < 1e-10 * peak
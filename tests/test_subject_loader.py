@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import feature_store
+import subject_loader
+from subject_loader import SubjectLoader
+
+
+def feature_frame(rows: int = 1000) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    # force column between feature columns, its position has to be kept
+    return pd.DataFrame({"RMS_EMG_1": rng.normal(size=rows), "MEAN_FORCE_1": rng.normal(size=rows),
+                         "RMS_EMG_2": rng.normal(size=rows).astype(np.float32).astype(np.float64)},
+                        index=pd.RangeIndex(100, 100 + rows))
+
+
+def is_mapped(df: pd.DataFrame) -> bool:
+    """Checks if values of DataFrame are a view of memory-mapped array"""
+    values = df.to_numpy()
+    while isinstance(values, np.ndarray):
+        if isinstance(values, np.memmap):
+            return True
+        values = values.base
+    return False
+
+
+@pytest.fixture(params=['table', 'parquet'])
+def feature_file(request, tmp_path):
+    df = feature_frame()
+    if request.param == 'parquet':
+        pytest.importorskip('pyarrow')
+        file_url = str(tmp_path / ('features' + feature_store.STORE_EXTENSION))
+        feature_store.write_features(df, file_url)
+    else:
+        file_url = str(tmp_path / 'features.hdf5')
+        df.to_hdf(file_url, key='data', format=request.param)
+    return file_url, df
+
+
+def test_spilled_file_keeps_values_and_column_order(feature_file, tmp_path, monkeypatch):
+    monkeypatch.setattr(feature_store, 'CHUNK_ROWS', 300)
+    file_url, df = feature_file
+    loader = SubjectLoader(lambda f: list(df.columns), max_bytes=1, parent_folder=str(tmp_path))
+
+    loaded = loader.load({'r': file_url})['r']
+
+    pd.testing.assert_frame_equal(loaded, df, check_index_type=False)
+    assert is_mapped(loaded)
+    loader.release()
+
+
+def test_file_in_budget_is_downcast_only_where_exact(feature_file, tmp_path):
+    file_url, df = feature_file
+    loader = SubjectLoader(lambda f: list(df.columns), max_bytes=1 << 30, parent_folder=str(tmp_path))
+
+    loaded = loader.load({'r': file_url})['r']
+
+    assert list(loaded.columns) == list(df.columns)
+    assert list(loaded.dtypes) == [np.float64, np.float64, np.float32]
+    pd.testing.assert_frame_equal(loaded.astype(np.float64), df, check_index_type=False)
+
+
+def test_reserve_spills_files(feature_file, tmp_path):
+    file_url, df = feature_file
+    size = subject_loader.estimate_bytes(file_url, list(df.columns))
+    loader = SubjectLoader(lambda f: list(df.columns), max_bytes=2 * size, parent_folder=str(tmp_path))
+
+    assert loader.reserve([[file_url], [file_url, file_url]]) == 2 * size
+    assert not is_mapped(loader.load({'r': file_url}, reserve=size)['r'])
+    assert is_mapped(loader.load({'r': file_url}, reserve=size + 1)['r'])
+    loader.release()
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+import instrumentation
+
+
+def usage():
+    print()
+    print('Prints stage timings, peak memory and I/O of trace files written with --trace option')
+    print()
+    print('Usage: {:s} <trace_file> [<trace_file> ...]'.format(os.path.basename(__file__)))
+    print()
+    print('Example:')
+    print('{:s} filter_trace.json features_trace.json force_learn_trace.json'.format(os.path.basename(__file__)))
+    exit(1)
+
+
+if __name__ == '__main__':
+    if '-h' in sys.argv or '--help' in sys.argv or len(sys.argv) < 2:
+        usage()
+
+    events = list()
+    for trace_file in sys.argv[1:]:
+        if not os.path.isfile(trace_file):
+            print('Trace file does not exist - {:s}'.format(trace_file))
+            usage()
+        events += instrumentation.read_trace(trace_file)
+
+    print(instrumentation.summary(events).to_string(float_format='{:.2f}'.format))
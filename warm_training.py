@@ -0,0 +1,118 @@
+import copy
+import time
+
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+from sklearn.linear_model import LinearRegression
+from sklearn.neural_network import MLPRegressor
+from sklearn.pipeline import Pipeline
+
+from sklearn.metrics.pairwise import rbf_kernel
+
+from regressors import as_target, uses_precomputed_kernel, rbf_gamma, precomputed_args, fit_svrs, predict_svrs, \
+    preprocessing, ApproximateKernelSVR, APPROXIMATE_SVR
+
+
+class WarmTrainer:
+    """Fits regressors of consecutive tasks reusing work done for previous ones
+
+    - preprocessing of biolab_utilities.prepare_pipeline is fitted once for the same train inputs (split, feature
+      set) and shared by all regressors and trajectories, inputs are the same as of pipelines fitted from scratch
+    - MLP of a given feature set and trajectory is warm-started from weights fitted on the previous split, its inputs
+      are transformed by preprocessing fitted on the first split of the chain, as the weights were fitted to them
+    - RBF kernel matrices of SVR are calculated once for the same train inputs and shared by all trajectories, train
+      kernel is included in fit time and test kernel in predict time of the first task using them, as in cold start
+
+    Tasks have to be given in order of splits, a single trainer is used for all tasks of a feature set.
+    """
+
+    def __init__(self):
+        self._scaled: Dict[Tuple, Tuple[Pipeline, np.ndarray, np.ndarray]] = dict()
+        self._kernels: Dict[Tuple, Tuple[float, np.ndarray]] = dict()
+        self._test_kernels: Dict[Tuple, np.ndarray] = dict()
+        self._mlps: Dict[Tuple, Tuple[Pipeline, MLPRegressor]] = dict()
+
+    def _scaled_inputs(self, input_key: Tuple, train_x: pd.DataFrame, train_y: pd.DataFrame, test_x: pd.DataFrame) \
+            -> Tuple[Pipeline, np.ndarray, np.ndarray]:
+        if input_key not in self._scaled:
+            # only inputs of the current split are kept, next split has different train data
+            self._scaled = {k: v for k, v in self._scaled.items() if k[0] == input_key[0]}
+            self._kernels = {k: v for k, v in self._kernels.items() if k[0] == input_key[0]}
+            self._test_kernels = {k: v for k, v in self._test_kernels.items() if k[0] == input_key[0]}
+
+            steps = preprocessing(train_x, train_y, norm_per_feature=False)
+            self._scaled[input_key] = steps, steps.transform(train_x), steps.transform(test_x)
+        return self._scaled[input_key]
+
+    def _train_kernel(self, input_key: Tuple, train: np.ndarray, gamma) -> Tuple[float, np.ndarray]:
+        """Returns gamma value and RBF Gram matrix of train samples"""
+        key = input_key + (gamma, )
+        if key not in self._kernels:
+            value = rbf_gamma(train, gamma)
+            self._kernels[key] = value, rbf_kernel(train, gamma=value)
+        return self._kernels[key]
+
+    def _test_kernel(self, input_key: Tuple, train: np.ndarray, test: np.ndarray, gamma) -> np.ndarray:
+        """Returns RBF kernel of test against train samples, train kernel has to be calculated first"""
+        key = input_key + (gamma, )
+        if key not in self._test_kernels:
+            self._test_kernels[key] = rbf_kernel(test, train, gamma=self._kernels[key][0])
+        return self._test_kernels[key]
+
+    def fit_and_predict(self, task: Dict[str, any], train_x: pd.DataFrame, train_y: pd.DataFrame,
+                        test_x: pd.DataFrame) -> Dict[str, any]:
+        """Fits task's regressor and predicts test data, returns prediction with fit and predict time"""
+        trajectory, split, feature_set, reg = task["key"]
+        predictor = task["reg_settings"]["predictor"]
+        args = dict(task["reg_settings"]["args"])
+
+        # train inputs are the same for all tasks of the same split and columns
+        input_key = (task["train_x"]["path"], str(task["input_columns"]))
+
+        start = time.time()
+        steps, train, test = self._scaled_inputs(input_key, train_x, train_y, test_x)
+        target = as_target(train_y)
+
+        if predictor == "MLPR":
+            chain = (feature_set, trajectory, reg)
+            if chain in self._mlps:
+                steps, previous = self._mlps[chain]
+                train, test = steps.transform(train_x), steps.transform(test_x)
+                regressor = copy.deepcopy(previous)
+                regressor.set_params(warm_start=True)
+            else:
+                regressor = MLPRegressor(**args)
+            regressor.fit(train, target)
+            self._mlps[chain] = steps, regressor
+            predict = regressor.predict
+        elif predictor == "SVR":
+            # multiple outputs are fitted one after another on shared kernel
+            if uses_precomputed_kernel(args, len(train)):
+                gamma = args.get("gamma", "scale")
+                svrs = fit_svrs(self._train_kernel(input_key, train, gamma)[1], target, precomputed_args(args))
+
+                def predict(x):
+                    return predict_svrs(svrs, self._test_kernel(input_key, train, x, gamma), target.ndim)
+            else:
+                svrs = fit_svrs(train, target, args)
+
+                def predict(x):
+                    return predict_svrs(svrs, x, target.ndim)
+        elif predictor == APPROXIMATE_SVR:
+            regressor = ApproximateKernelSVR(**args).fit(train, target)
+            predict = regressor.predict
+        elif predictor == "LR":
+            regressor = LinearRegression(**args).fit(train, target)
+            predict = regressor.predict
+        else:
+            raise ValueError('Warm start is not supported for predictor {:s}'.format(predictor))
+        elapsed_fit = time.time() - start
+
+        start = time.time()
+        test_y_pred = predict(test)
+        elapsed_predict = time.time() - start
+
+        return {"y_pred": test_y_pred, "fit_time": elapsed_fit, "predict_time": elapsed_predict}